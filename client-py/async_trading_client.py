@@ -0,0 +1,390 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional, Union
+
+import betterproto
+import websocket_api
+from codec import BetterprotoCodec, Codec, MarketDataDedup, peek
+from events import Events
+from metrics import Metrics
+from recording import RECEIVED, SENT, Recorder
+from throttle import Throttle, coalesce_cancels
+from trading_client import InitTimings, RequestFailed, State, quantize
+from websockets.asyncio.client import ClientConnection, connect
+from websockets.exceptions import ConnectionClosed
+from websockets.frames import CloseCode
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncTradingClient:
+    """
+    Asyncio client for interacting with the exchange server.
+
+    A single reader task owns the socket: it applies every message to the state and
+    resolves the pending request with the matching request_id, so any number of
+    requests can be in flight at once.
+
+    `events` holds callbacks fired by the reader task after each message is applied
+    to the state; they are plain functions, so to make requests from one, start a
+    task with `asyncio.create_task`.
+    """
+
+    _ws: ClientConnection
+    _state: State
+    _pending: Dict[str, "asyncio.Future[websocket_api.ServerMessage]"]
+    _reader: "asyncio.Task[None]"
+
+    def __init__(
+        self,
+        ws: ClientConnection,
+        codec: Optional[Codec] = None,
+        throttle: Union[Throttle, bool] = False,
+        dedup_market_data: bool = False,
+        recording: Union[str, Recorder, None] = None,
+    ):
+        """
+        Use `AsyncTradingClient.connect` rather than calling this directly.
+        """
+        self._ws = ws
+        self.events = Events()
+        if throttle is True:
+            throttle = Throttle()
+        self.throttle: Optional[Throttle] = throttle or None
+        self._metrics = Metrics()
+        self._dedup = MarketDataDedup() if dedup_market_data else None
+        self._owns_recorder = isinstance(recording, str)
+        self._recorder = (
+            Recorder(recording) if isinstance(recording, str) else recording
+        )
+        self._codec = codec if codec is not None else BetterprotoCodec()
+        self._state = State()
+        self._pending = {}
+        self._market_waiters: Dict[
+            int, List["asyncio.Future[websocket_api.Market]"]
+        ] = {}
+        self._initialized = asyncio.get_running_loop().create_future()
+        self._reader = asyncio.create_task(self._read_forever())
+
+    @classmethod
+    async def connect(
+        cls,
+        api_url: str,
+        jwt: str,
+        act_as: str,
+        *,
+        codec: Optional[Codec] = None,
+        wait_for_init: bool = True,
+        throttle: Union[Throttle, bool] = False,
+        dedup_market_data: bool = False,
+        recording: Union[str, Recorder, None] = None,
+    ) -> "AsyncTradingClient":
+        """
+        Connect, Authenticate, then make sure all of the messages holding initial state
+        have been received.
+
+        `codec` decodes and encodes frames, `throttle` (off by default) paces
+        messages to stay within the server's rate limits, `dedup_market_data` drops
+        repeated MarketData frames and `recording` records every frame, see
+        `TradingClient`.
+
+        With `wait_for_init=False`, this returns as soon as Authenticate is sent; use
+        `market_ready` or `wait_for_markets` to wait for the markets you need.
+        """
+        timings = InitTimings()
+        client = cls(
+            await connect(api_url), codec, throttle, dedup_market_data, recording
+        )
+        client._state.init_timings = timings
+        timings._record("connected")
+        try:
+            authenticate = websocket_api.Authenticate(jwt=jwt, act_as=act_as)
+            await client.send(websocket_api.ClientMessage(authenticate=authenticate))
+            if wait_for_init:
+                await client._initialized
+        except BaseException:
+            await client.close(CloseCode.INTERNAL_ERROR)
+            raise
+        return client
+
+    def state(self) -> State:
+        """
+        Return the up-to-date state of the client.
+        The reader task applies messages as they arrive, so this never touches the
+        socket.
+        """
+        return self._state
+
+    async def market_ready(self, market_id: int) -> websocket_api.Market:
+        """
+        Wait until the state holds a market, for use with `wait_for_init=False`.
+        Raises KeyError if initialization finishes without it.
+        """
+        market = self._state.markets.get(market_id)
+        if market is not None:
+            return market
+        if self._initialized.done():
+            self._initialized.result()
+            raise KeyError(f"Market {market_id} not found")
+        future = asyncio.get_running_loop().create_future()
+        self._market_waiters.setdefault(market_id, []).append(future)
+        return await future
+
+    async def wait_for_markets(
+        self, market_ids: Iterable[int]
+    ) -> Dict[int, websocket_api.Market]:
+        """
+        Wait until the state holds all of the given markets, see `market_ready`.
+        """
+        market_ids = list(market_ids)
+        markets = await asyncio.gather(*map(self.market_ready, market_ids))
+        return dict(zip(market_ids, markets))
+
+    async def create_order(
+        self,
+        market_id: int,
+        price: float,
+        size: float,
+        side: websocket_api.Side,
+    ) -> websocket_api.OrderCreated:
+        """
+        Place an order on the exchange.
+        Note that if price and size are passed as float or Decimal they will be
+        quantized.
+        """
+        msg = websocket_api.ClientMessage(
+            create_order=websocket_api.CreateOrder(
+                market_id=market_id,
+                price=quantize(price, "Price"),
+                size=quantize(size, "Size"),
+                side=side,
+            ),
+        )
+        response = await self.request(msg)
+        _, message = betterproto.which_one_of(response, "message")
+        assert isinstance(message, websocket_api.OrderCreated)
+        return message
+
+    async def cancel_order(self, order_id: int) -> websocket_api.OrderCancelled:
+        """
+        Cancel an order on the exchange.
+        """
+        msg = websocket_api.ClientMessage(
+            cancel_order=websocket_api.CancelOrder(
+                id=order_id,
+            ),
+        )
+        response = await self.request(msg)
+        _, message = betterproto.which_one_of(response, "message")
+        assert isinstance(message, websocket_api.OrderCancelled)
+        return message
+
+    async def out(self, market_id: int) -> websocket_api.Out:
+        """
+        Cancel all orders for a market.
+        """
+        msg = websocket_api.ClientMessage(
+            out=websocket_api.Out(
+                market_id=market_id,
+            ),
+        )
+        response = await self.request(msg)
+        _, message = betterproto.which_one_of(response, "message")
+        assert isinstance(message, websocket_api.Out)
+        return message
+
+    async def redeem(self, fund_id: int, amount: float) -> websocket_api.Redeemed:
+        """
+        Redeem a position in a market.
+        Note that if amount is passed as float or Decimal it will be quantized.
+        """
+        msg = websocket_api.ClientMessage(
+            redeem=websocket_api.Redeem(
+                fund_id=fund_id,
+                amount=quantize(amount, "Amount"),
+            ),
+        )
+        response = await self.request(msg)
+        _, message = betterproto.which_one_of(response, "message")
+        assert isinstance(message, websocket_api.Redeemed)
+        return message
+
+    def metrics(self) -> Metrics:
+        """
+        Request round-trip latencies and the time spent decoding and applying frames,
+        see `TradingClient.metrics`.
+        """
+        return self._metrics
+
+    async def request(
+        self, message: websocket_api.ClientMessage
+    ) -> websocket_api.ServerMessage:
+        """
+        Send a message to the server and wait for a response.
+        """
+        if not message.request_id:
+            message.request_id = str(uuid.uuid4())
+        future = asyncio.get_running_loop().create_future()
+        self._pending[message.request_id] = future
+        try:
+            await self.send(message)
+            return await future
+        finally:
+            self._pending.pop(message.request_id, None)
+            self._metrics._abandon(message.request_id)
+
+    async def request_many(
+        self, messages: List[websocket_api.ClientMessage]
+    ) -> List[websocket_api.ServerMessage]:
+        """
+        Send a list of messages to the server and wait for responses.
+        All of the messages are in flight at the same time, except that with the
+        throttle, repeated cancels of an order are sent once and share its response.
+        """
+        if self.throttle is None:
+            return list(await asyncio.gather(*(self.request(msg) for msg in messages)))
+        send, duplicates = coalesce_cancels(messages)
+        responses = await asyncio.gather(*(self.request(messages[i]) for i in send))
+        results = dict(zip(send, responses))
+        for i, first in duplicates.items():
+            results[i] = results[first]
+        return [results[i] for i in range(len(messages))]
+
+    async def close(self, code: int = CloseCode.NORMAL_CLOSURE, reason: str = ""):
+        """
+        Close the connection to the server.
+        """
+        await self._ws.close(code, reason)
+        await asyncio.gather(self._reader, return_exceptions=True)
+        if self._recorder is not None:
+            if self._owns_recorder:
+                self._recorder.close()
+            else:
+                self._recorder.flush()
+
+    async def send(self, message: websocket_api.ClientMessage):
+        """
+        Send a message to the server, first waiting for the throttle if it's enabled.
+        """
+        if self.throttle is not None:
+            delay = self.throttle.reserve(message)
+            if delay:
+                await asyncio.sleep(delay)
+        if message.request_id in self._pending:
+            self._metrics._sent(message)
+        if betterproto.which_one_of(message, "message")[0] == "act_as":
+            self._state._act_as_sent()
+        frame = self._codec.encode(message)
+        if self._recorder is not None:
+            self._recorder.record(SENT, frame)
+        await self._ws.send(frame)
+
+    async def _read_forever(self):
+        """
+        Apply every message from the server to the state and resolve whichever
+        request it is the response to.
+        """
+        error: BaseException
+        try:
+            async for message in self._ws:
+                assert isinstance(message, bytes)
+                if self._recorder is not None:
+                    self._recorder.record(RECEIVED, message)
+                started = time.perf_counter_ns()
+                if self._dedup is not None:
+                    peeked = peek(message)
+                    if (
+                        peeked.request_id not in self._pending
+                        and not self._state.resyncs.active
+                    ):
+                        decode_ns = self._dedup.repeat(message, peeked)
+                        if decode_ns is not None:
+                            self._metrics._repeated(len(message), decode_ns)
+                            continue
+                decoded = self._codec.decode(message)
+                applying = time.perf_counter_ns()
+                self._state._update(decoded)
+                self.events._dispatch(decoded, self._state.books)
+                if self._dedup is not None:
+                    self._dedup.applied(message, peeked, applying - started)
+                self._metrics._frame(
+                    decoded, applying - started, time.perf_counter_ns() - applying
+                )
+                self._dispatch(decoded)
+            error = ConnectionError("Connection closed by the server")
+        except ConnectionClosed as e:
+            error = e
+        except Exception as e:
+            logger.exception("Error in the reader task")
+            error = e
+        if not self._initialized.done():
+            self._initialized.set_exception(error)
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self._wake_market_waiters(None, error)
+
+    def _dispatch(self, server_message: websocket_api.ServerMessage):
+        _, message = betterproto.which_one_of(server_message, "message")
+        if (
+            isinstance(message, websocket_api.RequestFailed)
+            and self.throttle is not None
+        ):
+            self.throttle._rate_limited(message)
+        if not self._initialized.done():
+            if isinstance(message, websocket_api.RequestFailed):
+                # A request someone is awaiting fails on its own, not the whole init
+                if server_message.request_id not in self._pending:
+                    self._initialized.set_exception(
+                        RuntimeError(
+                            f"{message.request_details.kind} request failed during"
+                            f" initialization: {message.error_details.message}"
+                        )
+                    )
+            elif not self._state._initializing:
+                self._initialized.set_result(None)
+        if self._market_waiters:
+            self._wake_market_waiters(message)
+        future = self._pending.get(server_message.request_id)
+        if future is None or future.done():
+            return
+        if isinstance(message, websocket_api.RequestFailed):
+            future.set_exception(
+                RequestFailed(
+                    f"{message.request_details.kind} request failed:"
+                    f" {message.error_details.message}"
+                )
+            )
+        else:
+            future.set_result(server_message)
+
+    def _wake_market_waiters(
+        self, message: object, error: Optional[BaseException] = None
+    ):
+        if isinstance(message, websocket_api.Market):
+            for future in self._market_waiters.pop(message.id, ()):
+                if not future.done():
+                    future.set_result(self._state.markets[message.id])
+        if error is None:
+            if not self._initialized.done():
+                return
+            error = self._initialized.exception()
+        # Initialization is over, so whichever markets are still awaited don't exist
+        for market_id, futures in self._market_waiters.items():
+            for future in futures:
+                if not future.done():
+                    future.set_exception(
+                        error or KeyError(f"Market {market_id} not found")
+                    )
+        self._market_waiters.clear()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            await self.close()
+        else:
+            await self.close(CloseCode.INTERNAL_ERROR)
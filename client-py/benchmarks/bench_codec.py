@@ -0,0 +1,206 @@
+"""
+Throughput of each codec in `codec.CODECS` on a synthetic session.
+
+The session looks like what a bot sees on a busy exchange: the initialization
+sequence (users, then a snapshot of every market with resting orders and trades),
+followed by a stream of OrderCreated (some of them sweeping the book, with fills and
+trades) and OrderCancelled messages. Each codec decodes every frame, once on its own
+and once followed by `State._update`.
+
+    python benchmarks/bench_codec.py --markets 20 --messages 20000
+
+With `--recording`, the frames received in a recording made with
+`TradingClient(recording=...)` are used instead of the synthetic session.
+
+    python benchmarks/bench_codec.py --recording recordings/
+"""
+
+import os
+import random
+import sys
+import time
+from typing import List, Optional
+
+import typer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import websocket_api  # noqa: E402
+from codec import CODECS, Codec  # noqa: E402
+from recording import RECEIVED, read  # noqa: E402
+from trading_client import State  # noqa: E402
+from websocket_api import Side  # noqa: E402
+
+app = typer.Typer(pretty_exceptions_show_locals=False)
+
+
+def session(
+    markets: int, orders_per_market: int, messages: int, seed: int
+) -> List[bytes]:
+    rng = random.Random(seed)
+    users = [f"user-{i:03}" for i in range(50)]
+    frames = [
+        bytes(
+            websocket_api.ServerMessage(
+                users=websocket_api.Users(
+                    users=[websocket_api.User(id=user, name=user) for user in users]
+                )
+            )
+        )
+    ]
+    next_id = 1
+    resting: List[List[websocket_api.Order]] = []
+    for market_id in range(1, markets + 1):
+        orders = []
+        for _ in range(orders_per_market):
+            side = rng.choice((Side.BID, Side.OFFER))
+            offset = rng.randint(1, 200) / 100
+            orders.append(
+                websocket_api.Order(
+                    id=next_id,
+                    market_id=market_id,
+                    owner_id=rng.choice(users),
+                    transaction_id=next_id,
+                    price=50 - offset if side == Side.BID else 50 + offset,
+                    size=rng.randint(1, 100) / 10,
+                    side=side,
+                )
+            )
+            next_id += 1
+        trades = [
+            websocket_api.Trade(
+                id=i,
+                market_id=market_id,
+                transaction_id=i,
+                price=50 + rng.randint(-100, 100) / 100,
+                size=rng.randint(1, 100) / 10,
+                buyer_id=rng.choice(users),
+                seller_id=rng.choice(users),
+            )
+            for i in range(orders_per_market)
+        ]
+        market = websocket_api.Market(
+            id=market_id,
+            name=f"market-{market_id}",
+            owner_id=users[0],
+            min_settlement=0,
+            max_settlement=100,
+            open=websocket_api.MarketOpen(),
+            orders=orders,
+            trades=trades,
+            has_full_history=True,
+        )
+        frames.append(bytes(websocket_api.ServerMessage(market_data=market)))
+        resting.append(orders)
+
+    for _ in range(messages):
+        i = rng.randrange(markets)
+        market_id = i + 1
+        orders = resting[i]
+        roll = rng.random()
+        if roll < 0.4 and orders:
+            order = orders.pop(rng.randrange(len(orders)))
+            message = websocket_api.ServerMessage(
+                order_cancelled=websocket_api.OrderCancelled(
+                    id=order.id, market_id=market_id
+                )
+            )
+        else:
+            side = rng.choice((Side.BID, Side.OFFER))
+            sweep = roll > 0.85
+            opposite = [order for order in orders if order.side != side][:3]
+            taken = opposite if sweep else []
+            for order in taken:
+                orders.remove(order)
+            offset = rng.randint(1, 200) / 100
+            order = websocket_api.Order(
+                id=next_id,
+                market_id=market_id,
+                owner_id=rng.choice(users),
+                transaction_id=next_id,
+                price=50 - offset if side == Side.BID else 50 + offset,
+                size=rng.randint(1, 100) / 10,
+                side=side,
+            )
+            next_id += 1
+            orders.append(order)
+            message = websocket_api.ServerMessage(
+                request_id=str(next_id),
+                order_created=websocket_api.OrderCreated(
+                    market_id=market_id,
+                    user_id=order.owner_id,
+                    order=order,
+                    fills=[
+                        websocket_api.OrderCreatedOrderFill(
+                            id=fill.id,
+                            market_id=market_id,
+                            owner_id=fill.owner_id,
+                            size_filled=fill.size,
+                            size_remaining=0.0,
+                            price=fill.price,
+                            side=fill.side,
+                        )
+                        for fill in taken
+                    ],
+                    trades=[
+                        websocket_api.Trade(
+                            id=next_id * 10 + j,
+                            market_id=market_id,
+                            transaction_id=next_id,
+                            price=fill.price,
+                            size=fill.size,
+                            buyer_id=order.owner_id,
+                            seller_id=fill.owner_id,
+                        )
+                        for j, fill in enumerate(taken)
+                    ],
+                ),
+            )
+        frames.append(bytes(message))
+    frames.append(
+        bytes(
+            websocket_api.ServerMessage(
+                acting_as=websocket_api.ActingAs(user_id=users[0])
+            )
+        )
+    )
+    return frames
+
+
+def messages_per_second(codec: Codec, frames: List[bytes], apply: bool) -> float:
+    start = time.perf_counter()
+    if apply:
+        state = State()
+        for frame in frames:
+            state._update(codec.decode(frame))
+    else:
+        for frame in frames:
+            codec.decode(frame)
+    return len(frames) / (time.perf_counter() - start)
+
+
+@app.command()
+def main(
+    markets: int = 20,
+    orders: int = 200,
+    messages: int = 20_000,
+    repeat: int = 3,
+    seed: int = 0,
+    recording: Optional[str] = None,
+):
+    if recording is not None:
+        frames = [bytes(frame.data) for frame in read(recording, RECEIVED)]
+    else:
+        frames = session(markets, orders, messages, seed)
+    size = sum(len(frame) for frame in frames)
+    print(f"{len(frames)} frames, {size / 1e6:.1f} MB")
+    print(f"  {'codec':<12} {'decode msg/s':>14} {'+ state msg/s':>14}")
+    for name, codec_cls in CODECS.items():
+        codec = codec_cls()
+        decode = max(messages_per_second(codec, frames, False) for _ in range(repeat))
+        applied = max(messages_per_second(codec, frames, True) for _ in range(repeat))
+        print(f"  {name:<12} {decode:>14,.0f} {applied:>14,.0f}")
+
+
+if __name__ == "__main__":
+    app()
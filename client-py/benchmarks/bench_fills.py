@@ -0,0 +1,158 @@
+"""
+Microbenchmark for applying OrderCreated fills to a deep book.
+
+Compares the original list-based `State._update` (scan every resting order for a
+matching fill, then rebuild the list) with the current one, which goes through the
+order-id index of the market's OrderBook.
+
+    python benchmarks/bench_fills.py --orders 10000 --fills 20
+"""
+
+import os
+import sys
+import time
+from typing import Callable, List
+
+import typer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import websocket_api  # noqa: E402
+from trading_client import State  # noqa: E402
+from websocket_api import Side  # noqa: E402
+
+app = typer.Typer(pretty_exceptions_show_locals=False)
+
+
+def resting_orders(market_id: int, count: int) -> List[websocket_api.Order]:
+    """
+    Half bids below 50 and half offers above it, a few orders per cent of price.
+    """
+    orders = []
+    for i in range(count):
+        side = Side.BID if i % 2 == 0 else Side.OFFER
+        level = (i // 2) // 4 + 1
+        price = 50 - level * 0.01 if side == Side.BID else 50 + level * 0.01
+        orders.append(
+            websocket_api.Order(
+                id=i + 1,
+                market_id=market_id,
+                owner_id="maker",
+                price=round(price, 2),
+                size=1.0,
+                side=side,
+            )
+        )
+    return orders
+
+
+def sweeps(
+    orders: List[websocket_api.Order], rounds: int, fills: int
+) -> List[websocket_api.ServerMessage]:
+    """
+    Aggressive bids that each take out the next `fills` best offers.
+    """
+    offers = sorted(
+        (order for order in orders if order.side == Side.OFFER),
+        key=lambda order: (order.price, order.id),
+    )
+    messages = []
+    for r in range(rounds):
+        taken = offers[r * fills : (r + 1) * fills]
+        messages.append(
+            websocket_api.ServerMessage(
+                order_created=websocket_api.OrderCreated(
+                    market_id=1,
+                    user_id="taker",
+                    fills=[
+                        websocket_api.OrderCreatedOrderFill(
+                            id=order.id,
+                            market_id=1,
+                            owner_id=order.owner_id,
+                            size_filled=order.size,
+                            size_remaining=0.0,
+                            price=order.price,
+                            side=Side.OFFER,
+                        )
+                        for order in taken
+                    ],
+                )
+            )
+        )
+    return messages
+
+
+def apply_by_scan(state: State, server_message: websocket_api.ServerMessage):
+    """
+    The original list-based handling of OrderCreated, kept here for comparison.
+    """
+    message = server_message.order_created
+    orders = state.markets[message.market_id].orders
+    if message.order.id:
+        orders.append(message.order)
+    if message.fills:
+        for order in orders:
+            if fill := next(
+                (fill for fill in message.fills if fill.id == order.id),
+                None,
+            ):
+                order.size = fill.size_remaining
+        state.markets[message.market_id].orders = [
+            order for order in orders if float(order.size) > 0
+        ]
+
+
+def fresh_state(order_count: int, indexed: bool) -> State:
+    orders = resting_orders(1, order_count)
+    market = websocket_api.Market(id=1, name="bench", orders=orders)
+    state = State()
+    if indexed:
+        state._update(websocket_api.ServerMessage(market_data=market))
+    else:
+        state.markets[1] = market
+    return state
+
+
+def time_per_message(
+    apply: Callable[[State, websocket_api.ServerMessage], None],
+    order_count: int,
+    indexed: bool,
+    rounds: int,
+    fills: int,
+    repeat: int,
+) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        state = fresh_state(order_count, indexed)
+        messages = sweeps(list(state.markets[1].orders), rounds, fills)
+        start = time.perf_counter()
+        for message in messages:
+            apply(state, message)
+        best = min(best, (time.perf_counter() - start) / rounds)
+    return best
+
+
+@app.command()
+def main(
+    orders: int = 10_000,
+    fills: int = 20,
+    rounds: int = 50,
+    repeat: int = 5,
+):
+    scan = time_per_message(apply_by_scan, orders, False, rounds, fills, repeat)
+    indexed = time_per_message(
+        lambda state, message: state._update(message),
+        orders,
+        True,
+        rounds,
+        fills,
+        repeat,
+    )
+    print(f"{orders} resting orders, {fills} fills per OrderCreated")
+    print(f"  list scan:     {scan * 1e6:10.1f} us/message")
+    print(f"  order index:   {indexed * 1e6:10.1f} us/message")
+    print(f"  speedup:       {scan / indexed:10.1f}x")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,445 @@
+"""
+Benchmarks of the client's hot paths, with baselines to catch regressions.
+
+Covers decoding each kind of `ServerMessage` with every codec, `State._update` of
+each kind of message on books of 100, 10k and 100k resting orders, correlating the
+responses of `request_many`, the `quantz` arbitrage helpers (`Arbsket.best_price`
+and `calculate_size`) and the quoting step of `market_maker_bot`. Fixtures are
+synthetic, shaped like a busy exchange, and the same on every run.
+
+    python benchmarks/bench_suite.py --save benchmarks/baseline.json
+    python benchmarks/bench_suite.py --compare benchmarks/baseline.json
+
+With `--compare`, each case is shown next to its baseline and the run fails if any
+is slower by more than `--tolerance`. Baselines only compare on the same machine:
+save one before a change and compare after it.
+"""
+
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+import typer
+
+CLIENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CLIENT_DIR)
+
+import websocket_api  # noqa: E402
+from bench_fills import resting_orders  # noqa: E402
+from codec import CODECS  # noqa: E402
+from recording import RECEIVED, Recorder  # noqa: E402
+from replay import ReplayClient  # noqa: E402
+from trading_client import State  # noqa: E402
+from websocket_api import Side  # noqa: E402
+
+app = typer.Typer(pretty_exceptions_show_locals=False)
+
+BOOK_SIZES = (100, 10_000, 100_000)
+ARB_MARKETS = ("high", "low", "sum")
+
+
+@dataclass
+class Case:
+    name: str
+    run: Callable[[], None]
+    ops: int = 1
+    """
+    Operations done by each call of `run`, e.g. messages applied.
+    """
+
+
+def measure(case: Case, min_seconds: float, repeat: int) -> float:
+    """
+    Best time per operation in ns over `repeat` rounds, each long enough to time.
+    """
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            case.run()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds / 10 or number >= 1 << 20:
+            break
+        number *= 2
+    number = max(1, int(number * min_seconds / max(elapsed, 1e-9)))
+    best = elapsed / number
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            case.run()
+        best = min(best, (time.perf_counter() - started) / number)
+    return best / case.ops * 1e9
+
+
+def book_state(order_count: int) -> State:
+    state = State()
+    state._update(
+        websocket_api.ServerMessage(acting_as=websocket_api.ActingAs(user_id="maker"))
+    )
+    state._update(
+        websocket_api.ServerMessage(
+            market_data=websocket_api.Market(
+                id=1,
+                name="bench",
+                min_settlement=0,
+                max_settlement=100,
+                open=websocket_api.MarketOpen(),
+                orders=resting_orders(1, order_count),
+            )
+        )
+    )
+    return state
+
+
+def order_created(
+    order_id: int, owner_id: str, price: float, side: Side
+) -> websocket_api.ServerMessage:
+    return websocket_api.ServerMessage(
+        order_created=websocket_api.OrderCreated(
+            market_id=1,
+            user_id=owner_id,
+            order=websocket_api.Order(
+                id=order_id,
+                market_id=1,
+                owner_id=owner_id,
+                transaction_id=order_id,
+                price=price,
+                size=1.0,
+                side=side,
+            ),
+        )
+    )
+
+
+def fill_of(order: websocket_api.Order) -> websocket_api.ServerMessage:
+    """
+    A taker's order, fully filled against `order`.
+    """
+    return websocket_api.ServerMessage(
+        order_created=websocket_api.OrderCreated(
+            market_id=1,
+            user_id="taker",
+            fills=[
+                websocket_api.OrderCreatedOrderFill(
+                    id=order.id,
+                    market_id=1,
+                    owner_id=order.owner_id,
+                    size_filled=order.size,
+                    size_remaining=0.0,
+                    price=order.price,
+                    side=order.side,
+                )
+            ],
+            trades=[
+                websocket_api.Trade(
+                    id=order.id,
+                    market_id=1,
+                    transaction_id=order.id,
+                    price=order.price,
+                    size=order.size,
+                    buyer_id="taker",
+                    seller_id=order.owner_id,
+                )
+            ],
+        )
+    )
+
+
+def apply_all(state: State, messages: List[websocket_api.ServerMessage]):
+    def run():
+        for message in messages:
+            state._update(message)
+
+    return run
+
+
+def update_cases() -> List[Case]:
+    """
+    `State._update` of each kind of message on books of each size. Each case
+    applies messages that leave the book as it was, so it can run any number of
+    times.
+    """
+    cases = []
+    for size in BOOK_SIZES:
+        state = book_state(size)
+        market = state.markets[1]
+        new_id = size + 1
+        rest_and_cancel = [
+            order_created(new_id, "maker", 49.99, Side.BID),
+            websocket_api.ServerMessage(
+                order_cancelled=websocket_api.OrderCancelled(id=new_id, market_id=1)
+            ),
+        ]
+        cases.append(
+            Case(
+                f"update/order_created+cancelled/{size}",
+                apply_all(state, rest_and_cancel),
+                ops=2,
+            )
+        )
+        rest = order_created(new_id, "maker", 49.99, Side.OFFER)
+        cases.append(
+            Case(
+                f"update/order_created+fill/{size}",
+                apply_all(state, [rest, fill_of(rest.order_created.order)]),
+                ops=2,
+            )
+        )
+        snapshot = websocket_api.ServerMessage(market_data=market)
+        cases.append(Case(f"update/market_data/{size}", apply_all(state, [snapshot])))
+    return cases
+
+
+def frames() -> Dict[str, bytes]:
+    orders = resting_orders(1, 1000)
+    fills = bytes(fill_of(orders[1]))
+    return {
+        "order_created": bytes(order_created(1, "maker", 49.99, Side.BID)),
+        "order_created_fill": fills,
+        "order_cancelled": bytes(
+            websocket_api.ServerMessage(
+                order_cancelled=websocket_api.OrderCancelled(id=1, market_id=1)
+            )
+        ),
+        "market_data_1k": bytes(
+            websocket_api.ServerMessage(
+                market_data=websocket_api.Market(
+                    id=1, name="bench", open=websocket_api.MarketOpen(), orders=orders
+                )
+            )
+        ),
+        "portfolio": bytes(
+            websocket_api.ServerMessage(
+                portfolio=websocket_api.Portfolio(
+                    total_balance=1000,
+                    available_balance=900,
+                    market_exposures=[
+                        websocket_api.PortfolioMarketExposure(
+                            market_id=i,
+                            position=i,
+                            total_bid_size=1,
+                            total_bid_value=50,
+                        )
+                        for i in range(10)
+                    ],
+                )
+            )
+        ),
+    }
+
+
+def parse_cases() -> List[Case]:
+    cases = []
+    for kind, frame in frames().items():
+        for name, codec_cls in CODECS.items():
+            decode = codec_cls().decode
+            cases.append(
+                Case(
+                    f"parse/{name}/{kind}",
+                    lambda decode=decode, frame=frame: decode(frame),
+                )
+            )
+    return cases
+
+
+def request_many_case(directory: str) -> Case:
+    """
+    `request_many` of ten orders and an `out` through a `ReplayClient`, which
+    answers locally, so what's measured is the client: sending, correlating the
+    responses and applying them.
+    """
+    with Recorder(directory) as recorder:
+        for message in (
+            websocket_api.ServerMessage(
+                users=websocket_api.Users(
+                    users=[websocket_api.User(id="me", name="me")]
+                )
+            ),
+            websocket_api.ServerMessage(
+                market_data=websocket_api.Market(
+                    id=1,
+                    name="bench",
+                    open=websocket_api.MarketOpen(),
+                    orders=resting_orders(1, 1000),
+                )
+            ),
+            websocket_api.ServerMessage(acting_as=websocket_api.ActingAs(user_id="me")),
+        ):
+            recorder.record(RECEIVED, bytes(message))
+    client = ReplayClient(directory)
+    messages = [
+        websocket_api.ClientMessage(
+            create_order=websocket_api.CreateOrder(
+                market_id=1, price=40 + i, size=1, side=Side.BID
+            )
+        )
+        for i in range(10)
+    ] + [websocket_api.ClientMessage(out=websocket_api.Out(market_id=1))]
+
+    def run():
+        for message in messages:
+            message.request_id = ""
+        client.request_many(messages)
+
+    return Case("request_many/10+out", run, ops=len(messages))
+
+
+class _StateOnly:
+    """
+    Just enough of a `TradingClient` for the `quantz` helpers, which only read the
+    state.
+    """
+
+    def __init__(self, state: State):
+        self._state = state
+
+    def state(self) -> State:
+        return self._state
+
+
+def import_quantz_config():
+    """
+    Put `quantz` on the path and import its `config`, which reads `config.toml`
+    from the working directory on import, from a throwaway one: nothing here
+    connects.
+    """
+    sys.path.insert(0, os.path.join(CLIENT_DIR, "quantz"))
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "config.toml"), "w") as f:
+            f.write('[api]\nurl = "ws://localhost:8080"\njwt = ""\nact_as = ""\n')
+        os.chdir(directory)
+        try:
+            import config  # noqa: F401
+        finally:
+            os.chdir(cwd)
+
+
+def arb_cases() -> List[Case]:
+    import_quantz_config()
+    from arb import Arbmark, Arbsket, Arbval, RelationSet, calculate_size, size_by_depth
+
+    state = State()
+    for market_id, name in enumerate(ARB_MARKETS, start=1):
+        state._update(
+            websocket_api.ServerMessage(
+                market_data=websocket_api.Market(
+                    id=market_id,
+                    name=name,
+                    open=websocket_api.MarketOpen(),
+                    orders=resting_orders(market_id, 10_000),
+                )
+            )
+        )
+    client = _StateOnly(state)
+    left = Arbsket(
+        [Arbmark(client, "high", Side.OFFER), Arbmark(client, "low", Side.OFFER)]
+    )
+    right = Arbsket([Arbmark(client, "sum", Side.BID)])
+    high, low, total = (Arbmark(client, name, Side.OFFER) for name in ARB_MARKETS)
+    relations = RelationSet(
+        [
+            (left, right),
+            (Arbsket([high, -low]), Arbsket([total, Arbval(-100, Side.BID)])),
+        ]
+        * 150
+    )
+    return [
+        Case("arb/arbsket_best_price", left.best_price),
+        Case("arb/calculate_size", lambda: calculate_size(left, right)),
+        Case("arb/size_by_depth/10000", lambda: size_by_depth(left, right)),
+        Case(
+            f"arb/relation_set_edges/{len(relations)}",
+            lambda: relations.edges(state),
+            ops=len(relations),
+        ),
+    ]
+
+
+def quote_case() -> Case:
+    from market_maker_bot import logger, quote
+
+    logger.setLevel(logging.WARNING)
+    state = book_state(10_000)
+    for i in range(5):
+        state._update(order_created(10**6 + i, "maker", 45 - i, Side.BID))
+    return Case(
+        "market_maker/quote/10000",
+        lambda: quote(state, 1, spread=1.0, size=1.0, fade_per_order=1.0),
+    )
+
+
+def format_ns(ns: float) -> str:
+    if ns >= 1e6:
+        return f"{ns / 1e6:.2f} ms"
+    if ns >= 1e3:
+        return f"{ns / 1e3:.2f} us"
+    return f"{ns:.0f} ns"
+
+
+@app.command()
+def main(
+    only: Optional[str] = typer.Option(None, help="Run the cases containing this"),
+    min_seconds: float = 0.2,
+    repeat: int = 3,
+    save: Optional[str] = typer.Option(None, help="Write the results as a baseline"),
+    compare: Optional[str] = typer.Option(None, help="Compare with a saved baseline"),
+    tolerance: float = 0.2,
+):
+    """
+    Time every case, optionally saving or comparing against a baseline.
+    """
+    baseline: Dict[str, float] = {}
+    if compare is not None:
+        with open(compare) as f:
+            baseline = json.load(f)["ns_per_op"]
+    with tempfile.TemporaryDirectory() as directory:
+        cases = (
+            parse_cases()
+            + update_cases()
+            + [request_many_case(directory)]
+            + arb_cases()
+            + [quote_case()]
+        )
+        results: Dict[str, float] = {}
+        regressions = []
+        for case in cases:
+            if only is not None and only not in case.name:
+                continue
+            ns = measure(case, min_seconds, repeat)
+            results[case.name] = round(ns, 1)
+            line = f"  {case.name:<44} {format_ns(ns):>10}/op"
+            before = baseline.get(case.name)
+            if before is not None:
+                change = ns / before - 1
+                line += f" {format_ns(before):>10} {change:>+7.1%}"
+                if change > tolerance:
+                    line += "  REGRESSION"
+                    regressions.append(case.name)
+            print(line)
+    if save is not None:
+        with open(save, "w") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "processor": platform.processor(),
+                    "ns_per_op": results,
+                },
+                f,
+                indent=2,
+            )
+            f.write("\n")
+    if regressions:
+        print(f"{len(regressions)} cases regressed by more than {tolerance:.0%}")
+        raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,139 @@
+import threading
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import websocket_api
+from throttle import Throttle
+from trading_client import RequestFailed, State, TradingClient
+
+
+class ClientPool:
+    """
+    One long-lived connection per account, opened on first use, with a single copy
+    of the public market data.
+
+    The first connection (or `public`, if given) keeps the full state. The others
+    are opened with `watch_markets=()`, so the server's market data is skipped on
+    them without being decoded and their state only holds what is private to the
+    account: its portfolio, payments and so on. Read markets from `state()` and
+    each account's portfolio from `portfolio(name)`.
+
+    With `throttle=True`, accounts sharing a JWT share a `Throttle`, since the
+    server's rate limits are per authenticated user.
+    """
+
+    def __init__(
+        self,
+        api_url: str,
+        *,
+        public: Optional[TradingClient] = None,
+        **client_options: Any,
+    ):
+        """
+        `client_options` are passed to each `TradingClient` the pool opens.
+        """
+        self._api_url = api_url
+        self._public = public
+        self._client_options = client_options
+        self._accounts: Dict[str, Tuple[str, str]] = {}
+        self._clients: Dict[str, TradingClient] = {}
+        self._throttles: Dict[str, Throttle] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, jwt: str, act_as: str):
+        """
+        Register an account, to be connected the first time it's used.
+        """
+        if name in self._accounts and self._accounts[name] != (jwt, act_as):
+            raise ValueError(f"Account {name!r} is already registered")
+        self._accounts[name] = (jwt, act_as)
+
+    def __getitem__(self, name: str) -> TradingClient:
+        """
+        The connection for an account, opening it if needed.
+        """
+        client = self._clients.get(name)
+        if client is not None:
+            return client
+        if name not in self._accounts:
+            raise KeyError(f"Account {name!r} is not registered")
+        with self._lock:
+            client = self._clients.get(name)
+            if client is None:
+                client = self._clients[name] = self._connect(*self._accounts[name])
+            return client
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._accounts
+
+    @property
+    def connected(self) -> List[str]:
+        """
+        Names of the accounts with an open connection.
+        """
+        return list(self._clients)
+
+    def state(self) -> State:
+        """
+        The state holding the public market data, connecting the first registered
+        account if nothing is connected yet.
+        """
+        if self._public is None:
+            if not self._accounts:
+                raise RuntimeError("No accounts registered")
+            self[next(iter(self._accounts))]
+        assert self._public is not None
+        return self._public.state()
+
+    def portfolio(self, name: str) -> websocket_api.Portfolio:
+        """
+        The up-to-date portfolio of an account.
+        """
+        return self[name].state().portfolio
+
+    def request(
+        self, name: str, message: websocket_api.ClientMessage
+    ) -> websocket_api.ServerMessage:
+        """
+        Send a message as an account and wait for the response.
+        """
+        return self[name].request(message)
+
+    def request_many(
+        self,
+        name: str,
+        messages: List[websocket_api.ClientMessage],
+        *,
+        raise_on_failure: bool = True,
+    ) -> List[Union[websocket_api.ServerMessage, RequestFailed]]:
+        """
+        Send messages as an account and wait for the responses, see
+        `TradingClient.request_many`.
+        """
+        return self[name].request_many(messages, raise_on_failure=raise_on_failure)
+
+    def close(self):
+        """
+        Close every connection the pool opened.
+        """
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for client in clients.values():
+            client.close()
+
+    def _connect(self, jwt: str, act_as: str) -> TradingClient:
+        options = dict(self._client_options)
+        if options.get("throttle") is True:
+            options["throttle"] = self._throttles.setdefault(jwt, Throttle())
+        if self._public is None:
+            self._public = TradingClient(self._api_url, jwt, act_as, **options)
+            return self._public
+        options["watch_markets"] = ()
+        # Restoring a snapshot of the public state would only be dropped again
+        options.pop("snapshot", None)
+        return TradingClient(self._api_url, jwt, act_as, **options)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
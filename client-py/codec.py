@@ -0,0 +1,598 @@
+import dataclasses
+import hashlib
+import struct
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Type, TypeVar
+
+import betterproto
+import websocket_api
+from typing_extensions import Protocol
+
+M = TypeVar("M", bound=betterproto.Message)
+
+
+class Codec(Protocol):
+    """
+    Turns frames from the server into `ServerMessage`s and `ClientMessage`s into frames.
+
+    Every codec produces the same betterproto message classes, so `State._update` and
+    the rest of the client don't depend on which one is in use.
+    """
+
+    name: str
+
+    def decode(self, data: bytes) -> websocket_api.ServerMessage: ...
+
+    def encode(self, message: websocket_api.ClientMessage) -> bytes: ...
+
+
+class BetterprotoCodec:
+    """
+    The generated betterproto code, as is.
+    """
+
+    name = "betterproto"
+
+    def decode(self, data: bytes) -> websocket_api.ServerMessage:
+        return websocket_api.ServerMessage().parse(data)
+
+    def encode(self, message: websocket_api.ClientMessage) -> bytes:
+        return bytes(message)
+
+
+class FastCodec:
+    """
+    Table-driven protobuf decoder that builds the same betterproto messages as
+    `ServerMessage().parse`, without its per-field overhead.
+
+    Field tables are derived once per class from the betterproto metadata. Messages
+    are created without running `__post_init__`, from a per-class template of default
+    values, and fields are decoded straight from the frame without slicing out
+    sub-messages. Unlike betterproto, enum fields decode as their enum type, e.g.
+    `Side`, rather than as plain int; values the enum doesn't know stay int.
+    Anything the tables don't cover (maps, wrapper types, packed
+    scalars, unexpected wire types, malformed frames) falls back to betterproto.
+
+    Encoding is left to betterproto: client messages are small and rare by comparison.
+    """
+
+    name = "fast"
+
+    def decode(self, data: bytes) -> websocket_api.ServerMessage:
+        try:
+            return _decode(websocket_api.ServerMessage, data, 0, len(data), False)
+        except (_Unsupported, IndexError, struct.error):
+            return websocket_api.ServerMessage().parse(data)
+
+    def encode(self, message: websocket_api.ClientMessage) -> bytes:
+        return bytes(message)
+
+
+CODECS: Dict[str, Type[Codec]] = {
+    BetterprotoCodec.name: BetterprotoCodec,
+    FastCodec.name: FastCodec,
+}
+
+
+def get_codec(name: str) -> Codec:
+    """
+    Instantiate a codec by name, see `CODECS`.
+    """
+    try:
+        return CODECS[name]()
+    except KeyError:
+        raise ValueError(
+            f"Unknown codec {name!r}, expected one of {', '.join(CODECS)}"
+        ) from None
+
+
+def build(cls: Type[M], **values: Any) -> M:
+    """
+    The equivalent of `cls(**values)`, without going through `__post_init__`, for
+    building many messages to `encode`, e.g. server side.
+    """
+    spec = _spec(cls)
+    if spec.fields is None:
+        return cls(**values)
+    message = _blank(cls)
+    attributes = message.__dict__
+    attributes.update(values)
+    if values:
+        attributes["_serialized_on_wire"] = True
+        group_map = attributes["_group_map"]
+        for name in values:
+            member = spec.members.get(name)
+            if member is not None:
+                group_map[member.group] = member.field
+    return message
+
+
+def encode(message: betterproto.Message) -> bytes:
+    """
+    Table-driven equivalent of `bytes(message)`.
+
+    Unlike betterproto, and like the backend, the member of a oneof that is set is
+    written even when it's an empty message, so e.g. `Authenticated` arrives as such
+    rather than as a ServerMessage with nothing set.
+    """
+    return bytes(_encode(message))
+
+
+class Peek(NamedTuple):
+    kind: str
+    """
+    Name of the `ServerMessage.message` field that is set, or "" if none is.
+    """
+    market_id: Optional[int]
+    """
+    Market the message is about, or None if it isn't about a single market.
+    """
+    request_id: str
+    body: Tuple[int, int] = (0, 0)
+    """
+    Start and end of the encoded message within the frame.
+    """
+
+
+# Field holding the market id in each market-scoped kind of message
+MARKET_ID_FIELDS = {
+    "market_data": "id",
+    "market_created": "id",
+    "market_settled": "id",
+    "order_created": "market_id",
+    "order_cancelled": "market_id",
+    "out": "market_id",
+}
+
+
+def peek(data: bytes) -> Peek:
+    """
+    Read which kind of message a frame holds, which market it is about and its
+    request_id, skipping over everything else without decoding it.
+    """
+    fields = _server_message_fields()
+    kind = ""
+    market_id = None
+    request_id = ""
+    body = (0, 0)
+    pos = 0
+    end = len(data)
+    try:
+        while pos < end:
+            key, pos = _varint(data, pos)
+            wire_type = key & 7
+            if wire_type == 0:
+                _, pos = _varint(data, pos)
+                continue
+            elif wire_type == 1:
+                pos += 8
+                continue
+            elif wire_type == 5:
+                pos += 4
+                continue
+            elif wire_type != 2:
+                raise _Unsupported(f"wire type {wire_type}")
+            length, pos = _varint(data, pos)
+            field = fields.get(key >> 3)
+            if field is not None:
+                if field.kind == _STRING:
+                    request_id = str(data[pos : pos + length], "utf-8")
+                else:
+                    kind = field.name
+                    body = (pos, pos + length)
+                    market_id_field = _market_id_field_numbers.get(kind)
+                    market_id = None
+                    if market_id_field is not None:
+                        market_id = _peek_int64(
+                            data, pos, pos + length, market_id_field
+                        )
+            pos += length
+    except (_Unsupported, IndexError):
+        # Let whoever decodes the frame report the problem
+        return Peek("", None, "")
+    return Peek(kind, market_id, request_id, body)
+
+
+def _server_message_fields() -> Dict[int, "_Field"]:
+    fields = _spec(websocket_api.ServerMessage).fields
+    assert fields is not None
+    if not _market_id_field_numbers:
+        by_name = {field.name: field for field in fields.values()}
+        for kind, name in MARKET_ID_FIELDS.items():
+            message_fields = _spec(by_name[kind].message_cls).fields
+            assert message_fields is not None
+            _market_id_field_numbers[kind] = next(
+                number for number, field in message_fields.items() if field.name == name
+            )
+    return fields
+
+
+_market_id_field_numbers: Dict[str, int] = {}
+
+
+class MarketDataDedup:
+    """
+    Recognises `MarketData` frames identical to the last one applied for the same
+    market, so they can be dropped without being decoded.
+
+    The server resends every market after `ActAs` and when the client lags, and
+    most of them haven't changed. A market's fingerprint is forgotten as soon as any
+    other message about it arrives, so a repeat is only recognised while the state
+    still holds exactly what the previous frame described.
+    """
+
+    def __init__(self):
+        # market id -> (digest of the last MarketData, nanoseconds it took to decode)
+        self._markets: Dict[int, Tuple[bytes, int]] = {}
+        self._last: Tuple[Optional[bytes], bytes] = (None, b"")
+
+    def repeat(self, data: bytes, peeked: Peek) -> Optional[int]:
+        """
+        If `data` repeats the last MarketData applied for its market, how many
+        nanoseconds decoding that one took; otherwise None.
+        """
+        if peeked.kind != "market_data" or peeked.market_id is None:
+            return None
+        known = self._markets.get(peeked.market_id)
+        if known is None:
+            return None
+        digest, decode_ns = known
+        return decode_ns if self._digest(data, peeked) == digest else None
+
+    def applied(self, data: bytes, peeked: Peek, decode_ns: int):
+        """
+        Note that a frame has been applied to the state.
+        """
+        if peeked.market_id is None:
+            return
+        if peeked.kind == "market_data":
+            self._markets[peeked.market_id] = (self._digest(data, peeked), decode_ns)
+        else:
+            self._markets.pop(peeked.market_id, None)
+
+    def forget(self, market_id: Optional[int] = None):
+        """
+        Forget one market's fingerprint, or every market's.
+        """
+        if market_id is None:
+            self._markets.clear()
+        else:
+            self._markets.pop(market_id, None)
+
+    def _digest(self, data: bytes, peeked: Peek) -> bytes:
+        # `repeat` and then `applied` hash the same frame
+        if self._last[0] is data:
+            return self._last[1]
+        start, end = peeked.body
+        digest = hashlib.blake2b(memoryview(data)[start:end], digest_size=16).digest()
+        self._last = (data, digest)
+        return digest
+
+
+def _peek_int64(data: bytes, pos: int, end: int, number: int) -> int:
+    """
+    The last value of int64 field `number` in the message at `data[pos:end]`,
+    or 0 if it isn't there, like proto3.
+    """
+    value = 0
+    while pos < end:
+        key, pos = _varint(data, pos)
+        wire_type = key & 7
+        if wire_type == 0:
+            field_value, pos = _varint(data, pos)
+            if key >> 3 == number:
+                field_value &= 0xFFFFFFFFFFFFFFFF
+                value = (field_value ^ 0x8000000000000000) - 0x8000000000000000
+        elif wire_type == 2:
+            length, pos = _varint(data, pos)
+            pos += length
+        elif wire_type == 1:
+            pos += 8
+        elif wire_type == 5:
+            pos += 4
+        else:
+            raise _Unsupported(f"wire type {wire_type}")
+    return value
+
+
+class _Unsupported(Exception):
+    pass
+
+
+# Field kinds understood by `_decode`
+_UNSIGNED = 0
+_INT32 = 1
+_INT64 = 2
+_BOOL = 3
+_DOUBLE = 4
+_FLOAT = 5
+_STRING = 6
+_BYTES = 7
+_MESSAGE = 8
+_REPEATED_MESSAGE = 9
+_ENUM = 10
+
+_KINDS = {
+    betterproto.TYPE_ENUM: (_ENUM, betterproto.WIRE_VARINT),
+    betterproto.TYPE_UINT32: (_UNSIGNED, betterproto.WIRE_VARINT),
+    betterproto.TYPE_UINT64: (_UNSIGNED, betterproto.WIRE_VARINT),
+    betterproto.TYPE_INT32: (_INT32, betterproto.WIRE_VARINT),
+    betterproto.TYPE_INT64: (_INT64, betterproto.WIRE_VARINT),
+    betterproto.TYPE_BOOL: (_BOOL, betterproto.WIRE_VARINT),
+    betterproto.TYPE_DOUBLE: (_DOUBLE, betterproto.WIRE_FIXED_64),
+    betterproto.TYPE_FLOAT: (_FLOAT, betterproto.WIRE_FIXED_32),
+    betterproto.TYPE_STRING: (_STRING, betterproto.WIRE_LEN_DELIM),
+    betterproto.TYPE_BYTES: (_BYTES, betterproto.WIRE_LEN_DELIM),
+    betterproto.TYPE_MESSAGE: (_MESSAGE, betterproto.WIRE_LEN_DELIM),
+}
+
+_unpack_double = struct.Struct("<d").unpack_from
+_unpack_float = struct.Struct("<f").unpack_from
+_pack_double = struct.Struct("<d").pack
+_pack_float = struct.Struct("<f").pack
+
+
+class _Field(NamedTuple):
+    name: str
+    kind: int
+    wire_type: int
+    message_cls: Optional[type]
+    group: Optional[str]
+    field: dataclasses.Field
+    key: bytes
+
+
+class _Spec:
+    """
+    Everything `_decode` and `_encode` need to know about one message class.
+    """
+
+    __slots__ = ("fields", "scalars", "lists", "messages", "groups", "members")
+
+    def __init__(self, cls: type):
+        blank = cls()
+        meta = blank._betterproto
+        # None means the class can't be decoded here and goes through betterproto
+        self.fields: Optional[Dict[int, _Field]] = {}
+        self.scalars: Dict[str, Any] = {}
+        self.lists: List[str] = []
+        self.messages: List[Tuple[str, type]] = []
+        self.groups: Dict[str, None] = dict(blank._group_map)
+        # Fields that are members of a oneof, by name
+        self.members: Dict[str, _Field] = {}
+        for field in dataclasses.fields(cls):
+            field_meta = betterproto.FieldMetadata.get(field)
+            default = blank.__dict__[field.name]
+            kind_and_wire = _KINDS.get(field_meta.proto_type)
+            if kind_and_wire is None or field_meta.wraps:
+                self.fields = None
+                kind_and_wire = (_UNSIGNED, betterproto.WIRE_VARINT)
+            kind, wire_type = kind_and_wire
+            message_cls = None
+            if isinstance(default, list):
+                self.lists.append(field.name)
+                if kind != _MESSAGE:
+                    # Repeated scalars may be packed
+                    self.fields = None
+                kind = _REPEATED_MESSAGE
+                message_cls = meta.cls_by_field[field.name]
+            elif kind == _MESSAGE:
+                message_cls = meta.cls_by_field[field.name]
+                if not isinstance(default, betterproto.Message):
+                    # datetime and timedelta
+                    self.fields = None
+                self.messages.append((field.name, message_cls))
+            elif kind == _ENUM:
+                message_cls = meta.cls_by_field[field.name]
+                self.scalars[field.name] = _enum_value(message_cls, default)
+            else:
+                self.scalars[field.name] = default
+            if self.fields is not None:
+                self.fields[field_meta.number] = _Field(
+                    field.name,
+                    kind,
+                    wire_type,
+                    message_cls,
+                    field_meta.group,
+                    field,
+                    _encode_varint(field_meta.number << 3 | wire_type),
+                )
+                if field_meta.group:
+                    self.members[field.name] = self.fields[field_meta.number]
+        self.scalars["_serialized_on_wire"] = False
+        self.scalars["_unknown_fields"] = b""
+
+
+def _enum_value(enum_cls: Any, value: int) -> int:
+    # Protobuf enums are open, so values from a newer schema stay plain int
+    return enum_cls._value2member_map_.get(value, value)
+
+
+_specs: Dict[type, _Spec] = {}
+
+
+def _spec(cls: type) -> _Spec:
+    spec = _specs.get(cls)
+    if spec is None:
+        spec = _specs[cls] = _Spec(cls)
+    return spec
+
+
+def _blank(cls: Type[M]) -> M:
+    """
+    The equivalent of `cls()`, without going through `__post_init__`.
+    """
+    spec = _spec(cls)
+    message = object.__new__(cls)
+    attributes = message.__dict__
+    attributes.update(spec.scalars)
+    for name in spec.lists:
+        attributes[name] = []
+    for name, message_cls in spec.messages:
+        attributes[name] = _blank(message_cls)
+    attributes["_group_map"] = dict(spec.groups)
+    return message
+
+
+def _encode(message: betterproto.Message) -> bytearray:
+    spec = _spec(type(message))
+    if spec.fields is None:
+        return bytearray(bytes(message))
+    attributes = message.__dict__
+    group_map = attributes["_group_map"]
+    scalars = spec.scalars
+    output = bytearray()
+    for field in spec.fields.values():
+        value = attributes[field.name]
+        kind = field.kind
+        if kind == _REPEATED_MESSAGE:
+            for item in value:
+                encoded = _encode(item)
+                output += field.key
+                output += _encode_varint(len(encoded))
+                output += encoded
+            continue
+        selected = field.group is not None and group_map[field.group] is field.field
+        if kind == _MESSAGE:
+            encoded = _encode(value)
+            if encoded or selected or value._serialized_on_wire:
+                output += field.key
+                output += _encode_varint(len(encoded))
+                output += encoded
+            continue
+        if value == scalars[field.name] and not selected:
+            continue
+        output += field.key
+        if kind == _DOUBLE:
+            output += _pack_double(value)
+        elif kind == _STRING or kind == _BYTES:
+            encoded = value.encode("utf-8") if kind == _STRING else value
+            output += _encode_varint(len(encoded))
+            output += encoded
+        elif kind == _FLOAT:
+            output += _pack_float(value)
+        else:
+            output += _encode_varint(int(value))
+    output += attributes["_unknown_fields"]
+    return output
+
+
+def _encode_varint(value: int) -> bytes:
+    if value < 0:
+        value += 1 << 64
+    if value < 0x80:
+        return _SMALL_VARINTS[value]
+    output = bytearray()
+    while value >= 0x80:
+        output.append(value & 0x7F | 0x80)
+        value >>= 7
+    output.append(value)
+    return bytes(output)
+
+
+_SMALL_VARINTS = [bytes((i,)) for i in range(0x80)]
+
+
+def _varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        result |= (b & 0x7F) << shift
+        pos += 1
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+        if shift >= 64:
+            raise _Unsupported("varint too long")
+
+
+def _decode(cls: Type[M], data: bytes, pos: int, end: int, nested: bool) -> M:
+    """
+    Decode `data[pos:end]` as a `cls`, mirroring `betterproto.Message.parse`.
+    """
+    spec = _spec(cls)
+    fields = spec.fields
+    if fields is None:
+        message = cls().parse(data[pos:end])
+        if nested:
+            message._serialized_on_wire = True
+        return message
+    message = _blank(cls)
+    attributes = message.__dict__
+    on_wire = nested
+    while pos < end:
+        start = pos
+        key = data[pos]
+        pos += 1
+        if key & 0x80:
+            key, pos = _varint(data, start)
+        wire_type = key & 7
+        if wire_type == 0:
+            value = data[pos]
+            pos += 1
+            if value & 0x80:
+                value, pos = _varint(data, pos - 1)
+        elif wire_type == 2:
+            length = data[pos]
+            pos += 1
+            if length & 0x80:
+                length, pos = _varint(data, pos - 1)
+            value = pos
+            pos += length
+        elif wire_type == 1:
+            value = pos
+            pos += 8
+        elif wire_type == 5:
+            value = pos
+            pos += 4
+        else:
+            raise _Unsupported(f"wire type {wire_type}")
+        if pos > end:
+            raise _Unsupported("truncated field")
+
+        field = fields.get(key >> 3)
+        if field is None:
+            attributes["_unknown_fields"] += data[start:pos]
+            on_wire = True
+            continue
+        if wire_type != field.wire_type:
+            raise _Unsupported(f"wire type {wire_type} for {field.name}")
+        kind = field.kind
+        if kind == _REPEATED_MESSAGE:
+            attributes[field.name].append(
+                _decode(field.message_cls, data, value, pos, True)
+            )
+            continue
+        elif kind == _MESSAGE:
+            value = _decode(field.message_cls, data, value, pos, True)
+        elif kind == _DOUBLE:
+            value = _unpack_double(data, value)[0]
+        elif kind == _STRING:
+            value = str(data[value:pos], "utf-8")
+        elif kind == _INT64:
+            value &= 0xFFFFFFFFFFFFFFFF
+            value = (value ^ 0x8000000000000000) - 0x8000000000000000
+        elif kind == _BOOL:
+            value = value > 0
+        elif kind == _INT32:
+            value &= 0xFFFFFFFF
+            value = (value ^ 0x80000000) - 0x80000000
+        elif kind == _FLOAT:
+            value = _unpack_float(data, value)[0]
+        elif kind == _ENUM:
+            value = _enum_value(field.message_cls, value)
+        elif kind == _BYTES:
+            value = bytes(data[value:pos])
+        attributes[field.name] = value
+        on_wire = True
+        if field.group is not None:
+            group_map = attributes["_group_map"]
+            selected = group_map[field.group]
+            if selected is not None and selected is not field.field:
+                # Like betterproto, setting one member of a oneof resets the others
+                attributes[selected.name] = message._get_field_default(
+                    selected, betterproto.FieldMetadata.get(selected)
+                )
+            group_map[field.group] = field.field
+    attributes["_serialized_on_wire"] = on_wire
+    return message
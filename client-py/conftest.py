@@ -0,0 +1,23 @@
+import pytest
+
+from exchange_sim import Exchange, ExchangeSimulator
+
+
+@pytest.fixture
+def server():
+    """
+    An exchange simulator where "admin", "a" and "b" start with 1000 and "admin"
+    owns market 1, "one", settling between 0 and 100.
+    """
+    exchange = Exchange()
+    for user_id in ("admin", "a", "b"):
+        exchange.ensure_user(user_id, user_id, 1000)
+    exchange.create_market("admin", "one", 0, 100)
+    simulator = ExchangeSimulator(exchange, initial_balance=1000)
+    yield simulator
+    simulator.stop()
+
+
+@pytest.fixture
+def url(server: ExchangeSimulator) -> str:
+    return server.start()
@@ -0,0 +1,173 @@
+import dataclasses
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar, overload
+
+import betterproto
+import websocket_api
+from codec import MARKET_ID_FIELDS
+from order_book import OrderBook
+
+logger = logging.getLogger(__name__)
+
+F = TypeVar("F", bound=Callable[..., None])
+
+# Pseudo-kinds for the events derived from messages
+_TRADE = "trade"
+_BOOK_CHANGE = "book_change"
+
+_KINDS = frozenset(
+    field.name
+    for field in dataclasses.fields(websocket_api.ServerMessage)
+    if field.name != "request_id"
+)
+
+# Kinds of message that change the resting orders of a market
+_BOOK_KINDS = frozenset(
+    ("market_data", "market_created", "order_created", "order_cancelled")
+)
+
+
+class Events:
+    """
+    Callbacks fired right after a message from the server has been applied to the
+    state, by kind of message and optionally only for one market.
+
+    Callbacks run on whichever thread receives messages, while it holds the client's
+    `state_lock`, so they see the state exactly as of the message. They must not wait
+    for responses to requests (that would wait on themselves) but can `send` them.
+    An exception in a callback is logged and doesn't stop the others.
+
+    Each `on...` method returns the callback, so it also works as a decorator:
+
+        @client.events.on_book_change(market_id=3)
+        def requote(book: OrderBook): ...
+    """
+
+    def __init__(self):
+        self._handlers: Dict[Tuple[str, Optional[int]], List[Callable[[Any], None]]] = (
+            {}
+        )
+        self._dispatching = threading.local()
+
+    @overload
+    def on(self, kind: str, callback: F, *, market_id: Optional[int] = None) -> F: ...
+
+    @overload
+    def on(
+        self, kind: str, callback: None = None, *, market_id: Optional[int] = None
+    ) -> Callable[[F], F]: ...
+
+    def on(self, kind, callback=None, *, market_id=None):
+        """
+        Call `callback(message)` for every message of a kind, named like the fields of
+        `ServerMessage` ("order_created", "portfolio", ...). With `market_id`, only for
+        messages about that market.
+        """
+        if kind not in _KINDS:
+            raise ValueError(f"Unknown kind of message {kind!r}")
+        return self._register(kind, callback, market_id)
+
+    def on_order_created(
+        self,
+        callback: Optional[Callable[[websocket_api.OrderCreated], None]] = None,
+        *,
+        market_id: Optional[int] = None,
+    ):
+        return self._register("order_created", callback, market_id)
+
+    def on_order_cancelled(
+        self,
+        callback: Optional[Callable[[websocket_api.OrderCancelled], None]] = None,
+        *,
+        market_id: Optional[int] = None,
+    ):
+        return self._register("order_cancelled", callback, market_id)
+
+    def on_trade(
+        self,
+        callback: Optional[Callable[[websocket_api.Trade], None]] = None,
+        *,
+        market_id: Optional[int] = None,
+    ):
+        """
+        Call `callback(trade)` for each trade, in the order they happened.
+        """
+        return self._register(_TRADE, callback, market_id)
+
+    def on_book_change(
+        self,
+        callback: Optional[Callable[[OrderBook], None]] = None,
+        *,
+        market_id: Optional[int] = None,
+    ):
+        """
+        Call `callback(book)` whenever the resting orders of a market change.
+        """
+        return self._register(_BOOK_CHANGE, callback, market_id)
+
+    def off(self, callback: Callable[..., None]):
+        """
+        Unregister a callback from everything it was registered for.
+        """
+        for key, callbacks in list(self._handlers.items()):
+            remaining = [other for other in callbacks if other != callback]
+            if remaining:
+                self._handlers[key] = remaining
+            else:
+                del self._handlers[key]
+
+    @property
+    def dispatching(self) -> bool:
+        """
+        Whether the current thread is running a callback.
+        """
+        return getattr(self._dispatching, "active", False)
+
+    def _register(self, kind: str, callback, market_id: Optional[int]):
+        if callback is None:
+            return lambda callback: self._register(kind, callback, market_id)
+        # Replace rather than append, so dispatching can iterate without copying
+        key = (kind, market_id)
+        self._handlers[key] = self._handlers.get(key, []) + [callback]
+        return callback
+
+    def _dispatch(
+        self,
+        server_message: websocket_api.ServerMessage,
+        books: Dict[int, OrderBook],
+    ):
+        if not self._handlers:
+            return
+        kind, message = betterproto.which_one_of(server_message, "message")
+        field = MARKET_ID_FIELDS.get(kind)
+        market_id = None if field is None else getattr(message, field)
+        self._dispatching.active = True
+        try:
+            self._fire(kind, market_id, message)
+            if kind == "order_created":
+                for trade in message.trades:
+                    self._fire(_TRADE, market_id, trade)
+            if kind in _BOOK_KINDS and market_id in books:
+                self._fire(_BOOK_CHANGE, market_id, books[market_id])
+        finally:
+            self._dispatching.active = False
+
+    def _fire(self, kind: str, market_id: Optional[int], argument: Any):
+        self._call(kind, self._handlers.get((kind, None)), argument)
+        if market_id is not None:
+            self._call(kind, self._handlers.get((kind, market_id)), argument)
+
+    def _call(
+        self,
+        kind: str,
+        callbacks: Optional[List[Callable[[Any], None]]],
+        argument: Any,
+    ):
+        if not callbacks:
+            return
+        for callback in callbacks:
+            try:
+                callback(argument)
+            except Exception:
+                logger.exception(f"Error in {kind} callback {callback!r}")
@@ -0,0 +1,1127 @@
+"""
+Local stand-in for the exchange server, to load test and benchmark bots offline.
+
+`Exchange` is an in-memory copy of the backend's order matching and portfolio
+accounting (`backend/src/db.rs`): price-time priority, partial fills, fills against
+your own orders (which move no money and make no trade), cancels, `out`, settlement
+and redemption of funds, with the same validation and error messages.
+`ExchangeSimulator` serves it over a websocket speaking the real protocol, sending
+the same `ServerMessage`s in the same order as `backend/src/handle_socket.rs`, so
+`TradingClient` and every bot can point at it unchanged:
+
+    python exchange_sim.py --market high:0:100 --market low:0:100 --market sum:0:200 --fund sum:high,low
+
+There is no authentication: the `sub` claim of a JWT, or the JWT itself if it isn't
+one, is the user id. Acting as another user only needs that user to exist.
+Payments, bots, ownerships and hidden user ids are not simulated.
+"""
+
+import asyncio
+import base64
+import bisect
+import json
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import betterproto
+import typer
+import websocket_api
+from codec import build, encode
+from throttle import CONNECT_QUOTA, MUTATE_QUOTA, MUTATING_KINDS, TokenBucket
+from typing_extensions import Annotated
+from websocket_api import Side
+from websockets.asyncio.server import Server, ServerConnection, broadcast, serve
+from websockets.exceptions import ConnectionClosed
+
+logger = logging.getLogger(__name__)
+
+# Prices, sizes and positions are kept in hundredths and money (balances and the
+# value of orders) in ten-thousandths, so that all of the accounting is exact integer
+# arithmetic, as the backend's is with decimals
+_TICKS = 100
+_MONEY = _TICKS * _TICKS
+_MAX_MANTISSA = 1_000_000_000_000
+
+BID = int(Side.BID)
+OFFER = int(Side.OFFER)
+
+
+class Rejected(Exception):
+    """
+    A request the server answers with RequestFailed, with its error message.
+    """
+
+
+@dataclass
+class Outcome:
+    """
+    What a request changed: messages for every connection, messages for the
+    connection that sent it, and the users whose portfolio to send again.
+    """
+
+    public: List[websocket_api.ServerMessage] = field(default_factory=list)
+    reply: List[websocket_api.ServerMessage] = field(default_factory=list)
+    portfolios: Set[str] = field(default_factory=set)
+
+
+class _Order:
+    __slots__ = (
+        "id",
+        "market_id",
+        "owner_id",
+        "transaction_id",
+        "price",
+        "size",
+        "side",
+    )
+
+    def __init__(
+        self,
+        id: int,
+        market_id: int,
+        owner_id: str,
+        transaction_id: int,
+        price: int,
+        size: int,
+        side: int,
+    ):
+        self.id = id
+        self.market_id = market_id
+        self.owner_id = owner_id
+        self.transaction_id = transaction_id
+        self.price = price
+        self.size = size
+        self.side = side
+
+    def message(self) -> websocket_api.Order:
+        return build(
+            websocket_api.Order,
+            id=self.id,
+            market_id=self.market_id,
+            owner_id=self.owner_id,
+            transaction_id=self.transaction_id,
+            price=self.price / _TICKS,
+            size=self.size / _TICKS,
+            side=Side(self.side),
+        )
+
+
+class _BookSide:
+    """
+    Resting orders of one side: a dict of orders per price, in time priority, and
+    the prices in ascending order.
+    """
+
+    __slots__ = ("levels", "prices")
+
+    def __init__(self):
+        self.levels: Dict[int, Dict[int, _Order]] = {}
+        self.prices: List[int] = []
+
+    def add(self, order: _Order):
+        level = self.levels.get(order.price)
+        if level is None:
+            level = self.levels[order.price] = {}
+            bisect.insort(self.prices, order.price)
+        level[order.id] = order
+
+    def remove(self, order: _Order):
+        level = self.levels[order.price]
+        del level[order.id]
+        if not level:
+            del self.levels[order.price]
+            del self.prices[bisect.bisect_left(self.prices, order.price)]
+
+
+class _Market:
+    __slots__ = (
+        "id",
+        "name",
+        "description",
+        "owner_id",
+        "transaction_id",
+        "min_settlement",
+        "max_settlement",
+        "settle_price",
+        "sides",
+        "orders_by_owner",
+        "trades",
+    )
+
+    def __init__(
+        self,
+        id: int,
+        name: str,
+        description: str,
+        owner_id: str,
+        transaction_id: int,
+        min_settlement: int,
+        max_settlement: int,
+    ):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.owner_id = owner_id
+        self.transaction_id = transaction_id
+        self.min_settlement = min_settlement
+        self.max_settlement = max_settlement
+        self.settle_price: Optional[int] = None
+        self.sides = {BID: _BookSide(), OFFER: _BookSide()}
+        self.orders_by_owner: Dict[str, Dict[int, _Order]] = {}
+        self.trades: List[websocket_api.Trade] = []
+
+    def message(self) -> websocket_api.Market:
+        market = build(
+            websocket_api.Market,
+            id=self.id,
+            name=self.name,
+            description=self.description,
+            owner_id=self.owner_id,
+            transaction_id=self.transaction_id,
+            min_settlement=self.min_settlement / _TICKS,
+            max_settlement=self.max_settlement / _TICKS,
+        )
+        if self.settle_price is None:
+            market.open = build(websocket_api.MarketOpen)
+        else:
+            market.closed = build(
+                websocket_api.MarketClosed, settle_price=self.settle_price / _TICKS
+            )
+        return market
+
+
+class _Exposure:
+    __slots__ = (
+        "market",
+        "position",
+        "total_bid_size",
+        "total_offer_size",
+        "total_bid_value",
+        "total_offer_value",
+    )
+
+    def __init__(self, market: _Market):
+        self.market = market
+        self.position = 0
+        self.total_bid_size = 0
+        self.total_offer_size = 0
+        self.total_bid_value = 0
+        self.total_offer_value = 0
+
+    def worst_case_outcome(self) -> int:
+        market = self.market
+        resolves_min = (
+            market.min_settlement * (self.position + self.total_bid_size)
+            - self.total_bid_value
+        )
+        resolves_max = (
+            market.max_settlement * (self.position - self.total_offer_size)
+            + self.total_offer_value
+        )
+        return min(resolves_min, resolves_max)
+
+    def resting(self, side: int, size: int, price: int):
+        """
+        Count `size` more (or less, if negative) resting on a side at `price`.
+        """
+        if side == BID:
+            self.total_bid_size += size
+            self.total_bid_value += size * price
+        else:
+            self.total_offer_size += size
+            self.total_offer_value += size * price
+
+    def filled(self, side: int, size: int, price: int):
+        """
+        Move `size` of the orders resting on a side at `price` into the position.
+        """
+        self.resting(side, -size, price)
+        self.position += size if side == BID else -size
+
+
+class _User:
+    __slots__ = ("id", "name", "balance", "exposures")
+
+    def __init__(self, id: str, name: str, balance: int):
+        self.id = id
+        self.name = name
+        self.balance = balance
+        self.exposures: Dict[int, _Exposure] = {}
+
+    def exposure(self, market: _Market) -> _Exposure:
+        exposure = self.exposures.get(market.id)
+        if exposure is None:
+            exposure = self.exposures[market.id] = _Exposure(market)
+        return exposure
+
+    def available_balance(self) -> int:
+        return self.balance + sum(
+            exposure.worst_case_outcome() for exposure in self.exposures.values()
+        )
+
+
+def _ticks(value: float, scale: int = _TICKS) -> Optional[int]:
+    """
+    `value` in hundredths (or another `scale`), or None if it has more decimals or
+    is out of range, as the backend's decimal validation has it.
+    """
+    scaled = value * scale
+    ticks = round(scaled)
+    if abs(scaled - ticks) > 1e-6 + 1e-12 * abs(scaled) or abs(ticks) > _MAX_MANTISSA:
+        return None
+    return ticks
+
+
+class Exchange:
+    """
+    The exchange's books and portfolios, in memory.
+
+    Each method applies one request as the backend would, returning its `Outcome`,
+    or raises `Rejected` without changing anything.
+    """
+
+    def __init__(self):
+        self.users: Dict[str, _User] = {}
+        self.markets: Dict[int, _Market] = {}
+        self.orders: Dict[int, _Order] = {}
+        # fund id -> ids of the markets it redeems into
+        self.funds: Dict[int, List[int]] = {}
+        self._transaction_id = 0
+        self._order_id = 0
+        self._trade_id = 0
+        self._market_id = 0
+
+    def ensure_user(
+        self, user_id: str, name: str, balance: float = 0.0
+    ) -> Optional[websocket_api.ServerMessage]:
+        """
+        Create a user if it doesn't exist, returning the UserCreated to announce it.
+        """
+        if user_id in self.users:
+            return None
+        self.users[user_id] = _User(user_id, name, round(balance * _MONEY))
+        return build(
+            websocket_api.ServerMessage,
+            user_created=build(websocket_api.User, id=user_id, name=name),
+        )
+
+    def add_fund(self, fund_id: int, constituent_ids: Iterable[int]):
+        """
+        Make a market redeemable for one of each of the constituent markets.
+        """
+        self.funds[fund_id] = list(constituent_ids)
+
+    def market_by_name(self, name: str) -> websocket_api.Market:
+        for market in self.markets.values():
+            if market.name == name:
+                return market.message()
+        raise KeyError(name)
+
+    def create_market(
+        self,
+        owner_id: str,
+        name: str,
+        min_settlement: float,
+        max_settlement: float,
+        description: str = "",
+        request_id: str = "",
+    ) -> Outcome:
+        low = _ticks(min_settlement)
+        high = _ticks(max_settlement)
+        if low is None or high is None or low >= high or low < 0:
+            raise Rejected("Invalid settlement prices")
+        self._market_id += 1
+        market = self.markets[self._market_id] = _Market(
+            self._market_id, name, description, owner_id, self._transact(), low, high
+        )
+        return Outcome(
+            public=[
+                build(
+                    websocket_api.ServerMessage,
+                    request_id=request_id,
+                    market_created=market.message(),
+                )
+            ]
+        )
+
+    def settle_market(
+        self, owner_id: str, market_id: int, settle_price: float, request_id: str = ""
+    ) -> Outcome:
+        price = _ticks(settle_price)
+        if price is None:
+            raise Rejected("Invalid settlement price")
+        market = self.markets.get(market_id)
+        if market is None or market.owner_id != owner_id:
+            raise Rejected("Not market owner")
+        if market.settle_price is not None:
+            raise Rejected("Market already settled")
+        if not market.min_settlement <= price <= market.max_settlement:
+            raise Rejected("Invalid settlement price")
+        self._transact()
+        market.settle_price = price
+        # Resting orders are dropped without any OrderCancelled
+        for orders in market.orders_by_owner.values():
+            for order_id in orders:
+                del self.orders[order_id]
+        market.orders_by_owner.clear()
+        market.sides = {BID: _BookSide(), OFFER: _BookSide()}
+        affected = set()
+        for user in self.users.values():
+            exposure = user.exposures.pop(market_id, None)
+            if exposure is not None:
+                user.balance += exposure.position * price
+                affected.add(user.id)
+        settled = build(
+            websocket_api.MarketSettled, id=market_id, settle_price=settle_price
+        )
+        return Outcome(
+            public=[
+                build(
+                    websocket_api.ServerMessage,
+                    request_id=request_id,
+                    market_settled=settled,
+                )
+            ],
+            portfolios=affected,
+        )
+
+    def create_order(
+        self,
+        user_id: str,
+        market_id: int,
+        price: float,
+        size: float,
+        side: int,
+        request_id: str = "",
+    ) -> Outcome:
+        if side not in (BID, OFFER):
+            raise Rejected("Unknown side")
+        price_ticks = _ticks(price)
+        if price_ticks is None:
+            raise Rejected("Invalid price")
+        size_ticks = _ticks(size)
+        if size_ticks is None or size_ticks <= 0:
+            raise Rejected("Invalid size")
+        market = self.markets.get(market_id)
+        if market is None:
+            raise Rejected("Market not found")
+        if market.settle_price is not None:
+            raise Rejected("Market already settled")
+        if not market.min_settlement <= price_ticks <= market.max_settlement:
+            raise Rejected("Invalid price")
+        user = self.users.get(user_id)
+        if user is None:
+            raise Rejected("User not found")
+
+        # The whole order counts against the balance before it is matched
+        new_exposure = market.id not in user.exposures
+        exposure = user.exposure(market)
+        exposure.resting(side, size_ticks, price_ticks)
+        if user.available_balance() < 0:
+            exposure.resting(side, -size_ticks, price_ticks)
+            if new_exposure:
+                del user.exposures[market.id]
+            raise Rejected("Insufficient funds")
+        transaction_id = self._transact()
+
+        # Price-time priority: best price first, then oldest first
+        opposite = market.sides[OFFER if side == BID else BID]
+        prices = opposite.prices
+        remaining = size_ticks
+        fills: List[Tuple[_Order, int]] = []
+        while remaining and prices:
+            best = prices[0] if side == BID else prices[-1]
+            if best > price_ticks if side == BID else best < price_ticks:
+                break
+            for other in list(opposite.levels[best].values()):
+                filled = min(remaining, other.size)
+                remaining -= filled
+                other.size -= filled
+                fills.append((other, filled))
+                if not other.size:
+                    self._remove(market, other)
+                if not remaining:
+                    break
+
+        order = None
+        if remaining:
+            self._order_id += 1
+            order = _Order(
+                self._order_id,
+                market.id,
+                user_id,
+                transaction_id,
+                price_ticks,
+                remaining,
+                side,
+            )
+            self.orders[order.id] = order
+            market.sides[side].add(order)
+            market.orders_by_owner.setdefault(user_id, {})[order.id] = order
+        exposure.filled(side, size_ticks - remaining, price_ticks)
+
+        portfolios = {user_id}
+        fill_messages = []
+        trades = []
+        for other, filled in fills:
+            if other.owner_id != user_id:
+                self._trade_id += 1
+                buyer_id, seller_id = (
+                    (user_id, other.owner_id)
+                    if side == BID
+                    else (other.owner_id, user_id)
+                )
+                trade = build(
+                    websocket_api.Trade,
+                    id=self._trade_id,
+                    market_id=market.id,
+                    transaction_id=transaction_id,
+                    price=other.price / _TICKS,
+                    size=filled / _TICKS,
+                    buyer_id=buyer_id,
+                    seller_id=seller_id,
+                )
+                trades.append(trade)
+                value = filled * other.price
+                if side == BID:
+                    user.balance -= value
+                    self.users[other.owner_id].balance += value
+                else:
+                    user.balance += value
+                    self.users[other.owner_id].balance -= value
+            self.users[other.owner_id].exposure(market).filled(
+                other.side, filled, other.price
+            )
+            portfolios.add(other.owner_id)
+            fill_messages.append(
+                build(
+                    websocket_api.OrderCreatedOrderFill,
+                    id=other.id,
+                    market_id=market.id,
+                    owner_id=other.owner_id,
+                    size_filled=filled / _TICKS,
+                    size_remaining=other.size / _TICKS,
+                    price=other.price / _TICKS,
+                    side=Side(other.side),
+                )
+            )
+        market.trades.extend(trades)
+
+        created = build(
+            websocket_api.OrderCreated,
+            market_id=market.id,
+            user_id=user_id,
+            fills=fill_messages,
+            trades=trades,
+        )
+        if order is not None:
+            created.order = order.message()
+            created.order.sizes = [
+                build(
+                    websocket_api.Size,
+                    transaction_id=transaction_id,
+                    size=created.order.size,
+                )
+            ]
+        return Outcome(
+            public=[
+                build(
+                    websocket_api.ServerMessage,
+                    request_id=request_id,
+                    order_created=created,
+                )
+            ],
+            portfolios=portfolios,
+        )
+
+    def cancel_order(
+        self, user_id: str, order_id: int, request_id: str = ""
+    ) -> Outcome:
+        order = self.orders.get(order_id)
+        if order is None:
+            raise Rejected("Order not found")
+        if order.owner_id != user_id:
+            raise Rejected("Not order owner")
+        self._transact()
+        market = self.markets[order.market_id]
+        self._remove(market, order)
+        self.users[user_id].exposure(market).resting(
+            order.side, -order.size, order.price
+        )
+        cancelled = build(
+            websocket_api.OrderCancelled, id=order_id, market_id=market.id
+        )
+        return Outcome(
+            public=[
+                build(
+                    websocket_api.ServerMessage,
+                    request_id=request_id,
+                    order_cancelled=cancelled,
+                )
+            ],
+            portfolios={user_id},
+        )
+
+    def out(self, user_id: str, market_id: int, request_id: str = "") -> Outcome:
+        self._transact()
+        outcome = Outcome(
+            reply=[
+                build(
+                    websocket_api.ServerMessage,
+                    request_id=request_id,
+                    out=build(websocket_api.Out, market_id=market_id),
+                )
+            ]
+        )
+        market = self.markets.get(market_id)
+        orders = market.orders_by_owner.get(user_id) if market is not None else None
+        if not orders:
+            return outcome
+        assert market is not None
+        for order in list(orders.values()):
+            self._remove(market, order)
+            outcome.public.append(
+                build(
+                    websocket_api.ServerMessage,
+                    order_cancelled=build(
+                        websocket_api.OrderCancelled, id=order.id, market_id=market_id
+                    ),
+                )
+            )
+        exposure = self.users[user_id].exposure(market)
+        exposure.total_bid_size = exposure.total_offer_size = 0
+        exposure.total_bid_value = exposure.total_offer_value = 0
+        outcome.portfolios.add(user_id)
+        return outcome
+
+    def redeem(
+        self, user_id: str, fund_id: int, amount: float, request_id: str = ""
+    ) -> Outcome:
+        amount_ticks = _ticks(amount)
+        if amount_ticks is None or amount_ticks == 0:
+            raise Rejected("Invalid amount")
+        constituent_ids = self.funds.get(fund_id)
+        if not constituent_ids:
+            raise Rejected("Fund not found")
+        market_ids = [fund_id, *constituent_ids]
+        if any(self.markets[id].settle_price is not None for id in market_ids):
+            raise Rejected("One of the redeemed funds is already settled")
+        user = self.users.get(user_id)
+        if user is None:
+            raise Rejected("Redeemer not found")
+        # Redeeming costs 1%, rounded in the exchange's favour
+        constituent_change = (
+            amount_ticks * 99 // 100 if amount_ticks > 0 else amount_ticks * 101 // 100
+        )
+        before = {id: user.exposures.get(id) for id in market_ids}
+        positions = {
+            id: exposure.position for id, exposure in before.items() if exposure
+        }
+        user.exposure(self.markets[fund_id]).position -= amount_ticks
+        for id in constituent_ids:
+            user.exposure(self.markets[id]).position += constituent_change
+        if user.available_balance() < 0:
+            for id, exposure in before.items():
+                if exposure is None:
+                    user.exposures.pop(id, None)
+                else:
+                    exposure.position = positions[id]
+            raise Rejected("Insufficient funds")
+        redeemed = build(
+            websocket_api.Redeemed,
+            transaction_id=self._transact(),
+            user_id=user_id,
+            fund_id=fund_id,
+            amount=amount,
+        )
+        return Outcome(
+            public=[
+                build(
+                    websocket_api.ServerMessage,
+                    request_id=request_id,
+                    redeemed=redeemed,
+                )
+            ],
+            portfolios={user_id},
+        )
+
+    def portfolio(self, user_id: str) -> websocket_api.Portfolio:
+        user = self.users[user_id]
+        return build(
+            websocket_api.Portfolio,
+            total_balance=user.balance / _MONEY,
+            available_balance=user.available_balance() / _MONEY,
+            market_exposures=[
+                build(
+                    websocket_api.PortfolioMarketExposure,
+                    market_id=market_id,
+                    position=exposure.position / _TICKS,
+                    total_bid_size=exposure.total_bid_size / _TICKS,
+                    total_offer_size=exposure.total_offer_size / _TICKS,
+                    total_bid_value=exposure.total_bid_value / _MONEY,
+                    total_offer_value=exposure.total_offer_value / _MONEY,
+                )
+                for market_id, exposure in user.exposures.items()
+            ],
+        )
+
+    def users_message(self) -> websocket_api.Users:
+        return build(
+            websocket_api.Users,
+            users=[
+                build(websocket_api.User, id=user.id, name=user.name)
+                for user in self.users.values()
+            ],
+        )
+
+    def market_data(
+        self, market_id: int, full_history: bool = False
+    ) -> websocket_api.Market:
+        """
+        A market with its resting orders and trades, as sent on connecting, or in
+        response to UpgradeMarketData with `full_history`.
+        """
+        market = self.markets[market_id]
+        message = market.message()
+        message.has_full_history = full_history
+        message.orders = [
+            order.message()
+            for orders in market.orders_by_owner.values()
+            for order in orders.values()
+        ]
+        message.orders.sort(key=lambda order: order.id)
+        message.trades = list(market.trades)
+        return message
+
+    def _transact(self) -> int:
+        self._transaction_id += 1
+        return self._transaction_id
+
+    def _remove(self, market: _Market, order: _Order):
+        market.sides[order.side].remove(order)
+        orders = market.orders_by_owner[order.owner_id]
+        del orders[order.id]
+        if not orders:
+            del market.orders_by_owner[order.owner_id]
+        del self.orders[order.id]
+
+
+_KINDS = {
+    "create_market": "CreateMarket",
+    "settle_market": "SettleMarket",
+    "create_order": "CreateOrder",
+    "cancel_order": "CancelOrder",
+    "out": "Out",
+    "make_payment": "MakePayment",
+    "authenticate": "Authenticate",
+    "act_as": "ActAs",
+    "create_bot": "CreateBot",
+    "give_ownership": "GiveOwnership",
+    "upgrade_market_data": "UpgradeMarketData",
+    "redeem": "Redeem",
+}
+
+
+def _request_failed(
+    request_id: str, kind: str, error: str
+) -> websocket_api.ServerMessage:
+    return build(
+        websocket_api.ServerMessage,
+        request_id=request_id,
+        request_failed=build(
+            websocket_api.RequestFailed,
+            request_details=build(websocket_api.RequestFailedRequestDetails, kind=kind),
+            error_details=build(websocket_api.RequestFailedErrorDetails, message=error),
+        ),
+    )
+
+
+def _user_id(jwt: str) -> str:
+    """
+    The `sub` claim of a JWT, unverified, or the whole string if it isn't a JWT.
+    """
+    parts = jwt.split(".")
+    if len(parts) == 3:
+        try:
+            payload = base64.urlsafe_b64decode(parts[1] + "=" * (-len(parts[1]) % 4))
+            return json.loads(payload)["sub"]
+        except (ValueError, KeyError, TypeError):
+            pass
+    return jwt
+
+
+@dataclass(eq=False)
+class _Session:
+    ws: ServerConnection
+    user_id: str
+    acting_as: str
+
+
+class ExchangeSimulator:
+    """
+    Serves an `Exchange` over websockets, one asyncio task per connection.
+
+    Requests are applied one at a time on the event loop, and what they change is
+    sent to each connection as soon as it's applied, without waiting for slow
+    readers. New users start with `initial_balance`. With `rate_limits`, each
+    user gets the backend's mutate and connect quotas.
+    """
+
+    def __init__(
+        self,
+        exchange: Optional[Exchange] = None,
+        *,
+        initial_balance: float = 1_000_000.0,
+        rate_limits: bool = False,
+    ):
+        self.exchange = exchange if exchange is not None else Exchange()
+        self.initial_balance = initial_balance
+        self.rate_limits = rate_limits
+        self._sessions: Set[_Session] = set()
+        self._mutate_buckets: Dict[str, TokenBucket] = {}
+        self._connect_buckets: Dict[str, TokenBucket] = {}
+        self._server: Optional[Server] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self.requests = 0
+
+    async def serve(self, host: str = "localhost", port: int = 0) -> Server:
+        """
+        Start serving on the running event loop.
+        """
+        self._server = await serve(
+            self._handle, host, port, compression=None, max_queue=None
+        )
+        return self._server
+
+    def start(self, host: str = "localhost", port: int = 0) -> str:
+        """
+        Serve from a background thread, returning the URL to connect to.
+        """
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.serve(host, port))
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(
+            target=run, name="Exchange simulator", daemon=True
+        )
+        self._thread.start()
+        started.wait()
+        assert self._server is not None
+        port = next(iter(self._server.sockets)).getsockname()[1]
+        return f"ws://{host}:{port}"
+
+    def stop(self):
+        """
+        Stop a simulator started with `start`.
+        """
+        if self._loop is None or self._server is None:
+            return
+        server, loop = self._server, self._loop
+
+        async def close():
+            server.close()
+            await server.wait_closed()
+            loop.stop()
+
+        asyncio.run_coroutine_threadsafe(close(), loop)
+        if self._thread is not None:
+            self._thread.join()
+
+    async def _handle(self, ws: ServerConnection):
+        session = await self._authenticate(ws)
+        if session is None:
+            return
+        self._sessions.add(session)
+        try:
+            async for frame in ws:
+                if isinstance(frame, bytes):
+                    self._on_message(session, frame)
+                else:
+                    self._send(
+                        session,
+                        _request_failed("", "Unknown", "Expected Binary message"),
+                    )
+        except ConnectionClosed:
+            pass
+        finally:
+            self._sessions.discard(session)
+
+    async def _authenticate(self, ws: ServerConnection) -> Optional[_Session]:
+        async for frame in ws:
+            try:
+                message = websocket_api.ClientMessage().parse(frame)
+            except Exception:
+                message = websocket_api.ClientMessage()
+            kind, authenticate = betterproto.which_one_of(message, "message")
+            if kind != "authenticate":
+                await ws.send(
+                    encode(
+                        _request_failed("", "Unknown", "Expected Authenticate message")
+                    )
+                )
+                continue
+            request_id = message.request_id
+            if not authenticate.jwt:
+                await ws.send(
+                    encode(
+                        _request_failed(
+                            request_id, "Authenticate", "JWT validation failed"
+                        )
+                    )
+                )
+                continue
+            user_id = _user_id(authenticate.jwt)
+            act_as = authenticate.act_as or user_id
+            if act_as != user_id and act_as not in self.exchange.users:
+                await ws.send(
+                    encode(
+                        _request_failed(request_id, "Authenticate", "Not owner of user")
+                    )
+                )
+                continue
+            if not self._allowed(self._connect_buckets, CONNECT_QUOTA, user_id):
+                await ws.send(
+                    encode(
+                        _request_failed(
+                            request_id, "Authenticate", "Rate Limited (connecting)"
+                        )
+                    )
+                )
+                return None
+            session = _Session(ws, user_id, act_as)
+            self._send(
+                session,
+                build(
+                    websocket_api.ServerMessage,
+                    request_id=request_id,
+                    authenticated=build(websocket_api.Authenticated),
+                ),
+            )
+            created = self.exchange.ensure_user(user_id, user_id, self.initial_balance)
+            if created is not None:
+                self._broadcast(self._sessions, created)
+            self._send(
+                session,
+                build(
+                    websocket_api.ServerMessage,
+                    ownerships=build(websocket_api.Ownerships),
+                ),
+            )
+            self._send_public_data(session)
+            self._send_actor_data(session)
+            return session
+        return None
+
+    def _on_message(self, session: _Session, frame: bytes):
+        self.requests += 1
+        try:
+            message = websocket_api.ClientMessage().parse(frame)
+            kind, body = betterproto.which_one_of(message, "message")
+        except Exception:
+            kind = ""
+        if not kind:
+            self._send(
+                session, _request_failed("", "Unknown", "Expected Client message")
+            )
+            return
+        request_id = message.request_id
+        if kind in MUTATING_KINDS and not self._allowed(
+            self._mutate_buckets, MUTATE_QUOTA, session.user_id
+        ):
+            self._send(
+                session,
+                _request_failed(request_id, _KINDS[kind], "Rate Limited (mutating)"),
+            )
+            return
+        exchange = self.exchange
+        acting_as = session.acting_as
+        try:
+            if kind == "create_order":
+                outcome = exchange.create_order(
+                    acting_as,
+                    body.market_id,
+                    body.price,
+                    body.size,
+                    body.side,
+                    request_id,
+                )
+            elif kind == "cancel_order":
+                outcome = exchange.cancel_order(acting_as, body.id, request_id)
+            elif kind == "out":
+                outcome = exchange.out(acting_as, body.market_id, request_id)
+            elif kind == "create_market":
+                outcome = exchange.create_market(
+                    session.user_id,
+                    body.name,
+                    body.min_settlement,
+                    body.max_settlement,
+                    body.description,
+                    request_id,
+                )
+            elif kind == "settle_market":
+                outcome = exchange.settle_market(
+                    session.user_id, body.market_id, body.settle_price, request_id
+                )
+            elif kind == "redeem":
+                outcome = exchange.redeem(
+                    acting_as, body.fund_id, body.amount, request_id
+                )
+            elif kind == "upgrade_market_data":
+                if not self._allowed(
+                    self._connect_buckets, CONNECT_QUOTA, session.user_id
+                ):
+                    raise Rejected("Rate Limited (connecting)")
+                if body.market_id not in exchange.markets:
+                    raise Rejected("Market not found")
+                outcome = Outcome(
+                    reply=[
+                        build(
+                            websocket_api.ServerMessage,
+                            request_id=request_id,
+                            market_data=exchange.market_data(
+                                body.market_id, full_history=True
+                            ),
+                        )
+                    ]
+                )
+            elif kind == "act_as":
+                if body.user_id not in exchange.users:
+                    raise Rejected("Not owner of user")
+                session.acting_as = body.user_id
+                self._send_actor_data(session)
+                return
+            elif kind == "authenticate":
+                raise Rejected(
+                    "Already authenticated, to re-authenticate open a new websocket connection"
+                )
+            else:
+                raise Rejected("Not supported by the simulator")
+        except Rejected as e:
+            self._send(session, _request_failed(request_id, _KINDS[kind], str(e)))
+            return
+        for server_message in outcome.public:
+            self._broadcast(self._sessions, server_message)
+        for server_message in outcome.reply:
+            self._send(session, server_message)
+        if outcome.portfolios:
+            for other in self._sessions:
+                if other.acting_as in outcome.portfolios:
+                    self._send(
+                        other,
+                        build(
+                            websocket_api.ServerMessage,
+                            portfolio=exchange.portfolio(other.acting_as),
+                        ),
+                    )
+
+    def _send_public_data(self, session: _Session):
+        exchange = self.exchange
+        self._send(
+            session, build(websocket_api.ServerMessage, users=exchange.users_message())
+        )
+        for market_id in sorted(exchange.markets):
+            self._send(
+                session,
+                build(
+                    websocket_api.ServerMessage,
+                    market_data=exchange.market_data(market_id),
+                ),
+            )
+
+    def _send_actor_data(self, session: _Session):
+        self._send(
+            session,
+            build(
+                websocket_api.ServerMessage,
+                portfolio=self.exchange.portfolio(session.acting_as),
+            ),
+        )
+        self._send(
+            session,
+            build(websocket_api.ServerMessage, payments=build(websocket_api.Payments)),
+        )
+        self._send(
+            session,
+            build(
+                websocket_api.ServerMessage,
+                acting_as=build(websocket_api.ActingAs, user_id=session.acting_as),
+            ),
+        )
+
+    def _allowed(
+        self, buckets: Dict[str, TokenBucket], quota: Tuple[int, float], user_id: str
+    ) -> bool:
+        if not self.rate_limits:
+            return True
+        bucket = buckets.get(user_id)
+        if bucket is None:
+            burst, seconds = quota
+            bucket = buckets[user_id] = TokenBucket(burst, burst / seconds)
+        return bucket.take()
+
+    def _send(self, session: _Session, server_message: websocket_api.ServerMessage):
+        broadcast([session.ws], encode(server_message))
+
+    def _broadcast(
+        self, sessions: Iterable[_Session], server_message: websocket_api.ServerMessage
+    ):
+        broadcast([session.ws for session in sessions], encode(server_message))
+
+
+app = typer.Typer(pretty_exceptions_show_locals=False)
+
+
+@app.command()
+def main(
+    host: str = "localhost",
+    port: int = 8080,
+    market: Annotated[
+        Optional[List[str]],
+        typer.Option(help="A market to create, as name:min_settlement:max_settlement"),
+    ] = None,
+    fund: Annotated[
+        Optional[List[str]],
+        typer.Option(help="A redeemable market, as name:constituent,constituent,..."),
+    ] = None,
+    owner: Annotated[
+        str, typer.Option(help="User id owning the markets, who can settle them")
+    ] = "admin",
+    initial_balance: float = 1_000_000.0,
+    rate_limits: bool = False,
+):
+    """
+    Serve a simulated exchange.
+    """
+    logging.basicConfig(level=logging.INFO)
+    exchange = Exchange()
+    exchange.ensure_user(owner, owner, initial_balance)
+    for spec in market or []:
+        name, low, high = spec.rsplit(":", 2)
+        exchange.create_market(owner, name, float(low), float(high))
+    for spec in fund or []:
+        name, constituents = spec.split(":", 1)
+        exchange.add_fund(
+            exchange.market_by_name(name).id,
+            [exchange.market_by_name(c).id for c in constituents.split(",")],
+        )
+    simulator = ExchangeSimulator(
+        exchange, initial_balance=initial_balance, rate_limits=rate_limits
+    )
+
+    async def run():
+        server = await simulator.serve(host, port)
+        logger.info(f"Simulated exchange listening on ws://{host}:{port}")
+        await server.serve_forever()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,484 @@
+"""
+Load generator: simulated traders across a pool of processes, ramping up the rate
+of requests until the exchange (or the box) can't keep up.
+
+Each trader is a `TradingClient` on its own connection, placing, cancelling and
+taking out orders in the given mix at a steady pace. Every `step_seconds` the rate
+is multiplied by `ramp`, until requests fail, a round trip percentile breaks its SLO
+or the traders fall behind their target; the last step within bounds is the
+sustained rate.
+
+    python exchange_sim.py --market one:0:100 &
+    python loadgen.py ws://localhost:8080 --traders 40 --processes 4
+
+Traders send one request at a time and wait for the response, as bots do, so a
+trader can't go faster than one over its round trip: add traders for more load.
+Against the simulator, any JWT is accepted as the user id and each trader gets its
+own user; against a backend, pass `--jwt` and `--act-as` (repeated, assigned to
+traders in turn), keeping in mind its quotas are per user.
+"""
+
+import multiprocessing
+import random
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from multiprocessing.connection import Connection
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import betterproto
+import typer
+from codec import get_codec
+from metrics import Histogram
+from trading_client import RequestFailed, TradingClient
+from typing_extensions import Annotated
+from websocket_api import Side
+
+KINDS = ("create_order", "cancel_order", "out")
+
+
+@dataclass
+class LoadStep:
+    """
+    What all of the traders did during one step of the ramp.
+    """
+
+    target_rate: float
+    """
+    Requests per second asked of all of the traders together.
+    """
+    seconds: float = 0.0
+    round_trips: Dict[str, Histogram] = field(default_factory=dict)
+    """
+    Round trip in ns of each kind of request, failed ones included.
+    """
+    errors: Counter = field(default_factory=Counter)
+    """
+    Failed requests by error message.
+    """
+    cpu_seconds: float = 0.0
+    """
+    CPU time used by the trader processes.
+    """
+
+    @property
+    def requests(self) -> int:
+        return sum(histogram.count for histogram in self.round_trips.values())
+
+    @property
+    def failed(self) -> int:
+        return sum(self.errors.values())
+
+    @property
+    def rate(self) -> float:
+        return self.requests / self.seconds if self.seconds else 0.0
+
+    @property
+    def orders_per_second(self) -> float:
+        created = self.round_trips.get("create_order")
+        if created is None or not self.seconds:
+            return 0.0
+        return (created.count - self.errors_of("create_order")) / self.seconds
+
+    @property
+    def error_rate(self) -> float:
+        return self.failed / self.requests if self.requests else 0.0
+
+    def error_rate_excluding(self, messages: Sequence[str]) -> float:
+        failed = sum(
+            count
+            for (_, message), count in self.errors.items()
+            if message not in messages
+        )
+        return failed / self.requests if self.requests else 0.0
+
+    @property
+    def cpu_cores(self) -> float:
+        return self.cpu_seconds / self.seconds if self.seconds else 0.0
+
+    def errors_of(self, kind: str) -> int:
+        return sum(
+            count
+            for (error_kind, _), count in self.errors.items()
+            if error_kind == kind
+        )
+
+    def percentile_ms(self, kind: str, percentile: float) -> float:
+        histogram = self.round_trips.get(kind)
+        return histogram.percentile(percentile) / 1e6 if histogram else 0.0
+
+    def merge(self, other: "LoadStep"):
+        self.seconds = max(self.seconds, other.seconds)
+        for kind, histogram in other.round_trips.items():
+            self.round_trips.setdefault(kind, Histogram()).merge(histogram)
+        self.errors.update(other.errors)
+        self.cpu_seconds += other.cpu_seconds
+
+
+@dataclass
+class LoadReport:
+    steps: List[LoadStep]
+    stopped_because: str
+    sustained: Optional[LoadStep]
+    """
+    The fastest step that stayed within bounds.
+    """
+
+    def format(self) -> str:
+        kinds = [
+            kind
+            for kind in KINDS
+            if any(kind in step.round_trips for step in self.steps)
+        ]
+        lines = [
+            f"{'target/s':>9} {'req/s':>8} {'orders/s':>8} {'failed':>7}"
+            + "".join(f" {kind + ' p50/p99 ms':>24}" for kind in kinds)
+            + f" {'cpu':>5}"
+        ]
+        for step in self.steps:
+            lines.append(
+                f"{step.target_rate:>9.0f} {step.rate:>8.0f}"
+                f" {step.orders_per_second:>8.0f} {step.error_rate:>7.2%}"
+                + "".join(
+                    f" {step.percentile_ms(kind, 50):>11.1f}"
+                    f"/{step.percentile_ms(kind, 99):<12.1f}"
+                    for kind in kinds
+                )
+                + f" {step.cpu_cores:>5.2f}"
+            )
+        errors = Counter()
+        for step in self.steps:
+            errors.update(step.errors)
+        for (kind, message), count in errors.most_common():
+            lines.append(f"  {count} {kind} failed: {message}")
+        lines.append(f"Stopped: {self.stopped_because}")
+        if self.sustained is not None:
+            lines.append(
+                f"Sustained {self.sustained.rate:.0f} requests/s"
+                f" ({self.sustained.orders_per_second:.0f} orders/s)"
+                f" using {self.sustained.cpu_cores:.2f} client cores"
+            )
+        return "\n".join(lines)
+
+
+@dataclass
+class TraderOptions:
+    mix: Dict[str, float]
+    """
+    Relative weight of each kind of request.
+    """
+    market_ids: Sequence[int] = ()
+    """
+    Markets to trade in, or all of the open ones if empty.
+    """
+    size: float = 1.0
+    codec: str = "betterproto"
+    throttle: bool = False
+    seed: int = 0
+
+
+class _Trader:
+    """
+    One connection sending a mix of requests, one at a time.
+    """
+
+    def __init__(
+        self, url: str, jwt: str, act_as: str, options: TraderOptions, seed: int
+    ):
+        self.client = TradingClient(
+            url, jwt, act_as, codec=get_codec(options.codec), throttle=options.throttle
+        )
+        self.options = options
+        self.rng = random.Random(seed)
+        markets = self.client.state().markets
+        self.markets = [
+            markets[market_id]
+            for market_id in options.market_ids or sorted(markets)
+            if market_id in markets
+            and betterproto.which_one_of(markets[market_id], "status")[0] != "closed"
+        ]
+        if not self.markets:
+            raise ValueError("No open markets to trade in")
+        kinds = [kind for kind in KINDS if options.mix.get(kind)]
+        self.kinds = kinds
+        self.weights = [options.mix[kind] for kind in kinds]
+
+    def run(self, rate: float, seconds: float) -> LoadStep:
+        metrics = self.client.metrics()
+        metrics.reset()
+        step = LoadStep(rate, seconds)
+        interval = 1 / rate
+        started = time.monotonic()
+        next_at = started
+        end = started + seconds
+        while True:
+            now = time.monotonic()
+            if now >= end:
+                break
+            if next_at > now:
+                time.sleep(min(next_at, end) - now)
+                continue
+            # Behind schedule: carry on from now rather than catching up in a burst
+            next_at = max(next_at + interval, now)
+            kind = self.rng.choices(self.kinds, self.weights)[0]
+            try:
+                self._request(kind)
+            except RequestFailed as e:
+                message = str(e).split(" request failed: ", 1)[-1]
+                step.errors[(kind, message)] += 1
+        step.seconds = time.monotonic() - started
+        step.round_trips = {
+            kind: request.round_trip for kind, request in metrics.requests.items()
+        }
+        return step
+
+    def _request(self, kind: str):
+        market = self.rng.choice(self.markets)
+        own_orders = (
+            self.client.state().books[market.id].own_orders()
+            if kind == "cancel_order"
+            else None
+        )
+        if own_orders:
+            self.client.cancel_order(self.rng.choice(own_orders).id)
+        elif kind == "out":
+            self.client.out(market.id)
+        else:
+            price = round(
+                self.rng.uniform(market.min_settlement, market.max_settlement), 2
+            )
+            side = self.rng.choice((Side.BID, Side.OFFER))
+            self.client.create_order(market.id, price, self.options.size, side)
+
+    def close(self):
+        self.client.close()
+
+
+def _worker(
+    connection: Connection,
+    url: str,
+    credentials: List[Tuple[str, str]],
+    options: TraderOptions,
+    first_seed: int,
+):
+    """
+    Run traders in one process, a thread each, stepping them as told through
+    `connection`: (rate per trader, seconds) runs a step and sends back its
+    `LoadStep`, None stops.
+    """
+    traders = []
+    try:
+        for i, (jwt, act_as) in enumerate(credentials):
+            traders.append(_Trader(url, jwt, act_as, options, first_seed + i))
+    except Exception as e:
+        connection.send(e)
+        return
+    connection.send(None)
+    while True:
+        command = connection.recv()
+        if command is None:
+            break
+        rate, seconds = command
+        results: List[LoadStep] = []
+        cpu_started = time.process_time()
+        threads = [
+            threading.Thread(
+                target=lambda trader=trader: results.append(trader.run(rate, seconds))
+            )
+            for trader in traders
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        step = LoadStep(rate * len(traders))
+        for result in results:
+            step.merge(result)
+        step.cpu_seconds = time.process_time() - cpu_started
+        connection.send(step)
+    for trader in traders:
+        trader.close()
+
+
+def run_load(
+    url: str,
+    credentials: Sequence[Tuple[str, str]],
+    options: TraderOptions,
+    *,
+    processes: int = 1,
+    start_rate: float = 10.0,
+    ramp: float = 1.5,
+    step_seconds: float = 5.0,
+    max_steps: int = 20,
+    slo_ms: Optional[Dict[Tuple[str, float], float]] = None,
+    max_error_rate: float = 0.01,
+    expected_errors: Sequence[str] = ("Order not found",),
+    min_achieved: float = 0.9,
+) -> LoadReport:
+    """
+    Ramp the traders from `start_rate` requests per second in total, multiplying it
+    by `ramp` each step, until a step fails more than `max_error_rate` of its
+    requests, breaks one of `slo_ms` ((kind, percentile) -> milliseconds), achieves
+    less than `min_achieved` of its target, or `max_steps` are done. Failures with
+    one of `expected_errors` don't count: a cancel that loses the race against a
+    fill is part of trading, not a sign of overload.
+
+    `credentials` are the (jwt, act_as) of each trader, spread over `processes`.
+    """
+    if slo_ms is None:
+        slo_ms = {(kind, 99.0): 100.0 for kind in KINDS}
+    context = multiprocessing.get_context("spawn")
+    workers = []
+    for i in range(processes):
+        assigned = list(credentials[i::processes])
+        if not assigned:
+            continue
+        parent, child = context.Pipe()
+        process = context.Process(
+            target=_worker,
+            args=(child, url, assigned, options, options.seed + i * len(credentials)),
+            daemon=True,
+        )
+        process.start()
+        workers.append((process, parent, len(assigned)))
+    steps: List[LoadStep] = []
+    sustained = None
+    stopped_because = f"{max_steps} steps done"
+    try:
+        for _, connection, _ in workers:
+            error = connection.recv()
+            if error is not None:
+                raise error
+        rate = start_rate
+        for _ in range(max_steps):
+            per_trader = rate / len(credentials)
+            for _, connection, _ in workers:
+                connection.send((per_trader, step_seconds))
+            step = LoadStep(rate)
+            for _, connection, _ in workers:
+                step.merge(connection.recv())
+            steps.append(step)
+            broken = _broken(
+                step, slo_ms, max_error_rate, expected_errors, min_achieved
+            )
+            if broken is not None:
+                stopped_because = broken
+                break
+            sustained = step
+            rate *= ramp
+    finally:
+        for process, connection, _ in workers:
+            try:
+                connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for process, _, _ in workers:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+    return LoadReport(steps, stopped_because, sustained)
+
+
+def _broken(
+    step: LoadStep,
+    slo_ms: Dict[Tuple[str, float], float],
+    max_error_rate: float,
+    expected_errors: Sequence[str],
+    min_achieved: float,
+) -> Optional[str]:
+    error_rate = step.error_rate_excluding(expected_errors)
+    if error_rate > max_error_rate:
+        return f"{error_rate:.2%} of requests failed at {step.target_rate:.0f}/s"
+    for (kind, percentile), limit in slo_ms.items():
+        latency = step.percentile_ms(kind, percentile)
+        if latency > limit:
+            return (
+                f"{kind} p{percentile:g} of {latency:.1f} ms over {limit:g} ms"
+                f" at {step.target_rate:.0f}/s"
+            )
+    if step.rate < step.target_rate * min_achieved:
+        return (
+            f"traders only achieved {step.rate:.0f} of {step.target_rate:.0f}"
+            " requests/s"
+        )
+    return None
+
+
+def _parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        kind, weight = part.split("=")
+        kind = {"create": "create_order", "cancel": "cancel_order"}.get(kind, kind)
+        if kind not in KINDS:
+            raise typer.BadParameter(f"Unknown kind {kind!r} in mix")
+        weights[kind] = float(weight)
+    return weights
+
+
+app = typer.Typer(pretty_exceptions_show_locals=False)
+
+
+@app.command()
+def main(
+    url: str,
+    traders: int = 8,
+    processes: int = 2,
+    jwt: Annotated[
+        Optional[List[str]],
+        typer.Option(help="JWTs of the traders, in turn; defaults to loadgen-<n>"),
+    ] = None,
+    act_as: Annotated[
+        Optional[List[str]],
+        typer.Option(help="User to act as for each JWT, if not its own"),
+    ] = None,
+    market_id: Annotated[Optional[List[int]], typer.Option()] = None,
+    mix: str = "create=0.6,cancel=0.35,out=0.05",
+    size: float = 1.0,
+    start_rate: float = 20.0,
+    ramp: float = 1.5,
+    step_seconds: float = 5.0,
+    max_steps: int = 20,
+    p99_ms: Annotated[
+        float, typer.Option(help="SLO on the p99 round trip of each kind")
+    ] = 100.0,
+    max_error_rate: float = 0.01,
+    codec: str = "betterproto",
+    throttle: bool = False,
+    seed: int = 0,
+):
+    """
+    Ramp up simulated traders against an exchange and report what it sustained.
+    """
+    if jwt:
+        acting = act_as or [""]
+        credentials = [
+            (jwt[i % len(jwt)], acting[i % len(acting)]) for i in range(traders)
+        ]
+    else:
+        credentials = [(f"loadgen-{i}", "") for i in range(traders)]
+    options = TraderOptions(
+        mix=_parse_mix(mix),
+        market_ids=market_id or (),
+        size=size,
+        codec=codec,
+        throttle=throttle,
+        seed=seed,
+    )
+    report = run_load(
+        url,
+        credentials,
+        options,
+        processes=processes,
+        start_rate=start_rate,
+        ramp=ramp,
+        step_seconds=step_seconds,
+        max_steps=max_steps,
+        slo_ms={(kind, 99.0): p99_ms for kind in KINDS},
+        max_error_rate=max_error_rate,
+    )
+    print(report.format())
+
+
+if __name__ == "__main__":
+    app()
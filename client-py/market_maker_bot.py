@@ -1,10 +1,10 @@
 import logging
-from time import sleep
-from typing import Optional
+import threading
+from typing import List, Optional
 
 import typer
 from dotenv import load_dotenv
-from trading_client import TradingClient
+from trading_client import RequestFailed, State, TradingClient
 from typing_extensions import Annotated
 from websocket_api import ClientMessage, CreateOrder, CancelOrder, Side
 
@@ -26,7 +26,7 @@ def main(
     fade_per_order: float = 1.0,
     prior: Optional[float] = None,
 ):
-    with TradingClient(api_url, jwt, act_as) as client:
+    with TradingClient(api_url, jwt, act_as, receive_in_background=True) as client:
         market_maker_bot(
             client,
             market_id=market_id,
@@ -50,116 +50,150 @@ def market_maker_bot(
     client.out(market_id)
     logger.info(f"Starting market maker bot for market {market_id}")
 
+    # Requote as soon as the book or our position changes rather than polling; without
+    # a background receiver nothing sets `changed` and this polls every second
+    changed = threading.Event()
+    client.events.on_book_change(lambda book: changed.set(), market_id=market_id)
+    client.events.on("portfolio", lambda portfolio: changed.set())
+
     while True:
-        sleep(1)
-        state = client.state()
-        market = state.markets.get(market_id)
-        if market is None:
-            logger.info(f"No market data available for market {market_id}")
+        changed.wait(timeout=1)
+        changed.clear()
+        # The receiver thread applies messages under the lock, so hold it while
+        # reading the state, but not while waiting for the responses
+        with client.state_lock:
+            state = client.state()
+            market = state.markets.get(market_id)
+            book = state.books.get(market_id)
+            if market is None or book is None:
+                logger.info(f"No market data available for market {market_id}")
+                continue
+
+            messages = quote(
+                state,
+                market_id,
+                spread=spread,
+                size=size,
+                fade_per_order=fade_per_order,
+                prior=prior,
+            )
+        if not messages:
             continue
+        results = client.request_many(messages, raise_on_failure=False)
+        for result in results:
+            if isinstance(result, RequestFailed):
+                logger.warning(str(result))
 
-        if prior is None:
-            prior = (market.max_settlement + market.min_settlement) / 2
 
-        current_position = next(
-            (
-                exp.position
-                for exp in state.portfolio.market_exposures
-                if exp.market_id == market_id
+def quote(
+    state: State,
+    market_id: int,
+    *,
+    spread: float,
+    size: float,
+    fade_per_order: float,
+    prior: Optional[float] = None,
+) -> List[ClientMessage]:
+    """
+    The orders to place and cancel to requote around the fair price, given our
+    position and resting orders, or nothing if our spread is already tight enough.
+    """
+    market = state.markets[market_id]
+    book = state.books[market_id]
+    if prior is None:
+        prior = (market.max_settlement + market.min_settlement) / 2
+
+    current_position = next(
+        (
+            exp.position
+            for exp in state.portfolio.market_exposures
+            if exp.market_id == market_id
+        ),
+        0,
+    )
+    logger.info(f"Current position: {current_position}")
+
+    our_bids = book.own_prices(Side.BID)
+    our_offers = book.own_prices(Side.OFFER)
+
+    our_best_bid = max(our_bids + [market.min_settlement])
+    our_best_offer = min(our_offers + [market.max_settlement])
+
+    our_current_spread = our_best_offer - our_best_bid
+    logger.info(f"Current spread: {our_current_spread}")
+    if our_current_spread <= spread:
+        return []
+
+    fair_price = prior - round(current_position / size) * fade_per_order
+    logger.info(f"Current fair: {fair_price}")
+
+    def clamp(value: float):
+        return round(
+            max(
+                market.min_settlement,
+                min(market.max_settlement, value),
             ),
-            0,
+            2,
         )
-        logger.info(f"Current position: {current_position}")
-
-        our_bids = [
-            order.price
-            for order in market.orders
-            if order.side == Side.BID and order.owner_id == state.acting_as.user_id
-        ]
-        our_offers = [
-            order.price
-            for order in market.orders
-            if order.side == Side.OFFER and order.owner_id == state.acting_as.user_id
-        ]
-
-        our_best_bid = max(our_bids + [market.min_settlement])
-        our_best_offer = min(our_offers + [market.max_settlement])
-
-        our_current_spread = our_best_offer - our_best_bid
-        logger.info(f"Current spread: {our_current_spread}")
-        if our_current_spread <= spread:
-            continue
 
-        fair_price = prior - round(current_position / size) * fade_per_order
-        logger.info(f"Current fair: {fair_price}")
-
-        def clamp(value: float):
-            assert market is not None
-            return round(
-                max(
-                    market.min_settlement,
-                    min(market.max_settlement, value),
-                ),
-                2,
+    desired_bid_prices = [
+        clamp((fair_price - i * fade_per_order - spread / 2))
+        for i in range(5)
+    ]
+    desired_offer_prices = [
+        clamp((fair_price + i * fade_per_order + spread / 2))
+        for i in range(5)
+    ]
+
+    new_bid_prices = [
+        bid for bid in desired_bid_prices if bid not in our_bids
+    ]
+    new_offer_prices = [
+        offer for offer in desired_offer_prices if offer not in our_offers
+    ]
+    new_cancel_ids = [
+        order.id
+        for bid in our_bids if bid not in desired_bid_prices
+        for order in book.own_orders_at(Side.BID, bid)
+    ] + [
+        order.id
+        for offer in our_offers if offer not in desired_offer_prices
+        for order in book.own_orders_at(Side.OFFER, offer)
+    ]
+
+    bids = [
+        ClientMessage(
+            create_order=CreateOrder(
+                market_id=market_id,
+                price=bid_price,
+                size=size,
+                side=Side.BID,
             )
-
-        desired_bid_prices = [
-            clamp((fair_price - i * fade_per_order - spread / 2))
-            for i in range(5)
-        ]
-        desired_offer_prices = [
-            clamp((fair_price + i * fade_per_order + spread / 2))
-            for i in range(5)
-        ]
-
-        new_bid_prices = [
-            bid for bid in desired_bid_prices if bid not in our_bids
-        ]
-        new_offer_prices = [
-            offer for offer in desired_offer_prices if offer not in our_offers
-        ]
-        new_cancel_prices = [
-            bid for bid in our_bids if bid not in desired_bid_prices
-        ] + [
-            offer for offer in our_offers if offer not in desired_offer_prices
-        ]
-        new_cancel_ids = [
-            order.id
-            for order in market.orders
-            for price in new_cancel_prices if order.price == price and order.owner_id == state.acting_as.user_id
-        ]
-
-        bids = [
-            ClientMessage(
-                create_order=CreateOrder(
-                    market_id=market_id,
-                    price=bid_price,
-                    size=size,
-                    side=Side.BID,
-                )
+        )
+        for bid_price in new_bid_prices
+    ]
+    offers = [
+        ClientMessage(
+            create_order=CreateOrder(
+                market_id=market_id,
+                price=offer_price,
+                size=size,
+                side=Side.OFFER,
             )
-            for bid_price in new_bid_prices
-        ]
-        offers = [
-            ClientMessage(
-                create_order=CreateOrder(
-                    market_id=market_id,
-                    price=offer_price,
-                    size=size,
-                    side=Side.OFFER,
-                )
+        )
+        for offer_price in new_offer_prices
+    ]
+    cancels = [
+        ClientMessage(
+            cancel_order=CancelOrder(
+                id=id
             )
-            for offer_price in new_offer_prices
-        ]
-        cancels = [
-            ClientMessage(
-                cancel_order=CancelOrder(
-                    id=id
-                )
-            ) for id in new_cancel_ids
-        ]
-        logger.info(f"Placing {len(bids)} bids, {len(offers)} offers, and {len(cancels)} cancels")
-        client.request_many(bids + offers + cancels)
+        ) for id in new_cancel_ids
+    ]
+    logger.info(
+        f"Placing {len(bids)} bids, {len(offers)} offers, and {len(cancels)} cancels"
+    )
+    return bids + offers + cancels
 
 
 if __name__ == "__main__":
@@ -0,0 +1,314 @@
+import json
+import logging
+import math
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import betterproto
+import websocket_api
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (50.0, 99.0, 99.9)
+
+
+class Histogram:
+    """
+    HDR-style histogram of non-negative integers.
+
+    Values below 2**SUB_BUCKET_BITS are counted exactly; above that each power of two
+    is split into 2**(SUB_BUCKET_BITS - 1) buckets, so every reported value is within
+    about 1.6% of the true one, whatever the range. Recording is a couple of integer
+    operations and the memory used grows with the log of the largest value.
+    """
+
+    SUB_BUCKET_BITS = 7
+    _HALF = 1 << (SUB_BUCKET_BITS - 1)
+
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.counts: List[int] = []
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+
+    def record(self, value: int):
+        if value < 0:
+            value = 0
+        shift = value.bit_length() - self.SUB_BUCKET_BITS
+        if shift < 0:
+            shift = 0
+        index = shift * self._HALF + (value >> shift)
+        counts = self.counts
+        if index >= len(counts):
+            counts.extend([0] * (index + 1 - len(counts)))
+        counts[index] += 1
+        if self.count == 0 or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.count += 1
+        self.total += value
+
+    def percentile(self, percentile: float) -> int:
+        """
+        The highest value equivalent to the given percentile (0 to 100) of the recorded
+        values, or 0 if there are none.
+        """
+        if self.count == 0:
+            return 0
+        rank = max(1, math.ceil(self.count * percentile / 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self._highest_equivalent(index), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def merge(self, other: "Histogram"):
+        """
+        Add the values recorded in another histogram, e.g. by another process.
+        """
+        if other.count == 0:
+            return
+        counts = self.counts
+        if len(other.counts) > len(counts):
+            counts.extend([0] * (len(other.counts) - len(counts)))
+        for index, count in enumerate(other.counts):
+            counts[index] += count
+        self.min = other.min if self.count == 0 else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.count += other.count
+        self.total += other.total
+
+    def summary(self, scale: float = 1.0) -> Dict[str, float]:
+        """
+        Count, mean, percentiles and max, with values multiplied by `scale`.
+        """
+        summary: Dict[str, float] = {"count": self.count, "mean": self.mean * scale}
+        for percentile in PERCENTILES:
+            summary[f"p{percentile:g}"] = self.percentile(percentile) * scale
+        summary["max"] = self.max * scale
+        return summary
+
+    def _highest_equivalent(self, index: int) -> int:
+        if index < 2 * self._HALF:
+            return index
+        shift = index // self._HALF - 1
+        return ((index - shift * self._HALF + 1) << shift) - 1
+
+
+@dataclass
+class RequestMetrics:
+    """
+    Measurements of the requests of one kind, from sending to the response having
+    been applied to the state.
+
+    `client` is the time spent decoding and applying frames (the response and any
+    interleaved ones) while the request was in flight; the rest of `round_trip` is
+    network and server time.
+    """
+
+    round_trip: Histogram = field(default_factory=Histogram)
+    client: Histogram = field(default_factory=Histogram)
+    interleaved_frames: Histogram = field(default_factory=Histogram)
+    failed: int = 0
+
+
+@dataclass
+class FrameMetrics:
+    """
+    Time spent on the received frames of one kind.
+    """
+
+    decode: Histogram = field(default_factory=Histogram)
+    apply: Histogram = field(default_factory=Histogram)
+
+
+class Metrics:
+    """
+    Latency of requests and cost of received frames, by kind of message.
+    Durations are recorded in nanoseconds and summarized in microseconds.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started_at = time.time()
+        self.requests: Dict[str, RequestMetrics] = {}
+        self.frames: Dict[str, FrameMetrics] = {}
+        self.frames_received = 0
+        self.frames_skipped = 0
+        # MarketData frames dropped for repeating the last one, and what decoding
+        # them would have cost
+        self.repeats_skipped = 0
+        self.repeat_bytes_saved = 0
+        self.repeat_decode_ns_saved = 0
+        self._busy_ns = 0
+        # request_id -> (kind, sent at, frames_received and _busy_ns when sent)
+        self._in_flight: Dict[str, Tuple[str, int, int, int]] = {}
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Percentiles of everything recorded since the last reset, as plain data.
+        """
+        return {
+            "started_at": self.started_at,
+            "frames_received": self.frames_received,
+            "frames_skipped": self.frames_skipped,
+            "market_data_repeats": {
+                "skipped": self.repeats_skipped,
+                "bytes_saved": self.repeat_bytes_saved,
+                "decode_us_saved": self.repeat_decode_ns_saved * 1e-3,
+            },
+            "requests": {
+                kind: {
+                    "failed": request.failed,
+                    "round_trip_us": request.round_trip.summary(1e-3),
+                    "client_us": request.client.summary(1e-3),
+                    "interleaved_frames": request.interleaved_frames.summary(),
+                }
+                for kind, request in self.requests.items()
+            },
+            "frames": {
+                kind: {
+                    "decode_us": frames.decode.summary(1e-3),
+                    "apply_us": frames.apply.summary(1e-3),
+                }
+                for kind, frames in self.frames.items()
+            },
+        }
+
+    def format(self) -> str:
+        """
+        A table of the request latencies and frame costs, for logging.
+        """
+        lines = [
+            f"{self.frames_received} frames received"
+            f" ({self.frames_skipped} skipped) in {time.time() - self.started_at:.0f}s,"
+            f" {self.repeats_skipped} repeated MarketData dropped"
+            f" ({self.repeat_bytes_saved / 1e3:.0f} kB,"
+            f" {self.repeat_decode_ns_saved / 1e6:.1f} ms of decoding)",
+            f"  {'request':<16} {'count':>7} {'failed':>6}"
+            f" {'p50 us':>9} {'p99 us':>9} {'p999 us':>9} {'client us':>9}"
+            f" {'frames':>6}",
+        ]
+        for kind, request in sorted(self.requests.items()):
+            round_trip = request.round_trip
+            lines.append(
+                f"  {kind:<16} {round_trip.count:>7} {request.failed:>6}"
+                f" {round_trip.percentile(50) / 1e3:>9.0f}"
+                f" {round_trip.percentile(99) / 1e3:>9.0f}"
+                f" {round_trip.percentile(99.9) / 1e3:>9.0f}"
+                f" {request.client.mean / 1e3:>9.0f}"
+                f" {request.interleaved_frames.mean:>6.1f}"
+            )
+        lines.append(
+            f"  {'frame':<16} {'count':>7} {'':>6}"
+            f" {'decode p50':>10} {'p99':>8} {'apply p50':>10} {'p99':>8}"
+        )
+        for kind, frames in sorted(self.frames.items()):
+            lines.append(
+                f"  {kind:<16} {frames.decode.count:>7} {'':>6}"
+                f" {frames.decode.percentile(50) / 1e3:>10.1f}"
+                f" {frames.decode.percentile(99) / 1e3:>8.1f}"
+                f" {frames.apply.percentile(50) / 1e3:>10.1f}"
+                f" {frames.apply.percentile(99) / 1e3:>8.1f}"
+            )
+        return "\n".join(lines)
+
+    def _sent(self, message: websocket_api.ClientMessage):
+        kind, _ = betterproto.which_one_of(message, "message")
+        self._in_flight[message.request_id] = (
+            kind,
+            time.perf_counter_ns(),
+            self.frames_received,
+            self._busy_ns,
+        )
+
+    def _abandon(self, request_id: str):
+        self._in_flight.pop(request_id, None)
+
+    def _skipped(self):
+        self.frames_received += 1
+        self.frames_skipped += 1
+
+    def _repeated(self, size: int, decode_ns: int):
+        self.frames_received += 1
+        self.repeats_skipped += 1
+        self.repeat_bytes_saved += size
+        self.repeat_decode_ns_saved += decode_ns
+
+    def _frame(
+        self,
+        server_message: websocket_api.ServerMessage,
+        decode_ns: int,
+        apply_ns: int,
+    ):
+        self.frames_received += 1
+        self._busy_ns += decode_ns + apply_ns
+        kind, message = betterproto.which_one_of(server_message, "message")
+        frames = self.frames.get(kind)
+        if frames is None:
+            frames = self.frames[kind] = FrameMetrics()
+        frames.decode.record(decode_ns)
+        frames.apply.record(apply_ns)
+        if not self._in_flight:
+            return
+        sent = self._in_flight.pop(server_message.request_id, None)
+        if sent is None:
+            return
+        kind, sent_at, frames_received, busy_ns = sent
+        request = self.requests.get(kind)
+        if request is None:
+            request = self.requests[kind] = RequestMetrics()
+        request.round_trip.record(time.perf_counter_ns() - sent_at)
+        request.client.record(self._busy_ns - busy_ns)
+        request.interleaved_frames.record(self.frames_received - frames_received - 1)
+        if isinstance(message, websocket_api.RequestFailed):
+            request.failed += 1
+
+
+class MetricsReporter(threading.Thread):
+    """
+    Thread that calls `summarize()` every `interval` seconds for a table of metrics to
+    log and a summary to append to `path`, if given, as a line of JSON.
+    """
+
+    def __init__(
+        self,
+        summarize: Callable[[], Tuple[str, Dict[str, Any]]],
+        interval: float,
+        path: Optional[str] = None,
+    ):
+        super().__init__(name="Metrics reporter", daemon=True)
+        self._summarize = summarize
+        self._interval = interval
+        self._path = path
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self._interval):
+            try:
+                self.report()
+            except Exception:
+                logger.exception("Error reporting metrics")
+
+    def report(self):
+        table, summary = self._summarize()
+        logger.info(f"Client metrics:\n{table}")
+        if self._path is not None:
+            with open(self._path, "a") as f:
+                f.write(json.dumps({"time": time.time(), **summary}) + "\n")
+
+    def stop(self):
+        self._stopped.set()
@@ -50,24 +50,22 @@ def naive_bot(
         if random.random() >= (1 / seconds_per_trade):
             continue
 
-        market = client.state().markets.get(market_id)
-        if not market or not market.orders:
+        book = client.state().books.get(market_id)
+        if not book:
             logger.info(f"No market data available for market {market_id}")
             continue
 
-        bids = [order for order in market.orders if order.side == Side.BID]
-        offers = [order for order in market.orders if order.side == Side.OFFER]
+        best_bid = book.best_bid()
+        best_offer = book.best_offer()
 
-        if not bids:
+        if not best_bid:
             logger.info(f"No bids available for market {market_id}")
             continue
 
-        if not offers:
+        if not best_offer:
             logger.info(f"No offers available for market {market_id}")
             continue
 
-        best_bid = max(bids, key=lambda x: x.price)
-        best_offer = min(offers, key=lambda x: x.price)
         spread = best_offer.price - best_bid.price
 
         available_size = min(best_bid.size, best_offer.size)
@@ -0,0 +1,400 @@
+from bisect import bisect_left
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    overload,
+)
+
+import websocket_api
+from websocket_api import Side
+
+OrderIndex = Dict[int, Tuple[int, websocket_api.Order]]
+
+
+class PriceLevel:
+    """
+    Resting orders at a single price, in time priority.
+    """
+
+    __slots__ = ("price", "orders", "size")
+
+    def __init__(self, price: float):
+        self.price = price
+        self.orders: Dict[int, websocket_api.Order] = {}
+        self.size = 0.0
+
+    def __repr__(self):
+        return (
+            f"PriceLevel(price={self.price}, size={self.size},"
+            f" orders={len(self.orders)})"
+        )
+
+
+class OrderBook:
+    """
+    Resting orders of one market, maintained incrementally.
+
+    Each side is a dict of price levels plus a sorted list of their prices, arranged
+    so the best price is always last. Orders are also indexed by id, so adding,
+    removing and filling an order costs a dict operation plus at most one bisect,
+    and the best bid/offer is an O(1) read.
+
+    If `index` is given, the book also keeps `order id -> (market id, order)` entries
+    for its orders there, so one index can span the books of every market.
+
+    The orders of `owner_id` (normally the user we act as) are also kept by side and
+    price, so finding our own quotes costs O(our orders) rather than a scan of the
+    whole book; see `own_orders`, `own_prices` and `own_orders_at`.
+    """
+
+    def __init__(
+        self,
+        orders: Iterable[websocket_api.Order] = (),
+        *,
+        market_id: int = 0,
+        index: Optional["OrderIndex"] = None,
+        owner_id: str = "",
+    ):
+        self.market_id = market_id
+        self._index = index
+        self.owner_id = owner_id
+        self._own: Dict[Side, Dict[float, Dict[int, websocket_api.Order]]] = {
+            Side.BID: {},
+            Side.OFFER: {},
+        }
+        self._orders: Dict[int, websocket_api.Order] = {}
+        self._levels: Dict[Side, Dict[float, PriceLevel]] = {
+            Side.BID: {},
+            Side.OFFER: {},
+        }
+        # Sort keys of the price levels, ascending, so the best level is last.
+        # Bids are keyed by price and offers by negated price.
+        self._keys: Dict[Side, List[float]] = {Side.BID: [], Side.OFFER: []}
+        for order in orders:
+            self.add(order)
+
+    @property
+    def orders(self) -> "OrdersView":
+        """
+        All resting orders in arrival order, as a read-only sequence that stays up to
+        date.
+        """
+        return OrdersView(self._orders)
+
+    def get(self, order_id: int) -> Optional[websocket_api.Order]:
+        return self._orders.get(order_id)
+
+    def add(self, order: websocket_api.Order):
+        """
+        Add a resting order to the back of its price level.
+        """
+        if order.id in self._orders:
+            self.remove(order.id)
+        side = order.side
+        levels = self._levels[side]
+        level = levels.get(order.price)
+        if level is None:
+            level = levels[order.price] = PriceLevel(order.price)
+            keys = self._keys[side]
+            key = _key(side, order.price)
+            keys.insert(bisect_left(keys, key), key)
+        level.orders[order.id] = order
+        level.size += order.size
+        self._orders[order.id] = order
+        if self._index is not None:
+            self._index[order.id] = (self.market_id, order)
+        if self.owner_id and order.owner_id == self.owner_id:
+            self._own[side].setdefault(order.price, {})[order.id] = order
+
+    def remove(self, order_id: int) -> Optional[websocket_api.Order]:
+        """
+        Remove a resting order, returning it if it was in the book.
+        """
+        order = self._orders.pop(order_id, None)
+        if order is None:
+            return None
+        if self._index is not None:
+            self._index.pop(order_id, None)
+        side = order.side
+        level = self._levels[side][order.price]
+        del level.orders[order_id]
+        level.size -= order.size
+        if not level.orders:
+            self._remove_level(side, level.price)
+        if self.owner_id and order.owner_id == self.owner_id:
+            own = self._own[side]
+            own_level = own[order.price]
+            del own_level[order_id]
+            if not own_level:
+                del own[order.price]
+        return order
+
+    def fill(
+        self, order_id: int, size_remaining: float
+    ) -> Optional[websocket_api.Order]:
+        """
+        Update the size of a resting order after a fill, removing it once it is fully
+        filled.
+        """
+        order = self._orders.get(order_id)
+        if order is None:
+            return None
+        if size_remaining <= 0:
+            return self.remove(order_id)
+        level = self._levels[order.side][order.price]
+        level.size += size_remaining - order.size
+        order.size = size_remaining
+        return order
+
+    def sync(self, orders: Iterable[websocket_api.Order]) -> Tuple[int, int, int]:
+        """
+        Bring the book in line with a fresh snapshot of its orders, touching only the
+        orders that differ, so unchanged orders keep their objects and time priority.
+        An order whose owner id changed, as when the server stops hiding the ids of
+        the user we now act as, keeps its place too.
+        Returns how many orders were added, removed and resized.
+        """
+        seen = set()
+        added = resized = 0
+        for order in orders:
+            seen.add(order.id)
+            current = self._orders.get(order.id)
+            if current is None:
+                self.add(order)
+                added += 1
+            elif current.price != order.price or current.side != order.side:
+                self.add(order)
+                resized += 1
+            else:
+                if current.owner_id != order.owner_id:
+                    self._set_order_owner(current, order.owner_id)
+                if current.size != order.size:
+                    self.fill(order.id, order.size)
+                    resized += 1
+        stale = [order_id for order_id in self._orders if order_id not in seen]
+        for order_id in stale:
+            self.remove(order_id)
+        return added, len(stale), resized
+
+    def set_owner(self, owner_id: str):
+        """
+        Index the orders of a different owner, e.g. after switching who we act as.
+        """
+        if owner_id == self.owner_id:
+            return
+        self.owner_id = owner_id
+        for side in (Side.BID, Side.OFFER):
+            self._own[side].clear()
+        if not owner_id:
+            return
+        for order in self._orders.values():
+            if order.owner_id == owner_id:
+                self._own[order.side].setdefault(order.price, {})[order.id] = order
+
+    def own_orders(self, side: Optional[Side] = None) -> List[websocket_api.Order]:
+        """
+        The resting orders of `owner_id`, of one side or both.
+        """
+        sides = (Side.BID, Side.OFFER) if side is None else (side,)
+        return [
+            order
+            for side in sides
+            for level in self._own[side].values()
+            for order in level.values()
+        ]
+
+    def own_prices(self, side: Side) -> List[float]:
+        """
+        Prices at which `owner_id` has orders on one side, best first.
+        """
+        return sorted(
+            self._own[side], key=lambda price: _key(side, price), reverse=True
+        )
+
+    def own_orders_at(self, side: Side, price: float) -> List[websocket_api.Order]:
+        """
+        The orders of `owner_id` at one price, in time priority.
+        """
+        level = self._own[side].get(price)
+        return [] if level is None else list(level.values())
+
+    def best_bid(self) -> Optional[websocket_api.Order]:
+        """
+        The bid with price-time priority, or None if there are no bids.
+        """
+        return self._best(Side.BID)
+
+    def best_offer(self) -> Optional[websocket_api.Order]:
+        """
+        The offer with price-time priority, or None if there are no offers.
+        """
+        return self._best(Side.OFFER)
+
+    def best(self, side: Side) -> Optional[websocket_api.Order]:
+        return self._best(side)
+
+    def levels(self, side: Side, depth: Optional[int] = None) -> List[PriceLevel]:
+        """
+        Price levels of one side, best first, limited to `depth` levels.
+        """
+        levels = self._levels[side]
+        keys = self._keys[side]
+        start = 0 if depth is None else max(len(keys) - depth, 0)
+        return [levels[_key(side, key)] for key in reversed(keys[start:])]
+
+    def bid_levels(self, depth: Optional[int] = None) -> List[PriceLevel]:
+        return self.levels(Side.BID, depth)
+
+    def offer_levels(self, depth: Optional[int] = None) -> List[PriceLevel]:
+        return self.levels(Side.OFFER, depth)
+
+    def depth(
+        self, side: Side, depth: Optional[int] = None
+    ) -> List[Tuple[float, float]]:
+        """
+        (price, total size) of the top `depth` levels of one side, best first.
+        """
+        return [(level.price, level.size) for level in self.levels(side, depth)]
+
+    def iter_orders(self, side: Side) -> Iterator[websocket_api.Order]:
+        """
+        Orders of one side in price-time priority.
+        """
+        levels = self._levels[side]
+        for key in reversed(self._keys[side]):
+            yield from list(levels[_key(side, key)].orders.values())
+
+    def bids(self, count: Optional[int] = None) -> List[websocket_api.Order]:
+        """
+        The top `count` bids in price-time priority.
+        """
+        return self._top(Side.BID, count)
+
+    def offers(self, count: Optional[int] = None) -> List[websocket_api.Order]:
+        """
+        The top `count` offers in price-time priority.
+        """
+        return self._top(Side.OFFER, count)
+
+    def detach(self):
+        """
+        Remove this book's orders from the shared index and stop maintaining it,
+        for when the book is replaced by a fresh snapshot.
+        """
+        if self._index is not None:
+            for order_id in self._orders:
+                self._index.pop(order_id, None)
+            self._index = None
+
+    def clear(self):
+        if self._index is not None:
+            for order_id in self._orders:
+                self._index.pop(order_id, None)
+        self._orders.clear()
+        for side in (Side.BID, Side.OFFER):
+            self._levels[side].clear()
+            self._keys[side].clear()
+            self._own[side].clear()
+
+    def __len__(self):
+        return len(self._orders)
+
+    def __contains__(self, order_id: object):
+        return order_id in self._orders
+
+    def _best(self, side: Side) -> Optional[websocket_api.Order]:
+        keys = self._keys[side]
+        if not keys:
+            return None
+        level = self._levels[side][_key(side, keys[-1])]
+        return next(iter(level.orders.values()))
+
+    def _top(self, side: Side, count: Optional[int]) -> List[websocket_api.Order]:
+        result: List[websocket_api.Order] = []
+        for order in self.iter_orders(side):
+            if count is not None and len(result) >= count:
+                break
+            result.append(order)
+        return result
+
+    def _set_order_owner(self, order: websocket_api.Order, owner_id: str):
+        was_own = bool(self.owner_id) and order.owner_id == self.owner_id
+        order.owner_id = owner_id
+        if not self.owner_id or was_own == (owner_id == self.owner_id):
+            return
+        # Rebuild our orders at this price from the level, to keep time priority
+        own = self._own[order.side]
+        level = self._levels[order.side][order.price]
+        mine = {
+            order_id: resting
+            for order_id, resting in level.orders.items()
+            if resting.owner_id == self.owner_id
+        }
+        if mine:
+            own[order.price] = mine
+        else:
+            own.pop(order.price, None)
+
+    def _remove_level(self, side: Side, price: float):
+        del self._levels[side][price]
+        keys = self._keys[side]
+        key = _key(side, price)
+        i = bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            del keys[i]
+
+
+def _key(side: Side, price: float) -> float:
+    # Negation is its own inverse, so this maps prices to keys and keys back to prices
+    return price if side == Side.BID else -price
+
+
+class OrdersView(Sequence[websocket_api.Order]):
+    """
+    Read-only sequence of the orders in an `OrderBook`, standing in for
+    `Market.orders`.
+
+    It holds no elements itself: every read goes to the book, so it is always up to
+    date. Iterating takes a snapshot first, so it is safe while the book is being
+    updated. It isn't a list: take `list(view)` for a copy to modify or compare, and
+    before serializing a `Market` holding one.
+    """
+
+    __slots__ = ("_orders",)
+
+    def __init__(self, orders: Dict[int, websocket_api.Order]):
+        self._orders = orders
+
+    def __len__(self):
+        return len(self._orders)
+
+    def __iter__(self) -> Iterator[websocket_api.Order]:
+        return iter(list(self._orders.values()))
+
+    def __reversed__(self) -> Iterator[websocket_api.Order]:
+        return reversed(list(self._orders.values()))
+
+    def __contains__(self, order: object):
+        return isinstance(order, websocket_api.Order) and (
+            self._orders.get(order.id) == order
+        )
+
+    @overload
+    def __getitem__(self, index: int) -> websocket_api.Order: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[websocket_api.Order]: ...
+
+    def __getitem__(
+        self, index: Union[int, slice]
+    ) -> Union[websocket_api.Order, List[websocket_api.Order]]:
+        return list(self._orders.values())[index]
+
+    def __repr__(self):
+        return f"OrdersView({list(self)!r})"
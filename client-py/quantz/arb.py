@@ -1,7 +1,10 @@
 from collections import defaultdict
+from dataclasses import dataclass
+import math
 import time
-from typing import List, Union
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 import betterproto
+import numpy as np
 from market import (
     ActAs,
     ActingAs,
@@ -27,11 +30,13 @@ def act_as_by_name(client: TradingClient, name: str):
     return act_as(client, bot_by_name(client.state())[name].id)
 
 def positions_by_user(client: TradingClient, market_name: str):
-    market = market_by_name(client.state())[market_name]
+    state = client.state()
+    market = market_by_name(state)[market_name]
+    users = users_by_id(state)
     positions = defaultdict(float)
     for trade in market.trades:
-        buyer = users_by_id(client.state())[trade.buyer_id].name
-        seller = users_by_id(client.state())[trade.seller_id].name
+        buyer = users[trade.buyer_id].name
+        seller = users[trade.seller_id].name
         positions[buyer] += trade.size
         positions[seller] -= trade.size
     return positions
@@ -80,7 +85,7 @@ class Arbval:
         pass
     def best_price(self):
         return Arbord(self.value)
-    def create_order(self, size: float):
+    def create_order(self, size: float, price: Optional[float] = None):
         pass
     def best_bid(self):
         pass
@@ -106,14 +111,17 @@ class Arbmark:
     def market(self):
         return market_by_name(self.client.state())[self.name]
 
+    def book(self):
+        return self.client.state().books[self.market().id]
+
     def orders(self):
         return self.market().orders
     
     def bids(self):
-        return [order for order in self.orders() if order.side == Side.BID]
+        return self.book().bids()
     
     def offers(self):
-        return [order for order in self.orders() if order.side == Side.OFFER]
+        return self.book().offers()
     
     def best_price(self):
         if self.side == Side.BID:
@@ -130,21 +138,15 @@ class Arbmark:
         return self.best_price().size
     
     def best_bid(self):
-        bids = self.bids()
-        if bids:
-            return sorted(bids, key=lambda x: -x.price)[0]
-        return None
+        return self.book().best_bid()
 
     def best_offer(self):
-        offers = self.offers()
-        if offers:
-            return sorted(offers, key=lambda x: x.price)[0]
-        return None
+        return self.book().best_offer()
     
-    def create_order(self, size: float):
+    def create_order(self, size: float, price: Optional[float] = None):
         return CreateOrder(
             market_id=self.market().id,
-            price=self.best_price().price,
+            price=self.best_price().price if price is None else price,
             size=size,
             side=self.opposite_side,
         )
@@ -176,6 +178,132 @@ class Arbsket:
     def __neg__(self):
         return Arbsket([-a for a in self.composition])
 
+class RelationSet:
+    """
+    Many basket relations, each a `left` basket that should cost more than its
+    `right`, evaluated together every tick.
+
+    Each relation is compiled once into two rows of a sparse coefficient matrix over
+    the markets' top of book (the best bid and best offer of every market named by
+    a leg): buying `left` against `right`, and the reverse trade, `-right` against
+    `-left`, as `do_arb` checks them. Repeated legs add up to one coefficient and
+    `Arbval` constants go into a separate vector, so `edges` reads each market's
+    best bid and offer once and prices every relation in one NumPy pass, rather
+    than each leg looking its market up by name.
+    """
+
+    def __init__(self, relations: Iterable[Tuple[Arbsket, Arbsket]]):
+        self.relations = list(relations)
+        self.names: List[str] = []
+        self._columns: Dict[str, int] = {}
+        self._market_ids: List[Optional[int]] = []
+        rows: List[int] = []
+        cols: List[int] = []
+        coefficients: List[float] = []
+        constants: List[float] = []
+        for i, (left, right) in enumerate(self.relations):
+            orientations = ((2 * i, left, right), (2 * i + 1, -right, -left))
+            for row, cheap, dear in orientations:
+                constant = 0.0
+                for sign, basket in ((-1.0, cheap), (1.0, dear)):
+                    for leg in basket.composition:
+                        if isinstance(leg, Arbval):
+                            constant += sign * leg.value
+                            continue
+                        rows.append(row)
+                        column = 2 * self._column(leg.name)
+                        cols.append(column + (leg.side == Side.OFFER))
+                        coefficients.append(sign)
+                constants.append(constant)
+        # Merge repeated (row, column) entries, keeping them sorted by row
+        width = max(2 * len(self.names), 1)
+        keys, inverse = np.unique(
+            np.asarray(rows, dtype=np.int64) * width + np.asarray(cols, dtype=np.int64),
+            return_inverse=True,
+        )
+        self._rows = keys // width
+        self._cols = keys % width
+        self._coefficients = np.bincount(
+            inverse,
+            weights=np.asarray(coefficients, dtype=np.float64),
+            minlength=len(keys),
+        )
+        self._constants = np.asarray(constants, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.relations)
+
+    def _column(self, name: str) -> int:
+        if name not in self._columns:
+            self._columns[name] = len(self.names)
+            self.names.append(name)
+            self._market_ids.append(None)
+        return self._columns[name]
+
+    def _resolve(self, state: State) -> List[Optional[int]]:
+        ids = self._market_ids
+        for i, market_id in enumerate(ids):
+            market = state.markets.get(market_id) if market_id is not None else None
+            if market is None or market.name != self.names[i]:
+                by_name = market_by_name(state)
+                for j, name in enumerate(self.names):
+                    market = by_name.get(name)
+                    ids[j] = market.id if market is not None else None
+                break
+        return ids
+
+    def prices(self, state: State) -> np.ndarray:
+        """
+        Best bid and best offer of each market in `names`, interleaved, with NaN
+        for an empty side or a market that doesn't exist.
+        """
+        prices = np.full(2 * len(self.names), np.nan)
+        for i, market_id in enumerate(self._resolve(state)):
+            book = state.books.get(market_id) if market_id is not None else None
+            if book is None:
+                continue
+            bid = book.best_bid()
+            if bid is not None:
+                prices[2 * i] = bid.price
+            offer = book.best_offer()
+            if offer is not None:
+                prices[2 * i + 1] = offer.price
+        return prices
+
+    def edges(self, state: State) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Per relation, how much `right` is worth over `left`, and `-left` over
+        `-right`: `right.best_price() - left.best_price()` and
+        `(-left).best_price() - (-right).best_price()`. Positive is an arbitrage;
+        NaN when a leg has nothing to trade against.
+        """
+        prices = self.prices(state)
+        totals = np.bincount(
+            self._rows,
+            weights=self._coefficients * prices[self._cols],
+            minlength=len(self._constants),
+        )
+        totals += self._constants
+        return totals[0::2], totals[1::2]
+
+    def opportunities(
+        self, state: State, min_edge: float = 0.0
+    ) -> List[Tuple[Arbsket, Arbsket, float]]:
+        """
+        `(cheap, dear, edge)` of every relation whose edge is over `min_edge`, ready
+        for `do_arb.basket_orders(cheap, dear)`: `(left, right)` to buy `left`
+        against `right`, or `(-right, -left)` for the reverse trade.
+        """
+        buy, sell = self.edges(state)
+        result = []
+        for i in np.flatnonzero(buy > min_edge):
+            left, right = self.relations[i]
+            result.append((left, right, float(buy[i])))
+        for i in np.flatnonzero(sell > min_edge):
+            left, right = self.relations[i]
+            result.append((-right, -left, float(sell[i])))
+        return result
+
 from unittest.mock import Mock, MagicMock
 from dataclasses import dataclass, field
 from typing import Dict, List
@@ -323,6 +451,115 @@ def calculate_size(left: Arbsket, right: Arbsket):
     result_right = round(min(min_right, desired_ratio**-1 * min_left), 2)
     return result_left, result_right
 
+def leg_depth(leg: Arbmark, max_levels: Optional[int] = None):
+    """
+    Prices and cumulative sizes of the levels `leg` trades against, best first.
+    """
+    levels = leg.book().depth(leg.side, max_levels)
+    prices = np.fromiter((price for price, _ in levels), np.float64, len(levels))
+    sizes = np.fromiter((size for _, size in levels), np.float64, len(levels))
+    return prices, np.cumsum(sizes)
+
+@dataclass
+class BasketSize:
+    size: float
+    """
+    Baskets to trade: each leg's order is for this size, so a leg repeated four
+    times in a basket trades four times it.
+    """
+    edge: float
+    """
+    Expected total profit of trading `size` baskets down to the limit prices.
+    """
+    left_prices: List[Optional[float]]
+    """
+    Limit price of each leg of `left`, in order, or None for an `Arbval`.
+    """
+    right_prices: List[Optional[float]]
+
+def size_by_depth(
+    left: Arbsket, right: Arbsket, max_levels: Optional[int] = None
+) -> BasketSize:
+    """
+    The most baskets of `left` against `right` whose marginal edge stays positive,
+    walking the depth of every leg rather than just its best order.
+
+    Each distinct market and side is read into price and cumulative size arrays; a
+    leg repeated n times uses up its depth n times as fast. The edge is piecewise
+    constant between the points where some leg moves to its next level, so it's
+    evaluated once per such segment, and the size stops at the first segment that
+    isn't profitable or where a leg runs out of depth. Levels are read 16 at a
+    time, doubling while the edge is still positive at the last level read, so an
+    arbitrage a few levels deep doesn't copy out whole books. Only the top
+    `max_levels` levels of each leg are considered, if given.
+    """
+    legs: Dict[Tuple[str, Side], List] = {}
+    constant = 0.0
+    for sign, basket in ((-1.0, left), (1.0, right)):
+        for leg in basket.composition:
+            if isinstance(leg, Arbval):
+                constant += sign * leg.value
+                continue
+            entry = legs.setdefault((leg.name, leg.side), [leg, 0, 0.0])
+            entry[1] += 1
+            entry[2] += sign
+
+    levels = 16 if max_levels is None else min(16, max_levels)
+    while True:
+        depths = []
+        for (name, side), (leg, count, coefficient) in legs.items():
+            prices, cumulative = leg_depth(leg, levels)
+            depths.append((name, side, prices, cumulative / count, coefficient))
+        # A basket can't be bigger than the depth of its thinnest leg
+        limit = min(
+            (breaks[-1] if len(breaks) else 0.0 for *_, breaks, _ in depths),
+            default=0.0,
+        )
+        size, edge, exhausted = _walk(depths, constant, limit)
+        # Read deeper only if the edge was still positive where the thinnest leg
+        # ran out, and that leg has more levels
+        truncated = any(
+            len(prices) == levels and breaks[-1] <= limit
+            for _, _, prices, breaks, _ in depths
+        )
+        if not (exhausted and truncated) or levels == max_levels:
+            break
+        levels = levels * 2 if max_levels is None else min(levels * 2, max_levels)
+
+    limits = {}
+    if size > 0:
+        for name, side, prices, breaks, _ in depths:
+            limits[name, side] = float(prices[np.searchsorted(breaks, size)])
+
+    def prices_of(basket: Arbsket):
+        return [
+            None if isinstance(leg, Arbval) else limits.get((leg.name, leg.side))
+            for leg in basket.composition
+        ]
+    return BasketSize(size, edge, prices_of(left), prices_of(right))
+
+def _walk(depths, constant: float, limit: float) -> Tuple[float, float, bool]:
+    """
+    Size and edge up to `limit` baskets, and whether the edge was still positive
+    there.
+    """
+    if limit <= 0:
+        return 0.0, 0.0, False
+    points = np.unique(np.concatenate(
+        [breaks[breaks < limit] for *_, breaks, _ in depths] + [np.array([limit])]
+    ))
+    marginal = np.full(len(points), constant)
+    for _, _, prices, breaks, coefficient in depths:
+        marginal += coefficient * prices[np.searchsorted(breaks, points)]
+    unprofitable = np.flatnonzero(marginal <= 0)
+    end = unprofitable[0] if len(unprofitable) else len(points)
+    if end == 0:
+        return 0.0, 0.0, False
+    # Sizes are in hundredths on the exchange
+    size = math.floor(points[end - 1] * 100 + 1e-9) / 100
+    widths = np.diff(np.minimum(points[:end], size), prepend=0.0)
+    return size, float(widths @ marginal[:end]), end == len(points)
+
 if __name__ == "__main__":
     client = TradingClient(API_URL, JWT, ACT_AS)
     act_as_by_name(client, 'Goofy')
@@ -0,0 +1,15 @@
+import os
+import tempfile
+
+# config.py reads config.toml from the working directory on import. Import it once
+# from a throwaway one, so the modules under test load without an account; the
+# tests never connect.
+_cwd = os.getcwd()
+with tempfile.TemporaryDirectory() as _directory:
+    with open(os.path.join(_directory, "config.toml"), "w") as config_toml:
+        config_toml.write('[api]\nurl = "ws://localhost:8080"\njwt = ""\nact_as = ""\n')
+    os.chdir(_directory)
+    try:
+        import config  # noqa: F401
+    finally:
+        os.chdir(_cwd)
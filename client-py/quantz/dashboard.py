@@ -14,6 +14,7 @@ from market import (
     TradingClient, 
     Side, 
     Market, 
+    OrderBook,
     Portfolio,
     State
 )
@@ -44,6 +45,14 @@ class DashboardClient:
             for id, name in self.market_names.items()
         }
     
+    def get_books(self) -> Dict[str, Optional[OrderBook]]:
+        """Get the order book of each market with human-readable names."""
+        state = self.client.state()
+        return {
+            name: state.books.get(id)
+            for id, name in self.market_names.items()
+        }
+    
     def get_portfolio(self) -> Portfolio:
         """Get current portfolio state."""
         return self.client.state().portfolio
@@ -54,7 +63,7 @@ class Dashboard:
     def __init__(self):
         self.console = Console()
 
-    def create_market_table(self, market: Market, name: str) -> Table:
+    def create_market_table(self, market: Market, name: str, book: Optional[OrderBook] = None) -> Table:
         """Create a rich table showing market order book."""
         table = Table(title=f"Market: {name.upper()}", box=box.ROUNDED)
         
@@ -64,16 +73,14 @@ class Dashboard:
         table.add_column("Size", justify="right")
         table.add_column("Total Value", justify="right")
         
-        # Sort and group orders by side
-        bids = [o for o in market.orders if o.side == Side.BID]
-        offers = [o for o in market.orders if o.side == Side.OFFER]
-        
-        # Sort bids descending, offers ascending
-        bids.sort(key=lambda x: x.price, reverse=True)
-        offers.sort(key=lambda x: x.price)
+        # Top 5 of each side, best first
+        if book is None:
+            book = OrderBook(market.orders)
+        bids = book.bids(5)
+        offers = book.offers(5)
         
         # Add offers (sells) in red
-        for order in offers[:5]:  # Top 5 offers
+        for order in offers:
             total = order.price * order.size
             table.add_row(
                 "SELL",
@@ -89,7 +96,7 @@ class Dashboard:
             table.add_row("SPREAD", f"{spread:.2f}", "", "", style="yellow bold")
         
         # Add bids (buys) in green
-        for order in bids[:5]:  # Top 5 bids
+        for order in bids:
             total = order.price * order.size
             table.add_row(
                 "BUY",
@@ -132,7 +139,7 @@ class Dashboard:
         
         return Panel(text, title="Portfolio", box=box.ROUNDED)
 
-    def display(self, markets: Dict[str, Market], portfolio: Portfolio):
+    def display(self, markets: Dict[str, Market], portfolio: Portfolio, books: Optional[Dict[str, Optional[OrderBook]]] = None):
         """Display the main dashboard."""
         self.console.clear()
         
@@ -142,7 +149,8 @@ class Dashboard:
         # Display each market
         for name, market in markets.items():
             if market:
-                self.console.print(self.create_market_table(market, name))
+                book = books.get(name) if books else None
+                self.console.print(self.create_market_table(market, name, book))
                 self.console.print(self.create_trades_table(market))
                 self.console.print()
 
@@ -158,8 +166,9 @@ def main():
         while True:
             try:
                 markets = client.get_markets()
+                books = client.get_books()
                 portfolio = client.get_portfolio()
-                dashboard.display(markets, portfolio)
+                dashboard.display(markets, portfolio, books)
                 sleep(1)  # Update frequency
             except Exception as e:
                 logger.error(f"Error updating dashboard: {e}")
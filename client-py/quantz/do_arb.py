@@ -1,5 +1,5 @@
-from arb import Arbmark, Arbsket, Arbval, calculate_size
-from market import TradingClient, Side, Market, Order, ClientMessage
+from arb import Arbmark, Arbsket, Arbval, calculate_size, size_by_depth
+from market import TradingClient, Side, Market, Order, ClientMessage, CancelOrder, RequestFailed
 from config import API_URL, JWT, ACT_AS
 
 def tw_test_sum(dry_run=True):
@@ -51,36 +51,60 @@ def arb_diff(dry_run=True):
     right_side = Arbsket([sum, offset])
     do_arb(client, left_side, right_side, dry_run)
 
+def execute_legs(client, orders):
+    # Send every leg at once so the basket costs one round trip instead of one per leg,
+    # then cancel whatever is left resting in a second batch. A failed leg doesn't stop
+    # the others, so cancel the legs that did rest before raising its error.
+    if not orders:
+        return
+    msgs = client.request_many(
+        [ClientMessage(create_order=order) for order in orders],
+        raise_on_failure=False,
+    )
+    failures = [msg for msg in msgs if isinstance(msg, RequestFailed)]
+    cancels = [
+        ClientMessage(cancel_order=CancelOrder(id=msg.order_created.order.id))
+        for msg in msgs
+        if not isinstance(msg, RequestFailed) and msg.order_created.order.id > 0
+    ]
+    if cancels:
+        for result in client.request_many(cancels, raise_on_failure=False):
+            if isinstance(result, RequestFailed):
+                print(result)
+    if failures:
+        raise failures[0]
+
+def basket_orders(left_side, right_side):
+    # Size on the depth of every leg and send each leg at the worst price it needs
+    sizing = size_by_depth(left_side, right_side)
+    print(sizing.size, sizing.edge)
+    orders = []
+    if sizing.size > 0:
+        for basket, prices in (
+            (left_side, sizing.left_prices),
+            (right_side, sizing.right_prices),
+        ):
+            orders.extend(
+                leg.create_order(sizing.size, price)
+                for leg, price in zip(basket.composition, prices)
+                if price is not None
+            )
+    return orders
+
 def do_arb(client, left_side, right_side, dry_run=True):
     orders = []
     if left_side.best_price() < right_side.best_price():
-        left, right = calculate_size(left_side, right_side)
-        print(left, right)
-        orders.extend([a.create_order(left) for a in left_side.composition])
-        orders.extend([a.create_order(right) for a in right_side.composition])
+        orders = basket_orders(left_side, right_side)
     print(orders)
     if not dry_run:
-      msgs = []
-      for order in orders:
-          msgs.append(client.request(ClientMessage(create_order=order)))
-      for msg in msgs:
-          if msg.order_created.order.id > 0:
-              client.request(ClientMessage(cancel_order=msg.order_created.order.d))
+        execute_legs(client, orders)
       
     orders = []
     if (-right_side).best_price() < (-left_side).best_price():
-        left, right = calculate_size(-left_side, -right_side)
-        print(left, right)
-        orders.extend([a.create_order(left) for a in (-left_side).composition])
-        orders.extend([a.create_order(right) for a in (-right_side).composition])
+        orders = basket_orders(-right_side, -left_side)
     print(orders)
     if not dry_run:
-      msgs = []
-      for order in orders:
-          msgs.append(client.request(ClientMessage(create_order=order)))
-      for msg in msgs:
-          if msg.order_created.order.id > 0:
-              client.request(ClientMessage(cancel_order=msg.order_created.order.id))
+        execute_legs(client, orders)
 
 if __name__ == "__main__":
     tw_test_sum()
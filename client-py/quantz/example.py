@@ -26,11 +26,13 @@ def act_as_by_name(client: TradingClient, name: str):
     return act_as(client, bot_by_name(client.state())[name].id)
 
 def positions_by_user(client: TradingClient, market_name: str):
-    market = market_by_name(client.state())[market_name]
+    state = client.state()
+    market = market_by_name(state)[market_name]
+    users = users_by_id(state)
     positions = defaultdict(float)
     for trade in market.trades:
-        buyer = users_by_id(client.state())[trade.buyer_id].name
-        seller = users_by_id(client.state())[trade.seller_id].name
+        buyer = users[trade.buyer_id].name
+        seller = users[trade.seller_id].name
         positions[buyer] += trade.size
         positions[seller] -= trade.size
     return positions
@@ -2,16 +2,12 @@ import betterproto
 from market import TradingClient, ClientMessage, State
 
 def users_by_id(state: State):
-    return {
-        user.id: user
-        for user in state.users
-    }
+    return dict(state.users_by_id)
 
 def bot_by_name(state: State):
-    ownership_ids = [ownership.of_bot_id for ownership in state.ownerships]
     owned_bots = [
         user for user in state.users
-        if user.id in ownership_ids and user.is_bot
+        if user.id in state.ownerships_by_bot_id and user.is_bot
     ]
     return {
         bot.name[4:]: bot
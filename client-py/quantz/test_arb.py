@@ -2,8 +2,19 @@ from unittest.mock import Mock, MagicMock
 from dataclasses import dataclass, field
 from typing import Dict, List
 
-from arb import Arbmark, Arbsket, Arbval
-from market import TradingClient, Side, Market, Order
+import math
+
+from arb import Arbmark, Arbsket, Arbval, RelationSet, calculate_size, size_by_depth
+from do_arb import basket_orders
+from market import (
+    TradingClient,
+    Side,
+    Market,
+    MarketOpen,
+    Order,
+    ServerMessage,
+    State,
+)
 
 def create_mock_client():
     """Creates a mock TradingClient that returns specified markets in its state"""
@@ -30,40 +41,12 @@ def create_mock_client():
     return mock_client
 
 def create_mock_client_with_sum_arb():
-    """Creates a mock TradingClient that returns specified markets in its state"""
-    mock_client = MagicMock()
-    
-    # Create mock state with markets dict
-    mock_state = MagicMock()
-    ricki_time = Arbmark(mock_client, 'ricki_time', Side.OFFER)
-    ricki_time.name = 'ricki_time'
-    ricki_time.id = 1
-    ricki_time_bid_order = Order(market_id=ricki_time.id, side=Side.BID, price=8, size=1)
-    ricki_time_ask_order = Order(market_id=ricki_time.id, side=Side.OFFER, price=10, size=1)
-    ricki_time.orders = MagicMock(return_value=[ricki_time_bid_order, ricki_time_ask_order])
-
-    david_time = Arbmark(mock_client, 'david_time', Side.OFFER)
-    david_time.name = 'david_time'
-    david_time.id = 2
-    david_time_bid_order = Order(market_id=david_time.id, side=Side.BID, price=18, size=1)
-    david_time_ask_order = Order(market_id=david_time.id, side=Side.OFFER, price=20, size=1)
-    david_time.orders = MagicMock(return_value=[david_time_bid_order, david_time_ask_order])
-
-    sum = MagicMock()
-    sum.name = 'sum'
-    sum.id = 3
-    sum_bid_order = Order(market_id=sum.id, side=Side.BID, price=32, size=1)
-    sum_ask_order = Order(market_id=sum.id, side=Side.OFFER, price=34, size=1)
-    sum.orders = MagicMock(return_value=[sum_bid_order, sum_ask_order])
-
-    mock_markets = {
-        'ricki_time': ricki_time,
-        'david_time': david_time,
-        'sum': sum,
-    }
-    mock_state.markets = mock_markets
-    mock_client.state.return_value = mock_state
-    return mock_client
+    """Creates a mock TradingClient whose state holds books with a sum arb"""
+    return create_client_with_books({
+        'ricki_time': [quote(1, Side.BID, 8), quote(2, Side.OFFER, 10)],
+        'david_time': [quote(3, Side.BID, 18), quote(4, Side.OFFER, 20)],
+        'sum': [quote(5, Side.BID, 32), quote(6, Side.OFFER, 34)],
+    })
 
 def test_arb():
     client = create_mock_client_with_sum_arb()
@@ -75,24 +58,156 @@ def test_arb():
     left_side = Arbsket([ricki_time, david_time])
     right_side = Arbsket([sum])
 
+    # Buying both times at 10 + 20 and selling the sum at 32
     orders = []
     if left_side.best_price() < right_side.best_price():
-        orders.append(left_side.create_order())
-        orders.append(right_side.create_order())
+        orders.extend(leg.create_order(1) for leg in left_side.composition)
+        orders.extend(leg.create_order(1) for leg in right_side.composition)
+    assert [(o.market_id, o.side, o.price) for o in orders] == [
+        (1, Side.BID, 10),
+        (2, Side.BID, 20),
+        (3, Side.OFFER, 32),
+    ]
 
-    print(orders)
-    
-    orders = []
-    if -right_side.best_price() < -left_side.best_price():
-        orders.append(-right_side.create_order())
-        orders.append(-left_side.create_order())
-    
-    print(orders)
+    # Selling both times at 8 + 18 and buying the sum at 34 loses
+    assert not (-right_side).best_price() < (-left_side).best_price()
+    assert (-right_side).best_price() == 34
+    assert (-left_side).best_price() == 26
+
+def create_client_with_books(books: Dict[str, List[Order]]):
+    """Creates a mock TradingClient whose state holds real books with these orders"""
+    state = State()
+    for market_id, (name, orders) in enumerate(books.items(), start=1):
+        for order in orders:
+            order.market_id = market_id
+        state._update(ServerMessage(market_data=Market(
+            id=market_id, name=name, open=MarketOpen(), orders=orders
+        )))
+    mock_client = MagicMock()
+    mock_client.state.return_value = state
+    return mock_client
 
-    shift = Arbval(30, Side.BID)
+def quote(order_id: int, side: Side, price: float, size: float = 1):
+    return Order(id=order_id, side=side, price=price, size=size)
+
+def test_relation_set_matches_arbsket_prices():
+    client = create_client_with_books({
+        'a': [quote(1, Side.BID, 8), quote(2, Side.OFFER, 10)],
+        'b': [quote(3, Side.BID, 18), quote(4, Side.OFFER, 20)],
+        'sum': [quote(5, Side.BID, 32), quote(6, Side.OFFER, 34)],
+        'avg': [quote(7, Side.BID, 6), quote(8, Side.OFFER, 7)],
+        'diff': [quote(9, Side.BID, 95)],
+    })
+    a = Arbmark(client, 'a', Side.OFFER)
+    b = Arbmark(client, 'b', Side.OFFER)
+    sum = Arbmark(client, 'sum', Side.BID)
+    avg = Arbmark(client, 'avg', Side.OFFER)
     diff = Arbmark(client, 'diff', Side.BID)
-    left_side = Arbsket([ricki_time, david_time])
-    right_side = Arbsket([diff, shift])
+    relations = [
+        (Arbsket([a, b]), Arbsket([sum])),
+        (Arbsket([avg, avg, avg, avg]), Arbsket([sum])),
+        (Arbsket([a, -b]), Arbsket([diff, Arbval(-100, Side.BID)])),
+    ]
+    relation_set = RelationSet(relations)
+    assert relation_set.names == ['a', 'b', 'sum', 'avg', 'diff']
+
+    buy, sell = relation_set.edges(client.state())
+    for (left, right), buy_edge in zip(relations, buy):
+        assert buy_edge == right.best_price() - left.best_price()
+    for (left, right), sell_edge in zip(relations[:2], sell):
+        assert sell_edge == (-left).best_price() - (-right).best_price()
+    assert list(buy) == [2, 4, -33]
+    assert math.isnan(sell[2])  # nothing offered in diff
+
+    opportunities = relation_set.opportunities(client.state())
+    assert [(left, edge) for left, _, edge in opportunities] == [
+        (relations[0][0], 2.0),
+        (relations[1][0], 4.0),
+    ]
+
+def test_relation_set_sell_side_goes_to_basket_orders():
+    client = create_client_with_books({
+        'a': [quote(1, Side.BID, 12), quote(2, Side.OFFER, 14)],
+        'b': [quote(3, Side.BID, 22), quote(4, Side.OFFER, 24)],
+        'sum': [quote(5, Side.BID, 28), quote(6, Side.OFFER, 30)],
+    })
+    left = Arbsket([Arbmark(client, 'a', Side.OFFER), Arbmark(client, 'b', Side.OFFER)])
+    right = Arbsket([Arbmark(client, 'sum', Side.BID)])
+
+    # Selling a and b at 12 + 22 and buying the sum at 30
+    [(cheap, dear, edge)] = RelationSet([(left, right)]).opportunities(client.state())
+    assert edge == 4
+    orders = basket_orders(cheap, dear)
+    assert [(o.market_id, o.side, o.price, o.size) for o in orders] == [
+        (3, Side.BID, 30, 1),
+        (1, Side.OFFER, 12, 1),
+        (2, Side.OFFER, 22, 1),
+    ]
+
+def test_relation_set_follows_markets_by_name():
+    client = create_client_with_books({'a': [quote(1, Side.OFFER, 10)]})
+    relation_set = RelationSet([
+        (Arbsket([Arbmark(client, 'a', Side.OFFER)]),
+         Arbsket([Arbmark(client, 'b', Side.BID)])),
+    ])
+    buy, _ = relation_set.edges(client.state())
+    assert math.isnan(buy[0])
+
+    client.state.return_value = create_client_with_books({
+        'b': [quote(2, Side.BID, 12)],
+        'a': [quote(1, Side.OFFER, 10)],
+    }).state()
+    buy, _ = relation_set.edges(client.state())
+    assert buy[0] == 2
+
+def test_size_by_depth_walks_every_level():
+    client = create_client_with_books({
+        'a': [quote(1, Side.OFFER, 10, 1), quote(2, Side.OFFER, 11, 5)],
+        'b': [quote(3, Side.OFFER, 20, 1), quote(4, Side.OFFER, 21, 5)],
+        'sum': [quote(5, Side.BID, 40, 3), quote(6, Side.BID, 33, 10)],
+    })
+    left = Arbsket([Arbmark(client, 'a', Side.OFFER), Arbmark(client, 'b', Side.OFFER)])
+    right = Arbsket([Arbmark(client, 'sum', Side.BID)])
+    assert calculate_size(left, right)[0] == 1
+
+    sizing = size_by_depth(left, right)
+    # 10 per basket for the first, 8 for the next two, then 1 until a and b run out
+    assert (sizing.size, sizing.edge) == (6, 29)
+    assert (sizing.left_prices, sizing.right_prices) == ([11, 21], [33])
+
+    # Only the top level of each leg
+    assert size_by_depth(left, right, max_levels=1).size == 1
+    # Constants count towards the edge
+    for shift, size in ((-7, 3), (-40, 0)):
+        shifted = Arbsket(right.composition + [Arbval(shift, Side.BID)])
+        assert size_by_depth(left, shifted).size == size
+
+def test_size_by_depth_repeated_legs():
+    client = create_client_with_books({
+        'avg': [quote(1, Side.OFFER, 7, 2), quote(2, Side.OFFER, 8, 8)],
+        'sum': [quote(3, Side.BID, 30, 1), quote(4, Side.BID, 29, 5)],
+    })
+    avg = Arbmark(client, 'avg', Side.OFFER)
+    left = Arbsket([avg, avg, avg, avg])
+    right = Arbsket([Arbmark(client, 'sum', Side.BID)])
+
+    # Four avg at 7 cost 28 against 30 for the sum, until the 2 avg offered at 7
+    # are used up half a basket in
+    sizing = size_by_depth(left, right)
+    assert (sizing.size, sizing.edge) == (0.5, 1)
+    assert (sizing.left_prices, sizing.right_prices) == ([7] * 4, [30])
+
+def test_size_by_depth_reads_deeper_while_profitable():
+    client = create_client_with_books({
+        'a': [quote(i, Side.OFFER, 10 + i / 100) for i in range(1, 41)],
+        'sum': [quote(100 + i, Side.BID, 20 - i / 100) for i in range(1, 101)],
+    })
+    left = Arbsket([Arbmark(client, 'a', Side.OFFER)])
+    right = Arbsket([Arbmark(client, 'sum', Side.BID)])
+    sizing = size_by_depth(left, right)
+    assert sizing.size == 40
+    assert (sizing.left_prices, sizing.right_prices) == ([10.4], [19.6])
+    assert size_by_depth(left, right, max_levels=20).size == 20
 
 if __name__ == "__main__":
     test_arb()
\ No newline at end of file
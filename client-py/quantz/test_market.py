@@ -0,0 +1,38 @@
+import importlib
+
+import pytest
+
+import market
+import order_book
+import trading_client
+import websocket_api
+
+SCRIPTS = [
+    'arb',
+    'avg_arb',
+    'diff_arb',
+    'do_arb',
+    'example',
+    'mapping',
+    'profits',
+    'repl',
+    'sum_arb',
+    'utils',
+]
+
+def test_market_reexports_the_shared_client():
+    assert market.TradingClient is trading_client.TradingClient
+    assert market.State is trading_client.State
+    assert market.RequestFailed is trading_client.RequestFailed
+    assert market.OrderBook is order_book.OrderBook
+    for name in ('ServerMessage', 'ClientMessage', 'Market', 'Order', 'Side'):
+        assert getattr(market, name) is getattr(websocket_api, name)
+
+@pytest.mark.parametrize('name', SCRIPTS + ['dashboard', 'exposure'])
+def test_scripts_use_the_shared_client(name):
+    if name not in SCRIPTS:
+        pytest.importorskip('rich')
+    script = importlib.import_module(name)
+    for attribute in ('TradingClient', 'State', 'Side', 'Market', 'Order'):
+        if hasattr(script, attribute):
+            assert getattr(script, attribute) is getattr(market, attribute)
@@ -1,9 +1,10 @@
 from collections import defaultdict
-from typing import List, Union
+from typing import List, Optional, Union
 import betterproto
 from market import (
     ActAs,
     ActingAs,
+    ClientPool,
     TradingClient, 
     Side, 
     Market, 
@@ -37,15 +38,30 @@ bots_by_name = {
     },
 }
 
-def act_as_by_name(client: TradingClient, name: str):
-    return TradingClient(API_URL, bots_by_name[name]['token'], bots_by_name[name]['id'])
+def act_as_by_name(
+    client: TradingClient, name: str, pool: Optional[ClientPool] = None
+) -> TradingClient:
+    """
+    A connection acting as one of `bots_by_name`: a new TradingClient with the full
+    state, or with `pool`, e.g. `ClientPool(API_URL, public=client)`, the pool's
+    long-lived connection for the bot. A pooled connection's state holds no market
+    data, only the bot's own portfolio; read markets from `client`, or
+    `watch_market` the ones the bot should follow.
+    """
+    bot = bots_by_name[name]
+    if pool is None:
+        return TradingClient(API_URL, bot['token'], bot['id'])
+    pool.add(name, bot['token'], bot['id'])
+    return pool[name]
 
 def positions_by_user(client: TradingClient, market_name: str):
-    market = market_by_name(client.state())[market_name]
+    state = client.state()
+    market = market_by_name(state)[market_name]
+    users = users_by_id(state)
     positions = defaultdict(float)
     for trade in market.trades:
-        buyer = users_by_id(client.state())[trade.buyer_id].name
-        seller = users_by_id(client.state())[trade.seller_id].name
+        buyer = users[trade.buyer_id].name
+        seller = users[trade.seller_id].name
         positions[buyer] += trade.size
         positions[seller] -= trade.size
     return positions
\ No newline at end of file
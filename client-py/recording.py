@@ -0,0 +1,206 @@
+"""
+Recording of the raw frames exchanged with the server.
+
+A recording is a directory of segment files. Each segment starts with a header and
+holds blocks of records, optionally zlib-compressed; each record is the direction of
+a frame, the `time.monotonic_ns()` at which it was received or sent, and the frame
+itself, length-prefixed. Records are buffered into blocks in memory, so recording a
+frame on the hot path is a struct pack and a copy into a bytearray.
+"""
+
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Iterator, List, NamedTuple, Optional
+
+RECEIVED = 0
+SENT = 1
+
+SEGMENT_SUFFIX = ".frames"
+
+_MAGIC = b"TBCREC\x00\x01"
+# flags, wall clock and monotonic clock in ns when the segment was opened
+_segment_header = struct.Struct("<Bqq")
+# stored (possibly compressed) length, raw length
+_block_header = struct.Struct("<II")
+# direction, monotonic ns, frame length
+_record_header = struct.Struct("<BqI")
+_COMPRESSED = 1
+
+
+class Frame(NamedTuple):
+    direction: int
+    """
+    `RECEIVED` or `SENT`.
+    """
+    timestamp_ns: int
+    """
+    `time.monotonic_ns()` when the frame was received or sent.
+    """
+    data: bytes
+
+
+class Recorder:
+    """
+    Appends frames to rotating segment files in `directory`.
+
+    Records are buffered into blocks of about `block_bytes`, each written (and
+    compressed, with `compress`) in one go; a block is also written by the first
+    record once `flush_interval` seconds have passed since the last one, and by
+    `flush()`. A new segment is started once one reaches `segment_bytes`.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        *,
+        compress: bool = True,
+        segment_bytes: int = 256 << 20,
+        block_bytes: int = 256 << 10,
+        flush_interval: float = 1.0,
+    ):
+        self.directory = directory
+        self.compress = compress
+        self.segment_bytes = segment_bytes
+        self.block_bytes = block_bytes
+        self._flush_interval_ns = int(flush_interval * 1e9)
+        self._buffer = bytearray()
+        self._last_flush_ns = time.monotonic_ns()
+        self._lock = threading.Lock()
+        self.frames = 0
+        self.bytes_written = 0
+        os.makedirs(directory, exist_ok=True)
+        existing = segments(directory)
+        self._next_segment = (
+            int(os.path.basename(existing[-1])[: -len(SEGMENT_SUFFIX)]) + 1
+            if existing
+            else 0
+        )
+        self._file = None
+        self._open_segment()
+
+    def record(self, direction: int, frame: bytes):
+        timestamp_ns = time.monotonic_ns()
+        with self._lock:
+            buffer = self._buffer
+            buffer += _record_header.pack(direction, timestamp_ns, len(frame))
+            buffer += frame
+            self.frames += 1
+            if (
+                len(buffer) >= self.block_bytes
+                or timestamp_ns - self._last_flush_ns >= self._flush_interval_ns
+            ):
+                self._write_block(timestamp_ns)
+
+    def flush(self):
+        """
+        Write out buffered records.
+        """
+        with self._lock:
+            self._write_block(time.monotonic_ns())
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._write_block(time.monotonic_ns())
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _open_segment(self):
+        if self._file is not None:
+            self._file.close()
+        path = os.path.join(self.directory, f"{self._next_segment:06}{SEGMENT_SUFFIX}")
+        self._next_segment += 1
+        self._file = open(path, "wb")
+        flags = _COMPRESSED if self.compress else 0
+        self._file.write(_MAGIC)
+        self._file.write(
+            _segment_header.pack(flags, time.time_ns(), time.monotonic_ns())
+        )
+        self._segment_size = len(_MAGIC) + _segment_header.size
+
+    def _write_block(self, now_ns: int):
+        self._last_flush_ns = now_ns
+        if not self._buffer or self._file is None:
+            return
+        raw = bytes(self._buffer)
+        self._buffer.clear()
+        stored = zlib.compress(raw, 1) if self.compress else raw
+        self._file.write(_block_header.pack(len(stored), len(raw)))
+        self._file.write(stored)
+        written = _block_header.size + len(stored)
+        self._segment_size += written
+        self.bytes_written += written
+        if self._segment_size >= self.segment_bytes:
+            self._open_segment()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def segments(path: str) -> List[str]:
+    """
+    The segment files of a recording directory in order, or `[path]` for a segment.
+    """
+    if not os.path.isdir(path):
+        return [path]
+    return sorted(
+        os.path.join(path, name)
+        for name in os.listdir(path)
+        if name.endswith(SEGMENT_SUFFIX)
+    )
+
+
+def read(path: str, direction: Optional[int] = None) -> Iterator[Frame]:
+    """
+    The frames of a recording directory or segment file, in the order they were
+    recorded, optionally only those received or sent.
+
+    Segments are memory-mapped; records of the other direction are skipped without
+    being copied. A block cut short by a crash ends its segment.
+    """
+    for segment in segments(path):
+        yield from _read_segment(segment, direction)
+
+
+def _read_segment(path: str, direction: Optional[int]) -> Iterator[Frame]:
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < len(_MAGIC) + _segment_header.size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[: len(_MAGIC)] != _MAGIC:
+                raise ValueError(f"{path} is not a recording segment")
+            flags, _, _ = _segment_header.unpack_from(data, len(_MAGIC))
+            compressed = bool(flags & _COMPRESSED)
+            pos = len(_MAGIC) + _segment_header.size
+            end = len(data)
+            while pos + _block_header.size <= end:
+                stored_length, raw_length = _block_header.unpack_from(data, pos)
+                start = pos + _block_header.size
+                pos = start + stored_length
+                if pos > end:
+                    return
+                if compressed:
+                    block = zlib.decompress(data[start:pos], bufsize=raw_length)
+                    yield from _records(block, 0, len(block), direction)
+                else:
+                    yield from _records(data, start, pos, direction)
+
+
+def _records(block, pos: int, end: int, direction: Optional[int]) -> Iterator[Frame]:
+    unpack_from = _record_header.unpack_from
+    header_size = _record_header.size
+    while pos < end:
+        frame_direction, timestamp_ns, length = unpack_from(block, pos)
+        pos += header_size
+        if direction is None or frame_direction == direction:
+            yield Frame(frame_direction, timestamp_ns, block[pos : pos + length])
+        pos += length
@@ -0,0 +1,343 @@
+"""
+Replay of a session recorded with `TradingClient(recording=...)`.
+
+`ReplayClient` is a `TradingClient` whose socket hands out the recorded frames
+instead of talking to a server, so bots and scripts written against `TradingClient`
+run unchanged on historical data, and the decoding, `State._update` and `events`
+they go through are the live ones.
+
+    python replay.py recordings/ --codec fast
+"""
+
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Iterator, List, Optional
+
+import betterproto
+import typer
+import websocket_api
+from codec import get_codec
+from recording import RECEIVED, Frame, read
+from trading_client import TradingClient
+from websockets.exceptions import ConnectionClosed, ConnectionClosedOK
+
+# Ids of the orders placed during a replay, well clear of the server's
+_FIRST_REPLAY_ORDER_ID = 1 << 60
+
+
+class ReplaySocket:
+    """
+    Stands in for the websocket of a `ReplayClient`.
+
+    `recv` returns responses to requests made during the replay first, then each
+    recorded frame once the replay clock reaches its timestamp. With a `speed`, the
+    clock follows wall time multiplied by it. At full speed, the clock only moves when
+    told to (`advance`) or when `recv` is called without a timeout, in which case it
+    jumps straight to the next frame; a replay is then the same whatever the machine.
+    """
+
+    def __init__(self, frames: Iterator[Frame], speed: Optional[float] = None):
+        self._frames = frames
+        self._next = next(frames, None)
+        self._speed = speed
+        self._responses: Deque[bytes] = deque()
+        self._wake = threading.Condition()
+        self._closed = False
+        self.first_ns = self.clock_ns = self.last_ns = (
+            self._next.timestamp_ns if self._next is not None else 0
+        )
+        self._started_ns = time.monotonic_ns()
+        self.frames = 0
+
+    @property
+    def finished(self) -> bool:
+        return self._next is None and not self._responses
+
+    def advance(self, seconds: float):
+        """
+        Move the clock of a full-speed replay on by `seconds` of recorded time.
+        """
+        self.clock_ns += int(seconds * 1e9)
+
+    def recv(self, timeout: Optional[float] = None) -> bytes:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._wake:
+            while True:
+                if self._closed:
+                    raise ConnectionClosedOK(None, None)
+                if self._responses:
+                    return self._responses.popleft()
+                frame = self._next
+                if frame is None:
+                    if deadline is None:
+                        # The recording is over, as if the server had closed
+                        raise ConnectionClosedOK(None, None)
+                    wait = deadline - time.monotonic()
+                elif self._speed is None:
+                    if frame.timestamp_ns > self.clock_ns:
+                        if deadline is not None:
+                            raise TimeoutError
+                        self.clock_ns = frame.timestamp_ns
+                    return self._pop(frame)
+                else:
+                    due_ns = self._started_ns + int(
+                        (frame.timestamp_ns - self.first_ns) / self._speed
+                    )
+                    wait = (due_ns - time.monotonic_ns()) / 1e9
+                    if wait <= 0:
+                        return self._pop(frame)
+                    if deadline is not None:
+                        wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    raise TimeoutError
+                self._wake.wait(wait)
+
+    def respond(self, frame: bytes):
+        """
+        Queue a frame to be received ahead of the recording.
+        """
+        with self._wake:
+            self._responses.append(frame)
+            self._wake.notify_all()
+
+    def send(self, frame: bytes):
+        raise RuntimeError("Nothing to send to when replaying a recording")
+
+    def close(self, code: int = 1000, reason: str = ""):
+        with self._wake:
+            self._closed = True
+            self._wake.notify_all()
+        close = getattr(self._frames, "close", None)
+        if close is not None:
+            close()
+
+    def _pop(self, frame: Frame) -> bytes:
+        self._next = next(self._frames, None)
+        self.last_ns = frame.timestamp_ns
+        self.frames += 1
+        return frame.data
+
+
+@dataclass
+class ReplayReport:
+    frames: int
+    """
+    Recorded frames replayed, including those skipped without being decoded.
+    """
+    seconds: float
+    """
+    Wall time the replay took.
+    """
+    recorded_seconds: float
+    """
+    Time the replayed frames span in the recording.
+    """
+
+    @property
+    def messages_per_second(self) -> float:
+        return self.frames / self.seconds if self.seconds else 0.0
+
+    def format(self) -> str:
+        return (
+            f"{self.frames} frames in {self.seconds:.3f}s"
+            f" ({self.messages_per_second:,.0f} msg/s),"
+            f" {self.recorded_seconds:.1f}s of recording"
+        )
+
+
+class ReplayClient(TradingClient):
+    """
+    A `TradingClient` fed from a recording instead of a server.
+
+    Every received frame of the recording goes through the client as it did live,
+    and `report()` says how fast. The frames the recorded client sent are ignored:
+    requests made during the replay are answered locally instead. Orders rest in the
+    book as the acting user's and can be cancelled or taken out, but never fill,
+    since the recorded market didn't see them. Other requests fail.
+    """
+
+    _ws: ReplaySocket  # type: ignore[assignment]
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        speed: Optional[float] = None,
+        step: float = 1.0,
+        **client_options: Any,
+    ):
+        """
+        Replay the recording in `path`, a directory or segment file.
+
+        With `speed`, frames are received at that multiple of the pace they were
+        recorded at. By default the replay runs as fast as the client takes frames:
+        each `state()` call moves the recording on by `step` seconds, and waiting for
+        anything else (initialization, `receive_in_background`) jumps from frame to
+        frame without sleeping.
+
+        `client_options` are those of `TradingClient`.
+        """
+        self._path = path
+        self._speed = speed
+        self._step = step
+        self._next_order_id = _FIRST_REPLAY_ORDER_ID
+        self._replay_started = time.perf_counter()
+        super().__init__(path, "", "", **client_options)
+
+    def state(self):
+        """
+        Return the state, having received whatever the replay clock has reached.
+        """
+        if self._speed is None and self._receiver is None:
+            self._ws.advance(self._step)
+        return super().state()
+
+    @property
+    def finished(self) -> bool:
+        """
+        Whether every frame of the recording has been received.
+        """
+        return self._ws.finished
+
+    def run(self) -> ReplayReport:
+        """
+        Receive the rest of the recording, at `speed` if given, and report on the
+        whole replay.
+        """
+        if self._receiver is not None:
+            self._receiver.join()
+        else:
+            try:
+                while True:
+                    self.recv()
+            except ConnectionClosed:
+                pass
+        return self.report()
+
+    def report(self) -> ReplayReport:
+        """
+        Frames replayed so far and how fast; `metrics()` breaks down where the time
+        went.
+        """
+        return ReplayReport(
+            frames=self._ws.frames,
+            seconds=time.perf_counter() - self._replay_started,
+            recorded_seconds=(self._ws.last_ns - self._ws.first_ns) / 1e9,
+        )
+
+    def send(self, message: websocket_api.ClientMessage):
+        """
+        Answer a message as the server would have, without touching the recording.
+        """
+        if self._is_awaited(message.request_id):
+            self._metrics._sent(message)
+        with self.state_lock:
+            responses = self._respond(message)
+        for response in responses:
+            self._ws.respond(bytes(response))
+
+    def _connect(self, api_url: str) -> ReplaySocket:  # type: ignore[override]
+        return ReplaySocket(read(self._path, RECEIVED), self._speed)
+
+    def _respond(
+        self, message: websocket_api.ClientMessage
+    ) -> List[websocket_api.ServerMessage]:
+        kind, body = betterproto.which_one_of(message, "message")
+        request_id = message.request_id
+        state = self._state
+        user_id = state.acting_as.user_id
+        if kind == "authenticate":
+            # The recording starts with the initial data sent in response
+            return []
+        if kind == "create_order":
+            if body.market_id not in state.books:
+                return [_failed(request_id, kind, "Market not found")]
+            order_id = self._next_order_id
+            self._next_order_id += 1
+            order = websocket_api.Order(
+                id=order_id,
+                market_id=body.market_id,
+                owner_id=user_id,
+                transaction_id=order_id,
+                price=body.price,
+                size=body.size,
+                side=body.side,
+                sizes=[websocket_api.Size(transaction_id=order_id, size=body.size)],
+            )
+            created = websocket_api.OrderCreated(
+                market_id=body.market_id, user_id=user_id, order=order
+            )
+            return [
+                websocket_api.ServerMessage(
+                    request_id=request_id, order_created=created
+                )
+            ]
+        if kind == "cancel_order":
+            found = state.find_order(body.id)
+            if found is None:
+                return [_failed(request_id, kind, "Order not found")]
+            market_id, order = found
+            if order.owner_id != user_id:
+                return [_failed(request_id, kind, "Not order owner")]
+            cancelled = websocket_api.OrderCancelled(id=body.id, market_id=market_id)
+            return [
+                websocket_api.ServerMessage(
+                    request_id=request_id, order_cancelled=cancelled
+                )
+            ]
+        if kind == "out":
+            book = state.books.get(body.market_id)
+            own_orders = book.own_orders() if book is not None else []
+            return [
+                websocket_api.ServerMessage(
+                    order_cancelled=websocket_api.OrderCancelled(
+                        id=order.id, market_id=body.market_id
+                    )
+                )
+                for order in own_orders
+            ] + [websocket_api.ServerMessage(request_id=request_id, out=body)]
+        return [_failed(request_id, kind, "Not available when replaying a recording")]
+
+
+def _failed(request_id: str, kind: str, error: str) -> websocket_api.ServerMessage:
+    return websocket_api.ServerMessage(
+        request_id=request_id,
+        request_failed=websocket_api.RequestFailed(
+            request_details=websocket_api.RequestFailedRequestDetails(
+                kind="".join(part.title() for part in kind.split("_"))
+            ),
+            error_details=websocket_api.RequestFailedErrorDetails(message=error),
+        ),
+    )
+
+
+app = typer.Typer(pretty_exceptions_show_locals=False)
+
+
+@app.command()
+def main(
+    path: str,
+    codec: str = "betterproto",
+    speed: Optional[float] = None,
+    dedup_market_data: bool = False,
+    columnar_trades: bool = False,
+):
+    """
+    Replay a recording through the client and report its throughput.
+    """
+    with ReplayClient(
+        path,
+        speed=speed,
+        codec=get_codec(codec),
+        dedup_market_data=dedup_market_data,
+        columnar_trades=columnar_trades,
+    ) as client:
+        report = client.run()
+        print(report.format())
+        print(client.metrics().format())
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,166 @@
+import copy
+import json
+import os
+import shutil
+import struct
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Iterator, Optional
+
+import websocket_api
+from codec import FastCodec
+
+if TYPE_CHECKING:
+    from trading_client import MarketDiff, State
+
+SNAPSHOT_VERSION = 1
+
+_MESSAGES = "messages.bin"
+_META = "meta.json"
+_TRADES = "trades"
+_length = struct.Struct("<I")
+
+
+@dataclass
+class Staleness:
+    """
+    How far a restored snapshot was behind the server.
+
+    The counts grow as the server's initial data replaces the restored markets;
+    `reconciled_at` is set once all of it has arrived.
+    """
+
+    saved_at: float
+    restored_at: float
+    reconciled_at: Optional[float] = None
+    markets_reconciled: int = 0
+    markets_added: int = 0
+    trades_missed: int = 0
+    orders_added: int = 0
+    orders_removed: int = 0
+    orders_resized: int = 0
+
+    @property
+    def age(self) -> float:
+        """
+        Seconds between saving the snapshot and restoring it.
+        """
+        return self.restored_at - self.saved_at
+
+    def _reconcile_market(self, diff: "MarketDiff"):
+        self.markets_reconciled += 1
+        self.trades_missed += diff.trades_added
+        self.orders_added += diff.orders_added
+        self.orders_removed += diff.orders_removed
+        self.orders_resized += diff.orders_resized
+
+
+def save(state: "State", path: str):
+    """
+    Write `state` to the directory `path`, replacing any snapshot already there.
+
+    The snapshot holds the state as the server messages that would rebuild it,
+    length-prefixed, and, for markets with a `TradeStore`, one `.npy` file per trade
+    column so the columns can be memory-mapped when restoring.
+    """
+    path = os.path.abspath(path)
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=".snapshot-", dir=parent)
+    try:
+        with open(os.path.join(staging, _MESSAGES), "wb") as f:
+            for message in _messages(state):
+                frame = bytes(message)
+                f.write(_length.pack(len(frame)))
+                f.write(frame)
+        for market_id, store in state.trade_stores.items():
+            store.save(os.path.join(staging, _TRADES, str(market_id)))
+        with open(os.path.join(staging, _META), "w") as f:
+            json.dump({"version": SNAPSHOT_VERSION, "saved_at": time.time()}, f)
+        _replace_directory(staging, path)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+
+def restore(state: "State", path: str, mmap: bool = True) -> Staleness:
+    """
+    Load a snapshot written by `save` into a fresh `state`.
+
+    The state is left initializing, since the server has yet to confirm any of it,
+    and its `staleness` is filled in as the server's data replaces it.
+    """
+    with open(os.path.join(path, _META)) as f:
+        meta = json.load(f)
+    if meta.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(
+            f"Snapshot {path} has version {meta.get('version')},"
+            f" expected {SNAPSHOT_VERSION}"
+        )
+    codec = FastCodec()
+    for frame in _frames(os.path.join(path, _MESSAGES)):
+        state._update(codec.decode(frame))
+    trades = os.path.join(path, _TRADES)
+    for market_id, market in state.markets.items():
+        directory = os.path.join(trades, str(market_id))
+        if not os.path.isdir(directory):
+            continue
+        from trade_store import TradeStore
+
+        store = TradeStore.load(directory, market_id, mmap=mmap)
+        if state.columnar_trades:
+            state.trade_stores[market_id] = store
+        else:
+            market.trades = list(store)
+    state._initializing = True
+    state._unreconciled = set(state.markets)
+    state.staleness = Staleness(saved_at=meta["saved_at"], restored_at=time.time())
+    return state.staleness
+
+
+def _messages(state: "State") -> Iterator[websocket_api.ServerMessage]:
+    """
+    The initialization sequence the server would send to rebuild `state`.
+    """
+    yield websocket_api.ServerMessage(
+        ownerships=websocket_api.Ownerships(ownerships=state.ownerships)
+    )
+    yield websocket_api.ServerMessage(users=websocket_api.Users(users=state.users))
+    for market in state.markets.values():
+        # `Market.orders` is a view of the book, which betterproto can't serialize
+        market = copy.copy(market)
+        market.orders = list(market.orders)
+        yield websocket_api.ServerMessage(market_data=market)
+    yield websocket_api.ServerMessage(portfolio=state.portfolio)
+    yield websocket_api.ServerMessage(
+        payments=websocket_api.Payments(payments=state.payments)
+    )
+    yield websocket_api.ServerMessage(acting_as=state.acting_as)
+
+
+def _frames(path: str) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        data = f.read()
+    pos = 0
+    while pos < len(data):
+        (length,) = _length.unpack_from(data, pos)
+        pos += _length.size
+        if pos + length > len(data):
+            raise ValueError(f"Snapshot {path} is truncated")
+        yield data[pos : pos + length]
+        pos += length
+
+
+def _replace_directory(source: str, destination: str):
+    """
+    Move `source` to `destination`, so a reader never finds a partly written snapshot there.
+    """
+    if not os.path.exists(destination):
+        os.rename(source, destination)
+        return
+    old = destination + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    os.rename(destination, old)
+    os.rename(source, destination)
+    shutil.rmtree(old, ignore_errors=True)
@@ -0,0 +1,145 @@
+import asyncio
+from typing import Optional
+
+import pytest
+import websocket_api
+from async_trading_client import AsyncTradingClient
+from trading_client import RequestFailed
+from websocket_api import CancelOrder, ClientMessage, Side
+
+
+class FakeConnection:
+    """
+    Stands in for the websocket, serving whatever frames the test queues.
+    """
+
+    def __init__(self):
+        self.frames: "asyncio.Queue[Optional[bytes]]" = asyncio.Queue()
+        self.sent = []
+
+    def serve(self, message: websocket_api.ServerMessage):
+        self.frames.put_nowait(bytes(message))
+
+    async def send(self, frame: bytes):
+        self.sent.append(websocket_api.ClientMessage().parse(frame))
+
+    async def close(self, code=None, reason=""):
+        self.frames.put_nowait(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        frame = await self.frames.get()
+        if frame is None:
+            raise StopAsyncIteration
+        return frame
+
+
+def failed(request_id: str, kind: str, error: str) -> websocket_api.ServerMessage:
+    return websocket_api.ServerMessage(
+        request_id=request_id,
+        request_failed=websocket_api.RequestFailed(
+            request_details=websocket_api.RequestFailedRequestDetails(kind=kind),
+            error_details=websocket_api.RequestFailedErrorDetails(message=error),
+        ),
+    )
+
+
+def test_failed_request_during_init_is_not_an_init_error():
+    async def run():
+        ws = FakeConnection()
+        async with AsyncTradingClient(ws) as client:
+            ws.serve(websocket_api.ServerMessage(users=websocket_api.Users()))
+            request = asyncio.ensure_future(client.create_order(2, 40, 1, Side.BID))
+            while not ws.sent:
+                await asyncio.sleep(0)
+            ws.serve(failed(ws.sent[-1].request_id, "CreateOrder", "Market not found"))
+            with pytest.raises(RequestFailed, match="Market not found"):
+                await request
+            ws.serve(
+                websocket_api.ServerMessage(
+                    acting_as=websocket_api.ActingAs(user_id="a")
+                )
+            )
+            await client._initialized
+
+        # Nobody waits on this one, so it's the initialization that failed
+        ws = FakeConnection()
+        async with AsyncTradingClient(ws) as client:
+            ws.serve(failed("", "ActAs", "User not found"))
+            with pytest.raises(RuntimeError, match="ActAs request failed during"):
+                await client._initialized
+
+    asyncio.run(run())
+
+
+def test_concurrent_requests_get_their_own_responses(url):
+    async def run():
+        async with await AsyncTradingClient.connect(url, "a", "a") as client:
+            created = await asyncio.gather(
+                *(client.create_order(1, price, 1, Side.BID) for price in range(10, 15))
+            )
+            assert [c.order.price for c in created] == [10, 11, 12, 13, 14]
+            assert len({c.order.id for c in created}) == 5
+            assert not client._pending
+            return client.state()
+
+    state = asyncio.run(run())
+    assert len(state.books[1].own_orders()) == 5
+
+
+def test_failed_requests_raise(url):
+    async def run():
+        async with await AsyncTradingClient.connect(url, "a", "a") as client:
+            ok, failed = await asyncio.gather(
+                client.create_order(1, 40, 1, Side.BID),
+                client.create_order(2, 40, 1, Side.BID),
+                return_exceptions=True,
+            )
+            assert ok.order.price == 40
+            assert isinstance(failed, RequestFailed)
+            assert "Market not found" in str(failed)
+            with pytest.raises(RequestFailed, match="Insufficient funds"):
+                await client.create_order(1, 40, 30, Side.BID)
+            with pytest.raises(RequestFailed, match="Order not found"):
+                await client.cancel_order(ok.order.id + 1)
+            # The client is still usable after a failure
+            await client.cancel_order(ok.order.id)
+            assert not client.state().books[1].own_orders()
+
+    asyncio.run(run())
+
+
+def test_repeated_cancels_are_sent_once(server, url):
+    async def run():
+        client = await AsyncTradingClient.connect(url, "a", "a", throttle=True)
+        async with client:
+            order_id = (await client.create_order(1, 40, 1, Side.BID)).order.id
+            requests = server.requests
+            cancel = ClientMessage(cancel_order=CancelOrder(id=order_id))
+            responses = await client.request_many([cancel, cancel])
+            assert server.requests == requests + 1
+            assert responses[0] is responses[1]
+            assert responses[0].order_cancelled.id == order_id
+
+    asyncio.run(run())
+
+
+def test_market_ready(url):
+    async def run():
+        client = await AsyncTradingClient.connect(url, "a", "a", wait_for_init=False)
+        async with client:
+            market, markets = await asyncio.gather(
+                client.market_ready(1), client.wait_for_markets([1])
+            )
+            assert market.name == "one"
+            assert markets == {1: market}
+            with pytest.raises(KeyError, match="Market 2 not found"):
+                await client.market_ready(2)
+            # Again, once initialization is known to be over
+            await client.create_order(1, 40, 1, Side.BID)
+            with pytest.raises(KeyError, match="Market 2 not found"):
+                await client.market_ready(2)
+
+    asyncio.run(run())
@@ -0,0 +1,61 @@
+import pytest
+
+import websocket_api
+from client_pool import ClientPool
+from websocket_api import Side
+from websockets.exceptions import ConnectionClosed
+
+
+def create(price: float, side: Side) -> websocket_api.ClientMessage:
+    return websocket_api.ClientMessage(
+        create_order=websocket_api.CreateOrder(
+            market_id=1, price=price, size=1, side=side
+        )
+    )
+
+
+def test_one_copy_of_the_market_data(url):
+    with ClientPool(url, throttle=True) as pool:
+        pool.add("a", "a", "a")
+        pool.add("b", "b", "b")
+        # a's JWT acting as b
+        pool.add("a as b", "a", "b")
+        assert pool.connected == []
+        assert set(pool.state().markets) == {1}
+        assert pool.connected == ["a"]
+
+        pool.request("b", create(40, Side.OFFER))
+        pool.request_many("a", [create(40, Side.BID), create(30, Side.BID)])
+        assert pool.connected == ["a", "b"]
+        assert pool["b"].state().markets == {}
+        assert pool["b"].metrics().frames_skipped > 0
+        assert pool["a as b"] is not pool["b"]
+        assert pool["a as b"].throttle is pool["a"].throttle
+        assert pool["b"].throttle is not pool["a"].throttle
+
+        assert pool.portfolio("a").total_balance == 1000 - 40
+        assert pool.portfolio("b").total_balance == 1000 + 40
+        assert len(pool.state().books[1].own_orders()) == 1
+        clients = [pool[name] for name in pool.connected]
+    for client in clients:
+        with pytest.raises(ConnectionClosed):
+            client.create_order(1, 40, 1, Side.BID)
+
+
+def test_public_client_and_accounts(url):
+    with ClientPool(url) as pool:
+        with pytest.raises(RuntimeError, match="No accounts"):
+            pool.state()
+        pool.add("a", "a", "a")
+        pool.add("a", "a", "a")
+        with pytest.raises(ValueError, match="already registered"):
+            pool.add("a", "a", "b")
+        with pytest.raises(KeyError, match="not registered"):
+            pool["c"]
+        assert "a" in pool and "c" not in pool
+
+        with ClientPool(url, public=pool["a"]) as other:
+            other.add("b", "b", "b")
+            assert other.state() is pool.state()
+            assert other["b"].throttle is None
+            assert other["b"].state().markets == {}
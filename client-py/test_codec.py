@@ -0,0 +1,255 @@
+import dataclasses
+import random
+
+import betterproto
+import websocket_api
+from codec import BetterprotoCodec, FastCodec, MarketDataDedup, build, encode, peek
+from websocket_api import Side
+
+
+def random_order(rng: random.Random) -> websocket_api.Order:
+    return websocket_api.Order(
+        id=rng.randrange(-5, 1 << 40),
+        market_id=rng.randrange(5),
+        owner_id=rng.choice(["", "alice", "bøb"]),
+        transaction_id=rng.randrange(100),
+        price=rng.choice([0.0, 1.5, -3.25]),
+        size=rng.random(),
+        side=rng.choice([Side.UNKNOWN, Side.BID, Side.OFFER]),
+        sizes=[
+            websocket_api.Size(transaction_id=i, size=rng.random())
+            for i in range(rng.randrange(3))
+        ],
+    )
+
+
+def random_frames(count: int):
+    rng = random.Random(0)
+    for _ in range(count):
+        kind = rng.randrange(5)
+        if kind == 0:
+            message = websocket_api.ServerMessage(
+                order_created=websocket_api.OrderCreated(
+                    market_id=rng.randrange(3),
+                    user_id="alice",
+                    order=random_order(rng),
+                    fills=[
+                        websocket_api.OrderCreatedOrderFill(
+                            id=rng.randrange(99), size_remaining=rng.random()
+                        )
+                        for _ in range(rng.randrange(4))
+                    ],
+                    trades=[
+                        websocket_api.Trade(id=i, price=rng.random(), buyer_id="bøb")
+                        for i in range(rng.randrange(4))
+                    ],
+                )
+            )
+        elif kind == 1:
+            # No order: it was fully filled on arrival
+            message = websocket_api.ServerMessage(
+                order_created=websocket_api.OrderCreated(
+                    market_id=1, fills=[websocket_api.OrderCreatedOrderFill(id=3)]
+                )
+            )
+        elif kind == 2:
+            message = websocket_api.ServerMessage(
+                order_cancelled=websocket_api.OrderCancelled(id=rng.randrange(99))
+            )
+        elif kind == 3:
+            market = websocket_api.Market(
+                id=rng.randrange(5),
+                name="market",
+                orders=[random_order(rng) for _ in range(rng.randrange(5))],
+                has_full_history=rng.random() < 0.5,
+            )
+            if rng.random() < 0.5:
+                market.open = websocket_api.MarketOpen()
+            else:
+                market.closed = websocket_api.MarketClosed(settle_price=rng.random())
+            message = websocket_api.ServerMessage(market_data=market)
+        else:
+            message = websocket_api.ServerMessage(
+                authenticated=websocket_api.Authenticated()
+            )
+        if rng.random() < 0.5:
+            message.request_id = str(rng.random())
+        yield bytes(message)
+
+
+def assert_same(frame: bytes):
+    expected = BetterprotoCodec().decode(frame)
+    decoded = FastCodec().decode(frame)
+    assert decoded == expected
+    assert bytes(decoded) == bytes(expected)
+    assert betterproto.which_one_of(decoded, "message") == betterproto.which_one_of(
+        expected, "message"
+    )
+    _, message = betterproto.which_one_of(decoded, "message")
+    _, expected_message = betterproto.which_one_of(expected, "message")
+    if expected_message is not None:
+        assert message._serialized_on_wire == expected_message._serialized_on_wire
+        assert message._group_map == expected_message._group_map
+
+
+def test_fast_codec_matches_betterproto():
+    for frame in random_frames(500):
+        assert_same(frame)
+
+
+def test_encode_round_trips():
+    for frame in random_frames(500):
+        message = BetterprotoCodec().decode(frame)
+        encoded = encode(message)
+        assert BetterprotoCodec().decode(encoded) == message
+        if betterproto.which_one_of(message, "message")[0] != "authenticated":
+            assert encoded == frame
+
+
+def test_encode_writes_empty_oneof_member():
+    frame = encode(
+        build(websocket_api.ServerMessage, authenticated=websocket_api.Authenticated())
+    )
+    assert peek(frame).kind == "authenticated"
+
+
+def test_build_matches_constructor():
+    built = build(
+        websocket_api.ServerMessage,
+        request_id="a",
+        order_cancelled=build(websocket_api.OrderCancelled, id=1, market_id=2),
+    )
+    expected = websocket_api.ServerMessage(
+        request_id="a",
+        order_cancelled=websocket_api.OrderCancelled(id=1, market_id=2),
+    )
+    assert built == expected
+    assert built._group_map == expected._group_map
+    assert encode(built) == bytes(expected)
+
+
+def test_fast_codec_keeps_unknown_fields():
+    frame = bytes(
+        websocket_api.ServerMessage(order_cancelled=websocket_api.OrderCancelled(id=1))
+    )
+    assert_same(frame + b"\xa8\x06\x05")
+
+
+def test_fast_codec_blank_messages_are_not_shared():
+    frame = bytes(
+        websocket_api.ServerMessage(order_cancelled=websocket_api.OrderCancelled(id=1))
+    )
+    first = FastCodec().decode(frame)
+    first.order_created.fills.append(websocket_api.OrderCreatedOrderFill(id=1))
+    assert FastCodec().decode(frame).order_created.fills == []
+
+
+def test_market_data_dedup_until_market_changes():
+    market = websocket_api.Market(id=3, name="market", orders=[], has_full_history=True)
+    frame = bytes(websocket_api.ServerMessage(market_data=market))
+    # The same market in a response to a request
+    response = bytes(websocket_api.ServerMessage(request_id="1", market_data=market))
+    cancelled = bytes(
+        websocket_api.ServerMessage(
+            order_cancelled=websocket_api.OrderCancelled(id=1, market_id=3)
+        )
+    )
+    dedup = MarketDataDedup()
+    assert dedup.repeat(frame, peek(frame)) is None
+    dedup.applied(frame, peek(frame), 100)
+    assert dedup.repeat(frame, peek(frame)) == 100
+    assert dedup.repeat(response, peek(response)) == 100
+    dedup.applied(cancelled, peek(cancelled), 10)
+    assert dedup.repeat(frame, peek(frame)) is None
+
+
+def sample(cls, depth: int = 0):
+    """
+    A `cls` with every field set to something other than its default, and the first
+    member of each oneof.
+    """
+    values = {}
+    groups = set()
+    for field in dataclasses.fields(cls):
+        meta = betterproto.FieldMetadata.get(field)
+        if meta.group is not None:
+            if meta.group in groups:
+                continue
+            groups.add(meta.group)
+        field_cls = cls()._betterproto.cls_by_field[field.name]
+        if issubclass(field_cls, betterproto.Enum):
+            value = list(field_cls)[-1]
+        elif issubclass(field_cls, betterproto.Message):
+            if depth > 3:
+                continue
+            value = sample(field_cls, depth + 1)
+        else:
+            value = {bool: True, int: 7, float: 1.5, str: "x"}[field_cls]
+        is_list = isinstance(cls().__dict__[field.name], list)
+        values[field.name] = [value, value] if is_list else value
+    return cls(**values)
+
+
+def fields_of(message: betterproto.Message, path: str = ""):
+    """
+    Every field of a message and of the messages in it, with its declared class.
+    """
+    cls_by_field = message._betterproto.cls_by_field
+    for field in dataclasses.fields(message):
+        value = getattr(message, field.name)
+        name = f"{path}.{field.name}"
+        yield name, cls_by_field[field.name], value
+        items = value if isinstance(value, list) else [value]
+        for i, item in enumerate(items):
+            if isinstance(item, betterproto.Message):
+                yield from fields_of(item, f"{name}[{i}]")
+
+
+def test_fast_codec_decodes_every_kind_like_betterproto():
+    kinds = [
+        field.name
+        for field in dataclasses.fields(websocket_api.ServerMessage)
+        if betterproto.FieldMetadata.get(field).group == "message"
+    ]
+    for kind in kinds:
+        message_cls = websocket_api.ServerMessage()._betterproto.cls_by_field[kind]
+        for value in (sample(message_cls), message_cls()):
+            frame = encode(
+                build(websocket_api.ServerMessage, request_id="1", **{kind: value})
+            )
+            assert_same(frame)
+            decoded = FastCodec().decode(frame)
+            expected = BetterprotoCodec().decode(frame)
+            fields = zip(fields_of(decoded), fields_of(expected), strict=True)
+            for (name, field_cls, got), (_, _, want) in fields:
+                assert got == want, name
+                if issubclass(field_cls, betterproto.Enum):
+                    # betterproto leaves enums as plain int
+                    assert type(got) is field_cls, name
+                else:
+                    assert type(got) is type(want), name
+            assert peek(frame).kind == kind
+
+
+def test_fast_codec_decodes_enums_as_enums():
+    for side in Side:
+        frame = bytes(
+            websocket_api.ServerMessage(
+                order_created=websocket_api.OrderCreated(
+                    order=websocket_api.Order(id=1, side=side)
+                )
+            )
+        )
+        decoded = FastCodec().decode(frame).order_created.order.side
+        assert decoded == side
+        assert type(decoded) is Side
+    # A value the enum doesn't know stays int
+    frame = bytes(
+        websocket_api.ServerMessage(
+            order_created=websocket_api.OrderCreated(
+                order=websocket_api.Order(id=1, side=9)
+            )
+        )
+    )
+    decoded = FastCodec().decode(frame).order_created.order.side
+    assert (decoded, type(decoded)) == (9, int)
@@ -0,0 +1,78 @@
+import logging
+
+import pytest
+
+import websocket_api
+from events import Events
+from order_book import OrderBook
+from trading_client import TradingClient
+from websocket_api import Side
+
+
+def created(market_id: int, trade_ids=()) -> websocket_api.ServerMessage:
+    return websocket_api.ServerMessage(
+        order_created=websocket_api.OrderCreated(
+            market_id=market_id,
+            trades=[websocket_api.Trade(id=i, market_id=market_id) for i in trade_ids],
+        )
+    )
+
+
+def test_dispatch_by_kind_and_market(caplog):
+    events = Events()
+    calls = []
+    events.on("order_created", lambda m: calls.append(("any", m.market_id)))
+    events.on_order_created(lambda m: calls.append(("two", m.market_id)), market_id=2)
+    events.on_trade(lambda trade: calls.append(("trade", trade.id)))
+    events.on_book_change(lambda book: calls.append(("book", book.market_id)))
+
+    @events.on_order_cancelled
+    def broken(message):
+        raise ValueError("oops")
+
+    books = {1: OrderBook(market_id=1)}
+    events._dispatch(created(1, [5, 6]), books)
+    events._dispatch(created(2), books)
+    assert calls == [
+        ("any", 1),
+        ("trade", 5),
+        ("trade", 6),
+        ("book", 1),
+        ("any", 2),
+        ("two", 2),
+    ]
+    # A failing callback is logged and doesn't stop dispatching
+    with caplog.at_level(logging.ERROR, logger="events"):
+        events._dispatch(
+            websocket_api.ServerMessage(
+                order_cancelled=websocket_api.OrderCancelled(id=1, market_id=3)
+            ),
+            books,
+        )
+    assert "Error in order_cancelled callback" in caplog.text
+    assert not events.dispatching
+
+    events.off(broken)
+    calls.clear()
+    with pytest.raises(ValueError, match="Unknown kind"):
+        events.on("order_creatd", print)
+    events._dispatch(created(2), books)
+    assert calls == [("any", 2), ("two", 2)]
+
+
+def test_callbacks_see_the_applied_state(url):
+    with TradingClient(url, "a", "a") as a, TradingClient(url, "b", "b") as b:
+        best_bids = []
+
+        @a.events.on_book_change(market_id=1)
+        def requote(book):
+            best_bid = book.best_bid()
+            best_bids.append(None if best_bid is None else best_bid.price)
+            with pytest.raises(RuntimeError, match="inside an event callback"):
+                a.create_order(1, 10, 1, Side.BID)
+
+        b.create_order(1, 40, 1, Side.BID)
+        b.create_order(1, 30, 1, Side.BID)
+        b.out(1)
+        a.state()
+        assert best_bids == [40, 40, 30, None]
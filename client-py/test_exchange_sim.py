@@ -0,0 +1,155 @@
+import pytest
+from exchange_sim import Exchange, ExchangeSimulator, Rejected
+from trading_client import RequestFailed, TradingClient
+from websocket_api import Side
+
+
+@pytest.fixture
+def exchange():
+    exchange = Exchange()
+    for user_id in ("admin", "a", "b"):
+        exchange.ensure_user(user_id, user_id, 1000)
+    exchange.create_market("admin", "one", 0, 100)
+    return exchange
+
+
+def order_ids(exchange: Exchange, side: int):
+    book = exchange.markets[1].sides[side]
+    return [order.id for price in book.prices for order in book.levels[price].values()]
+
+
+def test_price_time_priority(exchange: Exchange):
+    exchange.create_order("a", 1, 51, 1, Side.OFFER)
+    exchange.create_order("b", 1, 50, 1, Side.OFFER)
+    exchange.create_order("a", 1, 50, 1, Side.OFFER)
+    created = exchange.create_order("b", 1, 52, 3.5, Side.BID).public[0].order_created
+    assert [fill.id for fill in created.fills] == [2, 3, 1]
+    assert [trade.price for trade in created.trades] == [50, 51]
+    # The fill against b's own order makes no trade
+    assert [trade.seller_id for trade in created.trades] == ["a", "a"]
+    assert created.order.size == 0.5
+    assert created.order.price == 52
+    assert order_ids(exchange, Side.BID) == [created.order.id]
+    assert order_ids(exchange, Side.OFFER) == []
+
+
+def test_partial_fill_of_resting_order(exchange: Exchange):
+    exchange.create_order("a", 1, 40, 3, Side.BID)
+    created = exchange.create_order("b", 1, 30, 1.25, Side.OFFER).public[0]
+    fill = created.order_created.fills[0]
+    assert (fill.size_filled, fill.size_remaining, fill.price) == (1.25, 1.75, 40)
+    assert exchange.orders[1].size == 175
+
+
+def test_balances_and_exposures(exchange: Exchange):
+    exchange.create_order("a", 1, 40, 3, Side.BID)
+    a = exchange.portfolio("a")
+    assert a.total_balance == 1000
+    assert a.available_balance == 1000 - 120
+    exchange.create_order("b", 1, 40, 2, Side.OFFER)
+    a, b = exchange.portfolio("a"), exchange.portfolio("b")
+    assert a.total_balance == 1000 - 80
+    assert b.total_balance == 1000 + 80
+    assert a.available_balance == 1000 - 120
+    assert b.available_balance == 1000 - 120
+    [exposure] = a.market_exposures
+    assert (exposure.position, exposure.total_bid_size, exposure.total_bid_value) == (
+        2,
+        1,
+        40,
+    )
+
+
+def test_self_fill_moves_no_money(exchange: Exchange):
+    exchange.create_order("a", 1, 40, 1, Side.BID)
+    created = exchange.create_order("a", 1, 40, 1, Side.OFFER).public[0].order_created
+    assert created.trades == []
+    assert len(created.fills) == 1
+    portfolio = exchange.portfolio("a")
+    assert portfolio.total_balance == 1000
+    assert portfolio.market_exposures[0].position == 0
+
+
+def test_rejections(exchange: Exchange):
+    with pytest.raises(Rejected, match="Insufficient funds"):
+        exchange.create_order("a", 1, 50, 21, Side.BID)
+    with pytest.raises(Rejected, match="Invalid price"):
+        exchange.create_order("a", 1, 101, 1, Side.BID)
+    with pytest.raises(Rejected, match="Invalid size"):
+        exchange.create_order("a", 1, 50, 0.001, Side.BID)
+    with pytest.raises(Rejected, match="Market not found"):
+        exchange.create_order("a", 2, 50, 1, Side.BID)
+    exchange.create_order("a", 1, 50, 1, Side.BID)
+    with pytest.raises(Rejected, match="Not order owner"):
+        exchange.cancel_order("b", 1)
+    assert exchange.portfolio("a").available_balance == 950
+
+
+def test_cancel_and_out(exchange: Exchange):
+    for price in (10, 20, 30):
+        exchange.create_order("a", 1, price, 1, Side.BID)
+    exchange.create_order("a", 1, 60, 1, Side.OFFER)
+    exchange.cancel_order("a", 2)
+    with pytest.raises(Rejected, match="Order not found"):
+        exchange.cancel_order("a", 2)
+    outcome = exchange.out("a", 1)
+    assert [m.order_cancelled.id for m in outcome.public] == [1, 3, 4]
+    assert outcome.reply[0].out.market_id == 1
+    assert exchange.orders == {}
+    assert exchange.portfolio("a").available_balance == 1000
+
+
+def test_settle(exchange: Exchange):
+    exchange.create_order("a", 1, 40, 2, Side.BID)
+    exchange.create_order("b", 1, 40, 2, Side.OFFER)
+    exchange.create_order("a", 1, 10, 1, Side.BID)
+    with pytest.raises(Rejected, match="Not market owner"):
+        exchange.settle_market("a", 1, 70)
+    outcome = exchange.settle_market("admin", 1, 70)
+    assert outcome.portfolios == {"a", "b"}
+    assert exchange.portfolio("a").total_balance == 1000 - 80 + 140
+    assert exchange.portfolio("b").total_balance == 1000 + 80 - 140
+    assert exchange.portfolio("a").available_balance == 1060
+    assert exchange.orders == {}
+    with pytest.raises(Rejected, match="Market already settled"):
+        exchange.create_order("a", 1, 40, 1, Side.BID)
+
+
+def test_redeem(exchange: Exchange):
+    exchange.create_market("admin", "two", 0, 100)
+    exchange.create_market("admin", "sum", 0, 200)
+    exchange.add_fund(3, [1, 2])
+    exchange.redeem("a", 3, -1)
+    positions = {
+        exposure.market_id: exposure.position
+        for exposure in exchange.portfolio("a").market_exposures
+    }
+    assert positions == {3: 1, 1: -1.01, 2: -1.01}
+    with pytest.raises(Rejected, match="Fund not found"):
+        exchange.redeem("a", 1, 1)
+
+
+def test_trading_client():
+    exchange = Exchange()
+    exchange.ensure_user("admin", "admin", 1000)
+    exchange.create_market("admin", "one", 0, 100)
+    simulator = ExchangeSimulator(exchange, initial_balance=100)
+    url = simulator.start()
+    try:
+        with TradingClient(url, "a", "a") as a, TradingClient(url, "b", "b") as b:
+            order = a.create_order(1, 40, 2, Side.BID).order
+            with pytest.raises(RequestFailed, match="Insufficient funds"):
+                a.create_order(1, 40, 2, Side.BID)
+            created = b.create_order(1, 30, 1, Side.OFFER)
+            assert created.trades[0].buyer_id == "a"
+            # Responses come after the portfolio updates sent before them
+            a.cancel_order(order.id)
+            b.out(1)
+            state = a.state()
+            assert state.portfolio.total_balance == 60
+            assert state.portfolio.available_balance == 60
+            assert state.markets[1].trades[0].seller_id == "b"
+            assert b.state().portfolio.total_balance == 140
+            assert "b" in a.state().users_by_id
+    finally:
+        simulator.stop()
@@ -0,0 +1,50 @@
+from collections import Counter
+
+from exchange_sim import Exchange, ExchangeSimulator
+from loadgen import LoadStep, TraderOptions, _broken, run_load
+from metrics import Histogram
+
+
+def test_ramp_against_simulator():
+    exchange = Exchange()
+    exchange.ensure_user("admin", "admin", 1000)
+    exchange.create_market("admin", "one", 0, 100)
+    simulator = ExchangeSimulator(exchange)
+    url = simulator.start()
+    try:
+        report = run_load(
+            url,
+            [("a", ""), ("b", "")],
+            TraderOptions(mix={"create_order": 0.6, "cancel_order": 0.3, "out": 0.1}),
+            start_rate=10,
+            ramp=2,
+            step_seconds=0.5,
+            max_steps=2,
+            # Generous, so that a busy machine doesn't end the ramp early
+            slo_ms={("create_order", 99.0): 1000.0},
+            min_achieved=0.5,
+        )
+    finally:
+        simulator.stop()
+    assert [step.target_rate for step in report.steps] == [10, 20]
+    assert report.sustained is report.steps[-1]
+    assert report.steps[-1].requests > 5
+    assert "create_order" in report.steps[-1].round_trips
+    assert "Sustained" in report.format()
+
+
+def test_step_breaks_on_errors_latency_and_shortfall():
+    step = LoadStep(100, seconds=1.0)
+    latencies = step.round_trips["create_order"] = Histogram()
+    for _ in range(100):
+        latencies.record(5_000_000)
+    slo = {("create_order", 99.0): 10.0}
+    assert _broken(step, slo, 0.01, ("Order not found",), 0.9) is None
+    step.errors = Counter({("cancel_order", "Order not found"): 5})
+    assert _broken(step, slo, 0.01, ("Order not found",), 0.9) is None
+    step.errors[("create_order", "Insufficient funds")] = 2
+    assert "failed" in _broken(step, slo, 0.01, ("Order not found",), 0.9)
+    step.errors.clear()
+    assert "p99" in _broken(step, {("create_order", 99.0): 1.0}, 0.01, (), 0.9)
+    step.target_rate = 200
+    assert "achieved" in _broken(step, slo, 0.01, (), 0.9)
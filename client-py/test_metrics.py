@@ -0,0 +1,63 @@
+import math
+import random
+
+import websocket_api
+from metrics import Histogram, Metrics
+
+
+def test_histogram_percentiles_within_precision():
+    rng = random.Random(0)
+    values = sorted(int(rng.lognormvariate(12, 2)) for _ in range(10_000))
+    histogram = Histogram()
+    for value in values:
+        histogram.record(value)
+    assert histogram.count == len(values)
+    assert histogram.max == values[-1]
+    for percentile in (0.1, 50, 99, 99.9, 100):
+        exact = values[max(0, math.ceil(len(values) * percentile / 100) - 1)]
+        assert exact <= histogram.percentile(percentile) <= exact * 1.016 + 1
+
+
+def test_histogram_merge_matches_recording_everything():
+    rng = random.Random(1)
+    values = [int(rng.lognormvariate(10, 2)) for _ in range(2_000)]
+    whole, first, second = Histogram(), Histogram(), Histogram()
+    for i, value in enumerate(values):
+        whole.record(value)
+        (first if i % 3 else second).record(value)
+    first.merge(second)
+    first.merge(Histogram())
+    assert first.counts == whole.counts
+    assert (first.count, first.total, first.min, first.max) == (
+        whole.count,
+        whole.total,
+        whole.min,
+        whole.max,
+    )
+
+
+def test_request_round_trip_and_interleaved_frames():
+    metrics = Metrics()
+    request = websocket_api.ClientMessage(
+        request_id="1", out=websocket_api.Out(market_id=3)
+    )
+    metrics._sent(request)
+    metrics._frame(
+        websocket_api.ServerMessage(
+            order_cancelled=websocket_api.OrderCancelled(id=5, market_id=3)
+        ),
+        1000,
+        200,
+    )
+    metrics._skipped()
+    metrics._frame(
+        websocket_api.ServerMessage(request_id="1", out=websocket_api.Out(market_id=3)),
+        2000,
+        300,
+    )
+    out = metrics.requests["out"]
+    assert out.round_trip.count == 1
+    assert out.interleaved_frames.max == 2
+    assert out.client.max == 3500
+    assert metrics.frames["order_cancelled"].decode.max == 1000
+    assert not metrics._in_flight
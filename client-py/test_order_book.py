@@ -0,0 +1,133 @@
+import pytest
+
+import websocket_api
+from order_book import OrderBook
+from trading_client import State
+from websocket_api import Side
+
+
+def order(
+    order_id: int, side: Side, price: float, size: float = 1, owner_id: str = "a"
+) -> websocket_api.Order:
+    return websocket_api.Order(
+        id=order_id,
+        market_id=1,
+        owner_id=owner_id,
+        price=price,
+        size=size,
+        side=side,
+    )
+
+
+def book() -> OrderBook:
+    return OrderBook(
+        [
+            order(1, Side.BID, 40, 2),
+            order(2, Side.BID, 41, 1, "b"),
+            order(3, Side.BID, 40, 3, "b"),
+            order(4, Side.OFFER, 45, 1),
+            order(5, Side.OFFER, 44, 2, "b"),
+            order(6, Side.OFFER, 45, 4, "b"),
+        ],
+        market_id=1,
+        owner_id="a",
+    )
+
+
+def test_levels_and_best_prices():
+    b = book()
+    assert (b.best_bid().id, b.best_offer().id) == (2, 5)
+    assert b.depth(Side.BID) == [(41, 1), (40, 5)]
+    assert b.depth(Side.OFFER, 1) == [(44, 2)]
+    assert [order.id for order in b.bids()] == [2, 1, 3]
+    assert [order.id for order in b.offers(2)] == [5, 4]
+
+    b.fill(1, 0.5)
+    assert b.depth(Side.BID) == [(41, 1), (40, 3.5)]
+    b.remove(2)
+    # Order 1 keeps its time priority after the partial fill
+    assert b.best_bid().id == 1
+    b.fill(1, 0)
+    b.remove(3)
+    assert b.best_bid() is None
+    assert b.bid_levels() == []
+    assert 1 not in b
+    assert len(b) == 3
+
+
+def test_own_orders_follow_the_owner():
+    b = book()
+    assert [order.id for order in b.own_orders()] == [1, 4]
+    assert b.own_prices(Side.OFFER) == [45]
+    b.add(order(7, Side.OFFER, 43))
+    assert b.own_prices(Side.OFFER) == [43, 45]
+    assert [order.id for order in b.own_orders_at(Side.OFFER, 43)] == [7]
+    b.remove(7)
+    assert b.own_orders_at(Side.OFFER, 43) == []
+
+    b.set_owner("b")
+    assert [order.id for order in b.own_orders(Side.BID)] == [2, 3]
+    b.set_owner("")
+    assert b.own_orders() == []
+
+
+def test_orders_view_is_live_and_read_only():
+    b = book()
+    view = b.orders
+    assert [order.id for order in view] == [1, 2, 3, 4, 5, 6]
+    assert view[-1].id == 6
+    assert [order.id for order in view[1:3]] == [2, 3]
+    b.remove(2)
+    assert len(view) == 5
+    assert list(view) == list(b.orders)
+    assert not isinstance(view, list)
+    assert view.index(b.get(3)) == 1
+    with pytest.raises(TypeError):
+        view[0] = order(8, Side.BID, 1)
+
+
+def test_sync_touches_only_what_changed():
+    b = book()
+    kept = b.get(1)
+    snapshot = [
+        order(1, Side.BID, 40, 2),
+        order(3, Side.BID, 40, 1, "b"),
+        order(4, Side.OFFER, 46, 1),
+        order(8, Side.BID, 39),
+    ]
+    assert b.sync(snapshot) == (1, 3, 2)
+    assert b.get(1) is kept
+    assert b.depth(Side.BID) == [(40, 3), (39, 1)]
+    assert b.own_prices(Side.OFFER) == [46]
+
+
+def test_state_indexes_orders_across_markets():
+    state = State()
+    for market_id in (1, 2):
+        state._update(
+            websocket_api.ServerMessage(
+                market_data=websocket_api.Market(
+                    id=market_id,
+                    name=str(market_id),
+                    open=websocket_api.MarketOpen(),
+                    orders=[order(market_id * 10, Side.OFFER, 50, 2)],
+                )
+            )
+        )
+    assert state.find_order(20)[0] == 2
+    state._update(
+        websocket_api.ServerMessage(
+            order_created=websocket_api.OrderCreated(
+                market_id=2,
+                user_id="b",
+                fills=[
+                    websocket_api.OrderCreatedOrderFill(
+                        id=20, market_id=2, size_filled=2, size_remaining=0, price=50
+                    )
+                ],
+            )
+        )
+    )
+    assert state.find_order(20) is None
+    assert len(state.books[2]) == 0
+    assert state.find_order(10)[1] is state.books[1].get(10)
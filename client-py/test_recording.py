@@ -0,0 +1,31 @@
+import os
+
+import pytest
+from recording import RECEIVED, SENT, Recorder, read, segments
+
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_recording_round_trips_across_segments(tmp_path, compress):
+    frames = [bytes([i % 256]) * (i % 50) for i in range(1000)]
+    with Recorder(
+        str(tmp_path), compress=compress, segment_bytes=4096, block_bytes=1024
+    ) as recorder:
+        for i, frame in enumerate(frames):
+            recorder.record(RECEIVED if i % 3 else SENT, frame)
+    assert len(segments(str(tmp_path))) > 1
+    recorded = list(read(str(tmp_path)))
+    assert [bytes(frame.data) for frame in recorded] == frames
+    timestamps = [frame.timestamp_ns for frame in recorded]
+    assert timestamps == sorted(timestamps)
+    sent = [bytes(frame.data) for frame in read(str(tmp_path), SENT)]
+    assert sent == frames[::3]
+
+
+def test_truncated_block_ends_the_segment(tmp_path):
+    with Recorder(str(tmp_path), block_bytes=100) as recorder:
+        for i in range(20):
+            recorder.record(RECEIVED, b"x" * 40)
+    [segment] = segments(str(tmp_path))
+    with open(segment, "r+b") as f:
+        f.truncate(os.path.getsize(segment) - 1)
+    assert 0 < len(list(read(str(tmp_path)))) < 20
@@ -0,0 +1,59 @@
+import pytest
+import websocket_api
+from recording import RECEIVED, Recorder
+from replay import ReplayClient
+from trading_client import RequestFailed
+from websocket_api import Side
+
+
+def record_session(path: str):
+    messages = [
+        websocket_api.ServerMessage(
+            users=websocket_api.Users(users=[websocket_api.User(id="me", name="me")])
+        ),
+        websocket_api.ServerMessage(
+            market_data=websocket_api.Market(
+                id=1, name="one", open=websocket_api.MarketOpen()
+            )
+        ),
+        websocket_api.ServerMessage(acting_as=websocket_api.ActingAs(user_id="me")),
+    ] + [
+        websocket_api.ServerMessage(
+            order_created=websocket_api.OrderCreated(
+                market_id=1,
+                user_id="them",
+                order=websocket_api.Order(
+                    id=i,
+                    market_id=1,
+                    owner_id="them",
+                    price=40 + i,
+                    size=1,
+                    side=Side.BID,
+                ),
+            )
+        )
+        for i in range(1, 6)
+    ]
+    with Recorder(path) as recorder:
+        for message in messages:
+            recorder.record(RECEIVED, bytes(message))
+
+
+def test_replay_applies_recording_and_answers_requests(tmp_path):
+    record_session(str(tmp_path))
+    with ReplayClient(str(tmp_path)) as client:
+        assert client.state().acting_as.user_id == "me"
+        report = client.run()
+        assert report.frames == 8
+        book = client.state().books[1]
+        assert book.best_bid().price == 45
+
+        created = client.create_order(1, 50, 2, Side.OFFER)
+        assert book.own_orders() == [created.order]
+        client.create_order(1, 51, 2, Side.OFFER)
+        client.out(1)
+        assert book.own_orders() == []
+        with pytest.raises(RequestFailed, match="Not order owner"):
+            client.cancel_order(1)
+        with pytest.raises(RequestFailed, match="Not available"):
+            client.redeem(1, 1)
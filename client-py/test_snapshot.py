@@ -0,0 +1,105 @@
+import json
+import os
+import time
+
+import pytest
+
+import websocket_api
+from trading_client import State, TradingClient
+from websocket_api import Side
+
+
+def initialized_state(columnar_trades: bool = False) -> State:
+    state = State(columnar_trades=columnar_trades)
+    for message in (
+        websocket_api.ServerMessage(
+            users=websocket_api.Users(
+                users=[websocket_api.User(id=name, name=name) for name in ("a", "b")]
+            )
+        ),
+        websocket_api.ServerMessage(
+            market_data=websocket_api.Market(
+                id=1,
+                name="one",
+                open=websocket_api.MarketOpen(),
+                orders=[
+                    websocket_api.Order(
+                        id=10,
+                        market_id=1,
+                        owner_id="a",
+                        price=40,
+                        size=2,
+                        side=Side.BID,
+                    )
+                ],
+                trades=[
+                    websocket_api.Trade(
+                        id=5, market_id=1, price=41, size=1, buyer_id="a", seller_id="b"
+                    )
+                ],
+            )
+        ),
+        websocket_api.ServerMessage(
+            portfolio=websocket_api.Portfolio(total_balance=100)
+        ),
+        websocket_api.ServerMessage(payments=websocket_api.Payments()),
+        websocket_api.ServerMessage(acting_as=websocket_api.ActingAs(user_id="a")),
+    ):
+        state._update(message)
+    return state
+
+
+@pytest.mark.parametrize("columnar_trades", [False, True])
+def test_round_trip(tmp_path, columnar_trades):
+    path = str(tmp_path / "snapshot")
+    initialized_state(columnar_trades).save_snapshot(path)
+    # Saving again replaces the snapshot
+    initialized_state(columnar_trades).save_snapshot(path)
+    state = State.load_snapshot(path, columnar_trades=columnar_trades)
+    assert state.staleness is not None
+    assert state.staleness.reconciled_at is None
+    assert state._initializing
+    assert [user.id for user in state.users] == ["a", "b"]
+    assert state.portfolio.total_balance == 100
+    assert state.acting_as.user_id == "a"
+    assert [order.id for order in state.books[1].own_orders()] == [10]
+    assert state.find_order(10)[0] == 1
+    if columnar_trades:
+        assert state.trade_stores[1].position("a") == 1
+    else:
+        assert state.markets[1].trades[0].seller_id == "b"
+
+
+def test_refuses_what_it_cant_restore(tmp_path):
+    with pytest.raises(RuntimeError, match="before initialization"):
+        State().save_snapshot(str(tmp_path / "snapshot"))
+    path = str(tmp_path / "snapshot")
+    initialized_state().save_snapshot(path)
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump({"version": 0, "saved_at": 0}, f)
+    with pytest.raises(ValueError, match="has version 0"):
+        State.load_snapshot(path)
+
+
+def test_warm_start_reconciles_with_the_server(tmp_path, url):
+    path = str(tmp_path / "snapshot")
+    with TradingClient(url, "a", "a") as a:
+        a.create_order(1, 40, 2, Side.BID)
+        a.create_order(1, 30, 1, Side.BID)
+        a.save_snapshot(path)
+    # What the snapshot misses
+    with TradingClient(url, "b", "b") as b:
+        b.create_order(1, 40, 1, Side.OFFER)
+        b.create_order(1, 60, 1, Side.OFFER)
+
+    with TradingClient(url, "a", "a", snapshot=path) as a:
+        state = a.state()
+        deadline = time.monotonic() + 5
+        while state.staleness.reconciled_at is None:
+            assert time.monotonic() < deadline
+            state = a.state()
+        staleness = state.staleness
+        assert (staleness.markets_reconciled, staleness.trades_missed) == (1, 1)
+        assert (staleness.orders_added, staleness.orders_resized) == (1, 1)
+        assert state.books[1].best_bid().size == 1
+        assert state.books[1].best_offer().price == 60
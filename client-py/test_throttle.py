@@ -0,0 +1,31 @@
+import websocket_api
+from throttle import Throttle, TokenBucket, coalesce_cancels
+
+
+def test_token_bucket_allows_burst_then_paces():
+    bucket = TokenBucket(burst=10, rate=100)
+    assert bucket.remaining() == 10
+    delays = [bucket.reserve() for _ in range(12)]
+    assert delays[:10] == [0.0] * 10
+    assert 0.009 < delays[10] <= 0.01
+    assert 0.019 < delays[11] <= 0.02
+    assert bucket.remaining() == 0
+
+
+def test_throttle_only_counts_quota_kinds():
+    throttle = Throttle()
+    mutate = throttle.remaining()["mutate"]
+    throttle.reserve(websocket_api.ClientMessage(out=websocket_api.Out(market_id=1)))
+    throttle.reserve(
+        websocket_api.ClientMessage(act_as=websocket_api.ActAs(user_id="bot"))
+    )
+    assert throttle.remaining()["mutate"] == mutate - 1
+
+
+def test_coalesce_cancels():
+    messages = [
+        websocket_api.ClientMessage(cancel_order=websocket_api.CancelOrder(id=order_id))
+        for order_id in (1, 2, 1)
+    ]
+    messages.append(websocket_api.ClientMessage(out=websocket_api.Out(market_id=1)))
+    assert coalesce_cancels(messages) == ([0, 1, 3], {2: 0})
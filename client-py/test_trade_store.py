@@ -0,0 +1,99 @@
+import pytest
+
+import websocket_api
+from trade_store import TradeStore
+from trading_client import State
+
+
+def trade(trade_id: int, price: float, size: float, buyer: str, seller: str):
+    return websocket_api.Trade(
+        id=trade_id,
+        market_id=1,
+        transaction_id=trade_id * 10,
+        price=price,
+        size=size,
+        buyer_id=buyer,
+        seller_id=seller,
+    )
+
+
+TRADES = [
+    trade(1, 40, 2, "a", "b"),
+    trade(2, 50, 1, "b", "c"),
+    trade(3, 45, 1, "a", "c"),
+]
+
+
+def test_queries():
+    store = TradeStore(1, TRADES)
+    assert len(store) == 3
+    assert store.volume() == 4
+    assert store.notional() == 80 + 50 + 45
+    assert store.vwap() == 175 / 4
+    assert store.positions() == {"a": 3, "b": -1, "c": -2}
+    assert store.position("c") == -2
+    assert store.position("nobody") == 0
+    assert TradeStore().vwap() is None
+
+
+def test_round_trips_trades():
+    store = TradeStore(1, TRADES)
+    assert list(store) == TRADES
+    assert store.trade(-1) == TRADES[-1]
+    assert store.last(2) == TRADES[1:]
+    with pytest.raises(IndexError):
+        store.trade(3)
+
+
+def test_growth_keeps_views():
+    store = TradeStore(1, TRADES)
+    view = store.prices
+    with pytest.raises(ValueError):
+        view[0] = 1
+    store.extend(
+        trade(i, 1, 1, "d", "a") for i in range(4, TradeStore._INITIAL_CAPACITY + 10)
+    )
+    assert len(store) == TradeStore._INITIAL_CAPACITY + 9
+    assert list(view) == [40, 50, 45]
+    assert store.ids[-1] == TradeStore._INITIAL_CAPACITY + 9
+    assert store.user_ids == ["a", "b", "c", "d"]
+
+
+@pytest.mark.parametrize("mmap", [False, True])
+def test_save_and_load(tmp_path, mmap):
+    TradeStore(1, TRADES).save(str(tmp_path))
+    store = TradeStore.load(str(tmp_path), 1, mmap=mmap)
+    assert list(store) == TRADES
+    store.append(trade(4, 1, 1, "e", "a"))
+    assert store.positions()["e"] == 1
+    assert len(TradeStore.load(str(tmp_path), 1)) == 3
+
+
+def test_state_keeps_trades_in_columns():
+    state = State(columnar_trades=True)
+    state._update(
+        websocket_api.ServerMessage(
+            market_data=websocket_api.Market(
+                id=1, name="one", open=websocket_api.MarketOpen(), trades=TRADES[:2]
+            )
+        )
+    )
+    state._update(
+        websocket_api.ServerMessage(
+            order_created=websocket_api.OrderCreated(
+                market_id=1, user_id="a", trades=TRADES[2:]
+            )
+        )
+    )
+    assert state.markets[1].trades == []
+    assert list(state.trade_stores[1]) == TRADES
+
+
+def test_same_parties():
+    store = TradeStore(1, TRADES)
+    assert store.same_parties(TRADES)
+    assert store.same_parties(TRADES[:2])
+    assert store.same_parties([])
+    # The server hid c's id
+    assert not store.same_parties(TRADES[:2] + [trade(3, 45, 1, "a", "hidden")])
+    assert not store.same_parties(TRADES + [trade(4, 1, 1, "a", "b")])
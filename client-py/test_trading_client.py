@@ -0,0 +1,342 @@
+import logging
+import threading
+import time
+
+import pytest
+
+import websocket_api
+from recording import RECEIVED, Recorder
+from replay import ReplayClient
+from trading_client import RequestFailed, State, TradingClient
+from websocket_api import Side
+
+
+def eventually(ready, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not ready():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def market_data(owner_id: str, buyer_id: str) -> websocket_api.ServerMessage:
+    return websocket_api.ServerMessage(
+        market_data=websocket_api.Market(
+            id=1,
+            name="one",
+            open=websocket_api.MarketOpen(),
+            orders=[
+                websocket_api.Order(
+                    id=10, market_id=1, owner_id="a", price=40, size=2, side=Side.BID
+                ),
+                websocket_api.Order(
+                    id=11,
+                    market_id=1,
+                    owner_id=owner_id,
+                    price=40,
+                    size=1,
+                    side=Side.BID,
+                ),
+            ],
+            trades=[
+                websocket_api.Trade(
+                    id=5,
+                    market_id=1,
+                    price=41,
+                    size=1,
+                    buyer_id=buyer_id,
+                    seller_id="a",
+                )
+            ],
+        )
+    )
+
+
+def users() -> websocket_api.ServerMessage:
+    return websocket_api.ServerMessage(
+        users=websocket_api.Users(
+            users=[websocket_api.User(id=name, name=name) for name in ("a", "b")]
+        )
+    )
+
+
+def acting_as(user_id: str) -> websocket_api.ServerMessage:
+    return websocket_api.ServerMessage(
+        acting_as=websocket_api.ActingAs(user_id=user_id)
+    )
+
+
+@pytest.mark.parametrize("columnar_trades", [False, True])
+def test_act_as_resend_unhides_owners_without_a_resync(columnar_trades, caplog):
+    state = State(columnar_trades=columnar_trades)
+    # Acting as a, with the server hiding everyone else's ids
+    for message in (users(), market_data("hidden", "hidden"), acting_as("a")):
+        state._update(message)
+    book = state.books[1]
+    assert [order.id for order in book.own_orders()] == [10]
+
+    # ActAs b: the server resends the public data with b's ids unhidden
+    state._act_as_sent()
+    with caplog.at_level(logging.WARNING, logger="trading_client"):
+        for message in (users(), market_data("b", "b"), acting_as("b")):
+            state._update(message)
+    assert not caplog.records
+    assert state.resyncs.count == 0
+
+    assert book.get(11).owner_id == "b"
+    assert [order.id for order in book.own_orders()] == [11]
+    assert book.own_orders_at(Side.BID, 40)[0].id == 11
+    # Time priority within the level is kept
+    assert [order.id for order in book.bids()] == [10, 11]
+    if columnar_trades:
+        assert state.trade_stores[1].position("b") == 1
+    else:
+        assert state.markets[1].trades[0].buyer_id == "b"
+
+    # A replay without an ActAs is still a resync
+    for message in (users(), market_data("b", "b")):
+        state._update(message)
+    assert state.resyncs.count == 1
+
+
+def test_resync_market_data_is_not_deduped(tmp_path):
+    snapshot = [users(), market_data("hidden", "hidden")]
+    portfolio = websocket_api.ServerMessage(portfolio=websocket_api.Portfolio())
+    with Recorder(str(tmp_path)) as recorder:
+        # Initialization, then a resync replaying the same market
+        for message in snapshot + [acting_as("a")] + snapshot + [portfolio]:
+            recorder.record(RECEIVED, bytes(message))
+    with ReplayClient(str(tmp_path), dedup_market_data=True) as client:
+        client.run()
+        resyncs = client.state().resyncs
+        assert (resyncs.count, resyncs.markets, resyncs.active) == (1, 1, False)
+        assert client.metrics().repeats_skipped == 0
+
+
+def record(path, messages):
+    with Recorder(str(path)) as recorder:
+        for message in messages:
+            recorder.record(RECEIVED, bytes(message))
+
+
+def test_init_error_is_raised_after_returning(tmp_path, caplog):
+    failed = websocket_api.ServerMessage(
+        request_failed=websocket_api.RequestFailed(
+            request_details=websocket_api.RequestFailedRequestDetails(kind="ActAs"),
+            error_details=websocket_api.RequestFailedErrorDetails(message="Nope"),
+        )
+    )
+    record(tmp_path, [users(), failed, market_data("a", "a")])
+    with caplog.at_level(logging.ERROR, logger="trading_client"):
+        client = ReplayClient(str(tmp_path), wait_for_init=False)
+        with pytest.raises(RuntimeError, match="ActAs request failed"):
+            client.state()
+    assert "ActAs request failed during initialization" in caplog.text
+    with pytest.raises(RuntimeError, match="ActAs request failed"):
+        client.create_order(1, 40, 1, Side.BID)
+    with pytest.raises(RuntimeError, match="ActAs request failed"):
+        client.request_many([])
+
+
+def test_failed_request_during_init_is_not_an_init_error(tmp_path):
+    record(tmp_path, [users(), market_data("a", "a"), acting_as("a")])
+    client = ReplayClient(str(tmp_path), wait_for_init=False)
+    with pytest.raises(RequestFailed, match="Market not found"):
+        client.create_order(2, 40, 1, Side.BID)
+    assert client.state().markets[1].name == "one"
+
+
+def test_background_receiver_applies_messages(url):
+    with TradingClient(url, "a", "a", receive_in_background=True) as a:
+        with TradingClient(url, "b", "b") as b:
+            order = b.create_order(1, 40, 1, Side.BID).order
+            # Nobody calls recv() on a, yet its state follows the market
+            eventually(lambda: a.state().books[1].get(order.id) is not None)
+            with pytest.raises(RuntimeError, match="owned by the background receiver"):
+                a.recv()
+        receiver = a._receiver
+    assert not receiver.is_alive()
+
+
+def test_background_receiver_hands_responses_to_each_thread(url):
+    with TradingClient(url, "a", "a", receive_in_background=True) as client:
+        prices = {}
+
+        def place(price: int):
+            prices[price] = client.create_order(1, price, 1, Side.BID).order.price
+
+        threads = [threading.Thread(target=place, args=(p,)) for p in range(10, 20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert prices == {price: price for price in range(10, 20)}
+        with pytest.raises(RequestFailed, match="Market not found"):
+            client.create_order(2, 40, 1, Side.BID)
+        assert len(client.state().books[1].own_orders()) == 10
+    with pytest.raises(ConnectionError, match="receiver thread has stopped"):
+        client.create_order(1, 40, 1, Side.BID)
+
+
+def create(market_id: int) -> websocket_api.ClientMessage:
+    return websocket_api.ClientMessage(
+        create_order=websocket_api.CreateOrder(
+            market_id=market_id, price=40, size=1, side=Side.BID
+        )
+    )
+
+
+@pytest.mark.parametrize("receive_in_background", [False, True])
+def test_request_many_partial_results(url, receive_in_background):
+    with TradingClient(
+        url, "a", "a", receive_in_background=receive_in_background, throttle=True
+    ) as client:
+        order_id = client.create_order(1, 40, 1, Side.BID).order.id
+        with pytest.raises(RequestFailed, match="Market not found"):
+            client.request_many([create(1), create(2)])
+        cancel = websocket_api.ClientMessage(
+            cancel_order=websocket_api.CancelOrder(id=order_id)
+        )
+        results = client.request_many(
+            [create(1), create(2), create(1), cancel, cancel],
+            raise_on_failure=False,
+        )
+        assert results[0].order_created.order.market_id == 1
+        assert isinstance(results[1], RequestFailed)
+        assert "Market not found" in str(results[1])
+        assert results[2].order_created.order.market_id == 1
+        # The repeated cancel was sent once and shares its response
+        assert results[3].order_cancelled.id == order_id
+        assert results[4] is results[3]
+        assert len(client.state().books[1].own_orders()) == 3
+
+
+def test_users_payments_and_ownerships_are_keyed_by_id():
+    state = State()
+    payment = websocket_api.Payment(id=1, payer_id="a", recipient_id="b", amount=5)
+    for message in (
+        users(),
+        websocket_api.ServerMessage(
+            payments=websocket_api.Payments(payments=[payment])
+        ),
+        websocket_api.ServerMessage(
+            ownerships=websocket_api.Ownerships(
+                ownerships=[websocket_api.Ownership(of_bot_id="bot")]
+            )
+        ),
+        # Repeats of what we already have are ignored
+        websocket_api.ServerMessage(user_created=websocket_api.User(id="a", name="x")),
+        websocket_api.ServerMessage(payment_created=websocket_api.Payment(id=1)),
+        websocket_api.ServerMessage(
+            ownership_received=websocket_api.Ownership(of_bot_id="bot")
+        ),
+        websocket_api.ServerMessage(user_created=websocket_api.User(id="c", name="c")),
+        websocket_api.ServerMessage(payment_created=websocket_api.Payment(id=2)),
+        websocket_api.ServerMessage(
+            ownership_received=websocket_api.Ownership(of_bot_id="other")
+        ),
+    ):
+        state._update(message)
+    assert state.users_by_id["a"].name == "a"
+    assert [user.id for user in state.users] == ["a", "b", "c"]
+    assert state.payments_by_id[1] is payment
+    assert [payment.id for payment in state.payments] == [1, 2]
+    assert list(state.ownerships_by_bot_id) == ["bot", "other"]
+    assert [ownership.of_bot_id for ownership in state.ownerships] == ["bot", "other"]
+
+    # A fresh list replaces what we had
+    state._update(
+        websocket_api.ServerMessage(payments=websocket_api.Payments(payments=[]))
+    )
+    assert state.payments == []
+
+
+def test_watch_markets_skips_other_markets(url):
+    with TradingClient(url, "b", "b") as b:
+        b.request(
+            websocket_api.ClientMessage(
+                create_market=websocket_api.CreateMarket(
+                    name="two", min_settlement=0, max_settlement=100
+                )
+            )
+        )
+        with TradingClient(url, "a", "a", watch_markets=[1]) as a:
+            assert set(a.state().markets) == {1}
+            assert a.watched_markets == frozenset({1})
+            skipped = a.metrics().frames_skipped
+            b.create_order(2, 40, 1, Side.OFFER)
+            b.create_order(1, 60, 1, Side.OFFER)
+            # Our own requests about an unwatched market still get their response
+            created = a.create_order(2, 40, 1, Side.BID)
+            assert created.trades[0].seller_id == "b"
+            state = a.state()
+            assert set(state.markets) == {1}
+            assert len(state.books[1]) == 1
+            assert a.metrics().frames_skipped > skipped
+
+            market = a.watch_market(2)
+            assert market.id == 2
+            assert a.state().markets[2].trades[0].buyer_id == "a"
+            a.unwatch_market(1)
+            assert set(a.state().markets) == {2}
+            assert 1 not in a.state().books
+
+
+def test_streaming_initialization(url):
+    with TradingClient(url, "a", "a", wait_for_init=False) as client:
+        seen = []
+        client.events.on("market_data", lambda market: seen.append(market.id))
+        client.events.on("acting_as", lambda acting_as: seen.append(acting_as.user_id))
+        market = client.market_ready(1, timeout=5)
+        assert market.name == "one"
+        assert client.state().books[1] is not None
+        assert seen[0] == 1
+        with pytest.raises(KeyError, match=r"Markets not found: \[2\]"):
+            client.wait_for_markets([1, 2], timeout=5)
+        assert seen == [1, "a"]
+        timings = client.state().init_timings
+        assert list(timings.markets) == [1]
+        assert [name for name, _ in timings.breakdown()][0] == "connected"
+        assert timings.total >= timings.markets[1]
+
+
+def test_resync_is_applied_as_a_diff():
+    def market(*orders: websocket_api.Order) -> websocket_api.ServerMessage:
+        return websocket_api.ServerMessage(
+            market_data=websocket_api.Market(
+                id=1, name="one", open=websocket_api.MarketOpen(), orders=list(orders)
+            )
+        )
+
+    def order(order_id: int, price: float, size: float) -> websocket_api.Order:
+        return websocket_api.Order(
+            id=order_id,
+            market_id=1,
+            owner_id="a",
+            price=price,
+            size=size,
+            side=Side.BID,
+        )
+
+    state = State()
+    for message in (
+        users(),
+        market(order(10, 40, 2), order(11, 39, 1)),
+        acting_as("a"),
+    ):
+        state._update(message)
+    kept = state.books[1].get(10)
+
+    # The server replays its snapshot, then carries on
+    for message in (
+        users(),
+        market(order(10, 40, 1), order(12, 38, 1)),
+        websocket_api.ServerMessage(portfolio=websocket_api.Portfolio()),
+    ):
+        state._update(message)
+    resyncs = state.resyncs
+    assert (resyncs.count, resyncs.markets, resyncs.active) == (1, 1, False)
+    assert (resyncs.orders_added, resyncs.orders_removed) == (1, 1)
+    assert resyncs.orders_resized == 1
+    assert state.books[1].get(10) is kept
+    assert kept.size == 1
+    assert state.find_order(11) is None
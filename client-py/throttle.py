@@ -0,0 +1,167 @@
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import betterproto
+import websocket_api
+
+# The backend's quotas, per authenticated user across all of their connections:
+# requests allowed at once, and how many seconds it takes to earn them back
+MUTATE_QUOTA = (100, 1.0)
+CONNECT_QUOTA = (180, 60.0)
+
+# Kinds of ClientMessage counted against each quota
+MUTATING_KINDS = frozenset(
+    (
+        "create_market",
+        "settle_market",
+        "create_order",
+        "cancel_order",
+        "make_payment",
+        "out",
+        "create_bot",
+        "give_ownership",
+        "redeem",
+    )
+)
+CONNECTING_KINDS = frozenset(("authenticate", "upgrade_market_data"))
+
+
+class TokenBucket:
+    """
+    Generic cell rate algorithm, the token bucket the backend's rate limiter uses:
+    up to `burst` requests at once, then one every `1 / rate` seconds.
+
+    Tokens are reserved rather than waited for, so concurrent callers are served in
+    the order they asked, each told how long to wait before sending.
+    """
+
+    def __init__(self, burst: int, rate: float):
+        self.burst = burst
+        self.rate = rate
+        self._interval = 1 / rate
+        self._tolerance = (burst - 1) * self._interval
+        # When the bucket will next be full
+        self._theoretical_arrival = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Take a token, returning how many seconds to wait before using it.
+        """
+        with self._lock:
+            now = time.monotonic()
+            arrival = max(self._theoretical_arrival, now)
+            self._theoretical_arrival = arrival + self._interval
+            return max(0.0, arrival - self._tolerance - now)
+
+    def take(self) -> bool:
+        """
+        Take a token if one is available right now, as the server's rate limiter does.
+        """
+        with self._lock:
+            now = time.monotonic()
+            arrival = max(self._theoretical_arrival, now)
+            if arrival - self._tolerance > now:
+                return False
+            self._theoretical_arrival = arrival + self._interval
+            return True
+
+    def remaining(self) -> int:
+        """
+        How many tokens could be taken right now without waiting.
+        """
+        now = time.monotonic()
+        arrival = max(self._theoretical_arrival, now)
+        # Rounded so that float error doesn't hide the last token
+        tokens = round((now + self._tolerance - arrival) / self._interval, 6)
+        return max(0, int(tokens) + 1)
+
+    def drain(self):
+        """
+        Assume the bucket is empty, e.g. after the server reported it was.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._theoretical_arrival = max(
+                self._theoretical_arrival, now + self._tolerance + self._interval
+            )
+
+
+class Throttle:
+    """
+    Paces outgoing messages to stay within the backend's mutate and connect quotas,
+    instead of having them rejected with "Rate Limited".
+
+    `headroom` is the fraction of each burst kept in reserve, so that messages sent
+    at exactly the sustainable rate still fit when network jitter bunches them up.
+    The server counts quotas per user, so clients logged in as the same user
+    should share one `Throttle`.
+    """
+
+    def __init__(self, headroom: float = 0.1):
+        burst, seconds = MUTATE_QUOTA
+        self.mutate = TokenBucket(int(burst * (1 - headroom)), burst / seconds)
+        burst, seconds = CONNECT_QUOTA
+        self.connect = TokenBucket(int(burst * (1 - headroom)), burst / seconds)
+        self.waited = 0.0
+        self.throttled = 0
+
+    def reserve(self, message: websocket_api.ClientMessage) -> float:
+        """
+        Take a token for `message` if its kind counts against a quota, returning how
+        many seconds to wait before sending it.
+        """
+        bucket = self._bucket(betterproto.which_one_of(message, "message")[0])
+        if bucket is None:
+            return 0.0
+        delay = bucket.reserve()
+        if delay > 0:
+            self.waited += delay
+            self.throttled += 1
+        return delay
+
+    def remaining(self) -> Dict[str, int]:
+        """
+        How many mutating and connecting messages could be sent right now.
+        """
+        return {"mutate": self.mutate.remaining(), "connect": self.connect.remaining()}
+
+    def _bucket(self, kind: str) -> Optional[TokenBucket]:
+        if kind in MUTATING_KINDS:
+            return self.mutate
+        if kind in CONNECTING_KINDS:
+            return self.connect
+        return None
+
+    def _rate_limited(self, request_failed: websocket_api.RequestFailed):
+        """
+        The server rejected a request anyway, so its bucket is empty: stop until our
+        estimate of it has refilled by a token.
+        """
+        message = request_failed.error_details.message
+        if message == "Rate Limited (mutating)":
+            self.mutate.drain()
+        elif message == "Rate Limited (connecting)":
+            self.connect.drain()
+
+
+def coalesce_cancels(
+    messages: Sequence[websocket_api.ClientMessage],
+) -> Tuple[List[int], Dict[int, int]]:
+    """
+    Split a batch of messages into the indices of those to send and, for repeated
+    cancels of the same order, the index of the first cancel whose response to share.
+    """
+    send: List[int] = []
+    duplicates: Dict[int, int] = {}
+    first_cancels: Dict[int, int] = {}
+    for i, message in enumerate(messages):
+        kind, body = betterproto.which_one_of(message, "message")
+        if kind == "cancel_order":
+            first = first_cancels.setdefault(body.id, i)
+            if first != i:
+                duplicates[i] = first
+                continue
+        send.append(i)
+    return send, duplicates
@@ -0,0 +1,252 @@
+import json
+import os
+from operator import attrgetter
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+import websocket_api
+
+
+class TradeStore:
+    """
+    Append-only, columnar store of one market's trades.
+
+    Each field lives in its own NumPy buffer that grows by doubling, and buyer and
+    seller ids are interned into small integer codes (see `user_ids`). The column
+    properties are zero-copy, read-only views of the filled part of each buffer, so
+    volume, VWAP and position queries are single vectorized passes.
+
+    A view taken before a later append keeps showing the trades it was taken over.
+    """
+
+    _INITIAL_CAPACITY = 1024
+    _COLUMNS = (
+        "_ids",
+        "_transaction_ids",
+        "_prices",
+        "_sizes",
+        "_buyers",
+        "_sellers",
+    )
+
+    def __init__(self, market_id: int = 0, trades: Iterable[websocket_api.Trade] = ()):
+        self.market_id = market_id
+        self._len = 0
+        self._capacity = self._INITIAL_CAPACITY
+        self._ids = np.empty(self._capacity, dtype=np.int64)
+        self._transaction_ids = np.empty(self._capacity, dtype=np.int64)
+        self._prices = np.empty(self._capacity, dtype=np.float64)
+        self._sizes = np.empty(self._capacity, dtype=np.float64)
+        self._buyers = np.empty(self._capacity, dtype=np.int32)
+        self._sellers = np.empty(self._capacity, dtype=np.int32)
+        self.user_ids: List[str] = []
+        self._user_codes: Dict[str, int] = {}
+        self.extend(trades)
+
+    def __len__(self):
+        return self._len
+
+    def save(self, directory: str):
+        """
+        Write each column to its own `.npy` file in `directory`, plus the user ids.
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name in self._COLUMNS:
+            column = self._view(getattr(self, name))
+            np.save(os.path.join(directory, f"{name[1:]}.npy"), column)
+        with open(os.path.join(directory, "user_ids.json"), "w") as f:
+            json.dump(self.user_ids, f)
+
+    @classmethod
+    def load(
+        cls, directory: str, market_id: int = 0, mmap: bool = True
+    ) -> "TradeStore":
+        """
+        Read a store written by `save`.
+
+        With `mmap` the columns are memory-mapped read-only rather than read into
+        memory; the first append copies them into ordinary buffers.
+        """
+        store = cls(market_id)
+        columns = {
+            name: np.load(
+                os.path.join(directory, f"{name[1:]}.npy"),
+                mmap_mode="r" if mmap else None,
+            )
+            for name in cls._COLUMNS
+        }
+        length = len(columns["_ids"])
+        for name, column in columns.items():
+            if len(column) != length:
+                raise ValueError(
+                    f"Column {name[1:]} in {directory} has the wrong length"
+                )
+            setattr(store, name, column)
+        store._len = store._capacity = length
+        with open(os.path.join(directory, "user_ids.json")) as f:
+            store.user_ids = json.load(f)
+        store._user_codes = {user_id: i for i, user_id in enumerate(store.user_ids)}
+        return store
+
+    def append(self, trade: websocket_api.Trade):
+        self.extend((trade,))
+
+    def extend(self, trades: Iterable[websocket_api.Trade]):
+        trades = list(trades)
+        if not trades:
+            return
+        start = self._len
+        end = start + len(trades)
+        self._reserve(end)
+        code = self._intern
+        self._ids[start:end] = [trade.id for trade in trades]
+        self._transaction_ids[start:end] = [trade.transaction_id for trade in trades]
+        self._prices[start:end] = [trade.price for trade in trades]
+        self._sizes[start:end] = [trade.size for trade in trades]
+        self._buyers[start:end] = [code(trade.buyer_id) for trade in trades]
+        self._sellers[start:end] = [code(trade.seller_id) for trade in trades]
+        self._len = end
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._view(self._ids)
+
+    @property
+    def transaction_ids(self) -> np.ndarray:
+        return self._view(self._transaction_ids)
+
+    @property
+    def prices(self) -> np.ndarray:
+        return self._view(self._prices)
+
+    @property
+    def sizes(self) -> np.ndarray:
+        return self._view(self._sizes)
+
+    @property
+    def buyer_codes(self) -> np.ndarray:
+        """
+        Index into `user_ids` of the buyer of each trade.
+        """
+        return self._view(self._buyers)
+
+    @property
+    def seller_codes(self) -> np.ndarray:
+        """
+        Index into `user_ids` of the seller of each trade.
+        """
+        return self._view(self._sellers)
+
+    def user_code(self, user_id: str) -> Optional[int]:
+        return self._user_codes.get(user_id)
+
+    def same_parties(self, trades: Sequence[websocket_api.Trade]) -> bool:
+        """
+        Whether the first `len(trades)` trades have the buyers and sellers of
+        `trades`, comparing the decoded id columns in one pass.
+        """
+        count = len(trades)
+        if count > self._len:
+            return False
+        user_ids = np.array(self.user_ids, dtype=object)
+        for codes, parties in (
+            (self.buyer_codes, map(attrgetter("buyer_id"), trades)),
+            (self.seller_codes, map(attrgetter("seller_id"), trades)),
+        ):
+            ids = np.fromiter(parties, dtype=object, count=count)
+            if not np.array_equal(user_ids[codes[:count]], ids):
+                return False
+        return True
+
+    def volume(self) -> float:
+        return float(self.sizes.sum())
+
+    def notional(self) -> float:
+        return float(np.dot(self.prices, self.sizes))
+
+    def vwap(self) -> Optional[float]:
+        volume = self.volume()
+        if volume == 0:
+            return None
+        return self.notional() / volume
+
+    def position(self, user_id: str) -> float:
+        """
+        Net size bought minus sold by a user.
+        """
+        code = self._user_codes.get(user_id)
+        if code is None:
+            return 0.0
+        sizes = self.sizes
+        bought = sizes[self.buyer_codes == code].sum()
+        sold = sizes[self.seller_codes == code].sum()
+        return float(bought - sold)
+
+    def positions(self) -> Dict[str, float]:
+        """
+        Net position of every user that traded, keyed by user id.
+        """
+        users = len(self.user_ids)
+        sizes = self.sizes
+        net = np.bincount(self.buyer_codes, weights=sizes, minlength=users)
+        net -= np.bincount(self.seller_codes, weights=sizes, minlength=users)
+        return dict(zip(self.user_ids, net.tolist()))
+
+    def trade(self, i: int) -> websocket_api.Trade:
+        """
+        Rebuild the i-th trade as a protobuf message.
+        """
+        if i < 0:
+            i += self._len
+        if not 0 <= i < self._len:
+            raise IndexError("trade index out of range")
+        return websocket_api.Trade(
+            id=int(self._ids[i]),
+            market_id=self.market_id,
+            transaction_id=int(self._transaction_ids[i]),
+            price=float(self._prices[i]),
+            size=float(self._sizes[i]),
+            buyer_id=self.user_ids[self._buyers[i]],
+            seller_id=self.user_ids[self._sellers[i]],
+        )
+
+    def last(self, count: int) -> List[websocket_api.Trade]:
+        """
+        The most recent `count` trades as protobuf messages, oldest first.
+        """
+        return [self.trade(i) for i in range(max(self._len - count, 0), self._len)]
+
+    def __iter__(self) -> Iterator[websocket_api.Trade]:
+        for i in range(self._len):
+            yield self.trade(i)
+
+    def nbytes(self) -> int:
+        """
+        Bytes held by the column buffers, including spare capacity.
+        """
+        return sum(getattr(self, name).nbytes for name in self._COLUMNS)
+
+    def _intern(self, user_id: str) -> int:
+        code = self._user_codes.get(user_id)
+        if code is None:
+            code = self._user_codes[user_id] = len(self.user_ids)
+            self.user_ids.append(user_id)
+        return code
+
+    def _view(self, column: np.ndarray) -> np.ndarray:
+        view = column[: self._len]
+        view.flags.writeable = False
+        return view
+
+    def _reserve(self, needed: int):
+        if needed <= self._capacity:
+            return
+        capacity = max(self._capacity, self._INITIAL_CAPACITY)
+        while capacity < needed:
+            capacity *= 2
+        for name in self._COLUMNS:
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[: self._len] = old[: self._len]
+            setattr(self, name, new)
+        self._capacity = capacity
@@ -1,14 +1,41 @@
 import logging
+import os
+import threading
+import time
 import uuid
+from concurrent.futures import Future
 from dataclasses import dataclass, field
-from typing import Optional
+from operator import attrgetter
+from typing import (
+    Callable,
+    FrozenSet,
+    Iterable,
+    Literal,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+    cast,
+    overload,
+)
 
 import betterproto
+import snapshot
 import websocket_api
-from typing_extensions import Dict, List
+from codec import BetterprotoCodec, Codec, MarketDataDedup, peek
+from events import Events
+from metrics import Metrics, MetricsReporter
+from recording import RECEIVED, SENT, Recorder
+from throttle import Throttle, coalesce_cancels
+from order_book import OrderBook, OrderIndex
+from typing_extensions import TYPE_CHECKING, Dict, List
+from websockets.exceptions import ConnectionClosed
 from websockets.frames import CloseCode
 from websockets.sync.client import ClientConnection, connect
 
+if TYPE_CHECKING:
+    from trade_store import TradeStore
+
 logger = logging.getLogger(__name__)
 
 
@@ -19,33 +46,145 @@ class TradingClient:
 
     _ws: ClientConnection
     _state: "State"
+    _receiver: Optional[threading.Thread] = None
+    _reporter: Optional[MetricsReporter] = None
 
-    def __init__(self, api_url: str, jwt: str, act_as: str):
+    def __init__(
+        self,
+        api_url: str,
+        jwt: str,
+        act_as: str,
+        *,
+        receive_in_background: bool = False,
+        columnar_trades: bool = False,
+        codec: Optional[Codec] = None,
+        watch_markets: Optional[Iterable[int]] = None,
+        snapshot: Optional[str] = None,
+        wait_for_init: bool = True,
+        metrics_interval: Optional[float] = None,
+        metrics_path: Optional[str] = None,
+        throttle: Union[Throttle, bool] = False,
+        dedup_market_data: bool = False,
+        recording: Union[str, Recorder, None] = None,
+    ):
         """
         Connect, Authenticate, then make sure all of the messages holding initial state have been received.
+
+        With `receive_in_background`, a dedicated thread owns the socket once
+        initialization is done: it applies messages to the state as they arrive,
+        `state()` no longer drains the socket, and `request()` waits for the thread to
+        hand it the response.
+
+        With `columnar_trades`, trades are kept in `State.trade_stores` instead of
+        `Market.trades` (this needs NumPy).
+
+        `codec` decodes and encodes frames, `BetterprotoCodec` by default; pass
+        `codec.FastCodec()` for a faster decoder producing the same messages.
+
+        With `watch_markets`, only those markets are kept in the state: messages about
+        any other market are skipped without being decoded, unless they are responses
+        to our own requests. Use `watch_market` to bring in another market later.
+
+        With `snapshot`, the state is first restored from that directory if it holds
+        a snapshot written by `save_snapshot`, and then this returns without waiting
+        for the initial data from the server. That data replaces the restored state
+        as it arrives, and `state().staleness` counts what the snapshot had missed.
+
+        With `wait_for_init=False`, this returns as soon as Authenticate is sent, and
+        markets become usable one by one as the server sends them; use `market_ready`
+        or `wait_for_markets` to wait for the ones you need. Either way,
+        `state().init_timings` records when each part of the initial data arrived.
+
+        `events` holds callbacks fired after each message is applied to the state (see
+        `Events`); with `wait_for_init=False` they also see the rest of the initial
+        data.
+
+        `metrics()` measures request round trips and the cost of received frames. With
+        `metrics_interval`, they are logged every that many seconds, and with
+        `metrics_path` also appended to that file as lines of JSON.
+
+        With `throttle`, True or a `Throttle`, mutating and connecting messages are
+        paced to stay within the server's rate limits, and repeated cancels of an
+        order in `request_many` are sent once. Pass a shared `Throttle` to clients
+        logged in as the same user. It's off by default, so everything is sent
+        straight away and exactly as given.
+
+        With `dedup_market_data`, a `MarketData` frame identical to the last one
+        applied for its market, with nothing else about the market in between, is
+        dropped without being decoded; `metrics()` counts what that saved. It's off
+        by default since it peeks at every frame, which costs more than it saves
+        unless the server resends markets often. Frames of a resync are never
+        dropped, so `State.resyncs` sees every market.
+
+        With `recording`, a directory or a `recording.Recorder`, every frame received
+        and sent is recorded with its timestamp, to replay or benchmark against later.
         """
-        self._ws = connect(api_url)
-        self._state = State()
-        self._outstanding_requests = set()
+        self.events = Events()
+        if throttle is True:
+            throttle = Throttle()
+        self.throttle: Optional[Throttle] = throttle or None
+        self._metrics = Metrics()
+        self._dedup = MarketDataDedup() if dedup_market_data else None
+        self._owns_recorder = isinstance(recording, str)
+        self._recorder = (
+            Recorder(recording) if isinstance(recording, str) else recording
+        )
+        self._codec = codec if codec is not None else BetterprotoCodec()
+        self._watched: Optional[Set[int]] = (
+            None if watch_markets is None else set(watch_markets)
+        )
+        if snapshot is not None and os.path.exists(snapshot):
+            self._state = State.load_snapshot(snapshot, columnar_trades=columnar_trades)
+            if self._watched is not None:
+                for market_id in list(self._state.markets):
+                    if market_id not in self._watched:
+                        self._state._drop_market(market_id)
+        else:
+            self._state = State(columnar_trades=columnar_trades)
+        # request_ids `request` and `request_many` are waiting on, when not receiving
+        # in the background (then `_pending` holds them)
+        self._awaiting: Set[str] = set()
+        self._init_error: Optional[RuntimeError] = None
+        self._state.init_timings = InitTimings()
+        self._ws = self._connect(api_url)
+        self._state.init_timings._record("connected")
+        self._pending: Dict[str, "Future[websocket_api.ServerMessage]"] = {}
+        self.state_lock = threading.RLock()
+        # Notified by the receiver thread after each message it applies
+        self._state_changed = threading.Condition(self.state_lock)
         authenticate = websocket_api.Authenticate(jwt=jwt, act_as=act_as)
         self.send(websocket_api.ClientMessage(authenticate=authenticate))
-        while self._state._initializing:
-            server_message = self.recv()
-            _, message = betterproto.which_one_of(server_message, "message")
-            if isinstance(message, websocket_api.RequestFailed):
-                raise RuntimeError(
-                    f"{message.request_details.kind} request failed during initialization: {message.error_details.message}"
-                )
+        if wait_for_init and self._state.staleness is None:
+            self._wait_until(lambda: not self._state._initializing, None)
+        if receive_in_background:
+            self._receiver = threading.Thread(
+                target=self._receive_forever, name="TradingClient receiver", daemon=True
+            )
+            self._receiver.start()
+        if metrics_interval is not None:
+            self._reporter = MetricsReporter(
+                self._summarize_metrics, metrics_interval, metrics_path
+            )
+            self._reporter.start()
 
     def state(self) -> "State":
         """
         Return the up-to-date state of the client.
+
+        When receiving in the background the state is updated concurrently; hold
+        `state_lock` while reading if you need a consistent view across several markets.
+
+        Raises the error if a request failed during initialization, which with
+        `wait_for_init=False` or `snapshot` happens after this client is returned.
         """
-        try:
-            while True:
-                self.recv(timeout=1e-100)
-        except TimeoutError:
-            return self._state
+        if self._receiver is None:
+            try:
+                while True:
+                    self.recv(timeout=1e-100)
+            except TimeoutError:
+                pass
+        self._check_initialized()
+        return self._state
 
     def create_order(
         self,
@@ -58,17 +197,11 @@ class TradingClient:
         Place an order on the exchange.
         Note that if price and size are passed as float or Decimal they will be quantized.
         """
-        price_quantized = round(price, 2)
-        if abs(price_quantized - price) > 1e-4:
-            logger.warning(f"Price {price} quantized to {price_quantized}")
-        size_quantized = round(size, 2)
-        if abs(size_quantized - size) > 1e-4:
-            logger.warning(f"Size {size} quantized to {size_quantized}")
         msg = websocket_api.ClientMessage(
             create_order=websocket_api.CreateOrder(
                 market_id=market_id,
-                price=price_quantized,
-                size=size_quantized,
+                price=quantize(price, "Price"),
+                size=quantize(size, "Size"),
                 side=side,
             ),
         )
@@ -110,13 +243,10 @@ class TradingClient:
         Redeem a position in a market.
         Note that if amount is passed as float or Decimal it will be quantized.
         """
-        amount_quantized = round(amount, 2)
-        if abs(amount_quantized - amount) > 1e-4:
-            logger.warning(f"Amount {amount} quantized to {amount_quantized}")
         msg = websocket_api.ClientMessage(
             redeem=websocket_api.Redeem(
                 fund_id=fund_id,
-                amount=amount_quantized,
+                amount=quantize(amount, "Amount"),
             ),
         )
         response = self.request(msg)
@@ -124,70 +254,379 @@ class TradingClient:
         assert isinstance(message, websocket_api.Redeemed)
         return message
 
+    def market_ready(
+        self, market_id: int, timeout: Optional[float] = None
+    ) -> websocket_api.Market:
+        """
+        Wait until the state holds a market, for use with `wait_for_init=False`.
+        Raises KeyError if initialization finishes without it.
+        """
+        return self.wait_for_markets([market_id], timeout)[market_id]
+
+    def wait_for_markets(
+        self, market_ids: Iterable[int], timeout: Optional[float] = None
+    ) -> Dict[int, websocket_api.Market]:
+        """
+        Wait until the state holds all of the given markets, see `market_ready`.
+        """
+        market_ids = list(market_ids)
+        markets = self._state.markets
+        self._wait_until(
+            lambda: not self._state._initializing
+            or all(market_id in markets for market_id in market_ids),
+            timeout,
+        )
+        with self.state_lock:
+            missing = [
+                market_id for market_id in market_ids if market_id not in markets
+            ]
+            if missing:
+                raise KeyError(f"Markets not found: {missing}")
+            return {market_id: markets[market_id] for market_id in market_ids}
+
+    def metrics(self) -> Metrics:
+        """
+        Request round-trip latencies and the time spent decoding and applying frames,
+        by kind of message. `metrics().format()` makes a table of them and `reset()`
+        starts over.
+        """
+        return self._metrics
+
+    def save_snapshot(self, path: str):
+        """
+        Write the current state to the directory `path`, to warm start from later.
+        """
+        state = self.state()
+        with self.state_lock:
+            state.save_snapshot(path)
+
+    @property
+    def watched_markets(self) -> Optional[FrozenSet[int]]:
+        """
+        Ids of the markets kept in the state, or None if every market is.
+        """
+        return None if self._watched is None else frozenset(self._watched)
+
+    def watch_market(self, market_id: int) -> websocket_api.Market:
+        """
+        Start following a market that `watch_markets` left out, from a fresh snapshot.
+        Note that the server counts snapshot requests against the connection rate limit.
+        """
+        if self._watched is None or market_id in self._watched:
+            return self.state().markets[market_id]
+        msg = websocket_api.ClientMessage(
+            upgrade_market_data=websocket_api.UpgradeMarketData(
+                market_id=market_id,
+            ),
+        )
+        response = self.request(msg)
+        _, message = betterproto.which_one_of(response, "message")
+        assert isinstance(message, websocket_api.Market)
+        return message
+
+    def unwatch_market(self, market_id: int):
+        """
+        Stop following a market and drop it from the state.
+        """
+        if self._watched is None:
+            raise ValueError(
+                "Pass watch_markets to TradingClient to choose which markets to follow"
+            )
+        with self.state_lock:
+            self._watched.discard(market_id)
+            self._state._drop_market(market_id)
+            if self._dedup is not None:
+                self._dedup.forget(market_id)
+
     def request(
         self, message: websocket_api.ClientMessage
     ) -> websocket_api.ServerMessage:
         """
         Send a message to the server and wait for a response.
         """
+        self._check_not_dispatching()
+        self._check_initialized()
         if not message.request_id:
             message.request_id = str(uuid.uuid4())
-        self.send(message)
-        while True:
-            server_message = self.recv()
-            if server_message.request_id == message.request_id:
-                _, message = betterproto.which_one_of(server_message, "message")
-                if isinstance(message, websocket_api.RequestFailed):
-                    raise RequestFailed(
-                        f"{message.request_details.kind} request failed: {message.error_details.message}"
-                    )
-                return server_message
+        if self._receiver is not None:
+            future = self._expect_response(message.request_id)
+            try:
+                self.send(message)
+                return _check_response(future.result())
+            finally:
+                self._metrics._abandon(message.request_id)
+        self._awaiting.add(message.request_id)
+        try:
+            self.send(message)
+            while True:
+                server_message = self.recv()
+                if server_message.request_id == message.request_id:
+                    return _check_response(server_message)
+        finally:
+            self._awaiting.discard(message.request_id)
+            self._metrics._abandon(message.request_id)
+
+    @overload
+    def request_many(
+        self,
+        messages: List[websocket_api.ClientMessage],
+        *,
+        raise_on_failure: Literal[True] = True,
+    ) -> List[websocket_api.ServerMessage]: ...
 
+    @overload
     def request_many(
-        self, messages: List[websocket_api.ClientMessage]
-    ) -> List[websocket_api.ServerMessage]:
+        self,
+        messages: List[websocket_api.ClientMessage],
+        *,
+        raise_on_failure: Literal[False],
+    ) -> List[Union[websocket_api.ServerMessage, "RequestFailed"]]: ...
+
+    def request_many(
+        self,
+        messages: List[websocket_api.ClientMessage],
+        *,
+        raise_on_failure: bool = True,
+    ) -> List[Union[websocket_api.ServerMessage, "RequestFailed"]]:
         """
         Send a list of messages to the server and wait for responses.
+
+        By default the first failed request raises `RequestFailed`. With
+        `raise_on_failure=False` every response is waited for, and failed requests
+        get a `RequestFailed` in their slot instead of a `ServerMessage`.
         """
+        self._check_not_dispatching()
+        self._check_initialized()
         for message in messages:
             if not message.request_id:
                 message.request_id = str(uuid.uuid4())
-            self.send(message)
-        responses = [websocket_api.ServerMessage() for _ in messages]
-        while any(not response.request_id for response in responses):
-            server_message = self.recv()
-            for i, message in enumerate(messages):
-                if server_message.request_id == message.request_id:
-                    _, response = betterproto.which_one_of(server_message, "message")
-                    if isinstance(response, websocket_api.RequestFailed):
-                        raise RequestFailed(
-                            f"{response.request_details.kind} request failed: {response.error_details.message}"
-                        )
-                    responses[i] = server_message
-        return responses
+        results: List[Union[websocket_api.ServerMessage, RequestFailed, None]]
+        results = [None] * len(messages)
+        if self.throttle is not None:
+            send, duplicates = coalesce_cancels(messages)
+        else:
+            send, duplicates = list(range(len(messages))), {}
+        if self._receiver is not None:
+            futures = [(i, self._expect_response(messages[i].request_id)) for i in send]
+            try:
+                for i in send:
+                    self.send(messages[i])
+                for i, future in futures:
+                    results[i] = _response_or_error(future.result(), raise_on_failure)
+            finally:
+                for i in send:
+                    self._metrics._abandon(messages[i].request_id)
+        else:
+            slots = {messages[i].request_id: i for i in send}
+            self._awaiting.update(slots)
+            try:
+                for i in send:
+                    self.send(messages[i])
+                pending = len(slots)
+                while pending:
+                    server_message = self.recv()
+                    i = slots.pop(server_message.request_id, None)
+                    if i is None:
+                        continue
+                    results[i] = _response_or_error(server_message, raise_on_failure)
+                    pending -= 1
+            finally:
+                for i in send:
+                    self._awaiting.discard(messages[i].request_id)
+                    self._metrics._abandon(messages[i].request_id)
+        for i, first in duplicates.items():
+            results[i] = results[first]
+        return cast(List[Union[websocket_api.ServerMessage, RequestFailed]], results)
 
     def close(self, code: int = CloseCode.NORMAL_CLOSURE, reason: str = ""):
         """
         Close the connection to the server.
         """
         self._ws.close(code, reason)
+        if self._reporter is not None:
+            self._reporter.stop()
+        if (
+            self._receiver is not None
+            and self._receiver is not threading.current_thread()
+        ):
+            self._receiver.join()
+        if self._recorder is not None:
+            if self._owns_recorder:
+                self._recorder.close()
+            else:
+                self._recorder.flush()
 
     def recv(self, timeout: Optional[float] = None) -> websocket_api.ServerMessage:
         """
         Wait for a message from the server and update the state accordingly,
         returning the kind of message and the message.
         """
-        message = self._ws.recv(timeout=timeout)
-        assert isinstance(message, bytes)
-        decoded = websocket_api.ServerMessage().parse(message)
-        self._state._update(decoded)
-        return decoded
+        if self._receiver is not None:
+            raise RuntimeError("recv() is owned by the background receiver thread")
+        return self._recv(timeout)
+
+    def _recv(self, timeout: Optional[float] = None) -> websocket_api.ServerMessage:
+        while True:
+            message = self._ws.recv(timeout=timeout)
+            assert isinstance(message, bytes)
+            if self._recorder is not None:
+                self._recorder.record(RECEIVED, message)
+            started = time.perf_counter_ns()
+            if self._watched is None and self._dedup is None:
+                decoded = self._codec.decode(message)
+                with self.state_lock:
+                    applying = time.perf_counter_ns()
+                    self._apply(decoded)
+                    self._metrics._frame(
+                        decoded, applying - started, time.perf_counter_ns() - applying
+                    )
+                return decoded
+            peeked = peek(message)
+            market_id = peeked.market_id
+            if market_id is not None and not self._is_awaited(peeked.request_id):
+                if self._watched is not None and market_id not in self._watched:
+                    self._metrics._skipped()
+                    continue
+                if self._dedup is not None and not self._state.resyncs.active:
+                    decode_ns = self._dedup.repeat(message, peeked)
+                    if decode_ns is not None:
+                        self._metrics._repeated(len(message), decode_ns)
+                        continue
+            decoded = self._codec.decode(message)
+            with self.state_lock:
+                applying = time.perf_counter_ns()
+                applied = True
+                if (
+                    self._watched is None
+                    or market_id is None
+                    or market_id in self._watched
+                ):
+                    self._apply(decoded)
+                elif peeked.kind == "market_data":
+                    # The snapshot requested by watch_market
+                    self._watched.add(market_id)
+                    self._apply(decoded)
+                else:
+                    applied = False
+                if applied and self._dedup is not None:
+                    self._dedup.applied(message, peeked, applying - started)
+                self._metrics._frame(
+                    decoded, applying - started, time.perf_counter_ns() - applying
+                )
+            return decoded
+
+    def _connect(self, api_url: str) -> ClientConnection:
+        return connect(api_url)
+
+    def _apply(self, server_message: websocket_api.ServerMessage):
+        _, message = betterproto.which_one_of(server_message, "message")
+        if isinstance(message, websocket_api.RequestFailed):
+            if self._state._initializing and not self._is_awaited(
+                server_message.request_id
+            ):
+                self._init_error = RuntimeError(
+                    f"{message.request_details.kind} request failed during initialization: {message.error_details.message}"
+                )
+                logger.error("%s", self._init_error)
+            if self.throttle is not None:
+                self.throttle._rate_limited(message)
+        self._state._update(server_message)
+        self.events._dispatch(server_message, self._state.books)
+        self._state_changed.notify_all()
+
+    def _check_not_dispatching(self):
+        if self.events.dispatching:
+            raise RuntimeError(
+                "Can't wait for a response from inside an event callback, use send()"
+            )
+
+    def _check_initialized(self):
+        if self._init_error is not None:
+            raise self._init_error
+
+    def _wait_until(self, ready: Callable[[], bool], timeout: Optional[float]):
+        """
+        Receive until `ready()`, or wait for the receiver thread to get there.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if self._receiver is None:
+            while True:
+                self._check_initialized()
+                if ready():
+                    return
+                self.recv(None if deadline is None else deadline - time.monotonic())
+        with self._state_changed:
+            while True:
+                self._check_initialized()
+                if ready():
+                    return
+                if not self._receiver.is_alive():
+                    raise ConnectionError("The background receiver thread has stopped")
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if not self._state_changed.wait(remaining):
+                    raise TimeoutError
+
+    def _summarize_metrics(self) -> Tuple[str, Dict]:
+        with self.state_lock:
+            return self._metrics.format(), self._metrics.summary()
+
+    def _is_awaited(self, request_id: str) -> bool:
+        return bool(request_id) and (
+            request_id in self._pending or request_id in self._awaiting
+        )
+
+    def _expect_response(
+        self, request_id: str
+    ) -> "Future[websocket_api.ServerMessage]":
+        """
+        Register interest in the response to a request before sending it,
+        so the receiver thread can't race past it.
+        """
+        future: "Future[websocket_api.ServerMessage]" = Future()
+        self._pending[request_id] = future
+        if self._receiver is not None and not self._receiver.is_alive():
+            self._pending.pop(request_id, None)
+            raise ConnectionError("The background receiver thread has stopped")
+        return future
+
+    def _receive_forever(self):
+        """
+        Body of the background receiver thread.
+        """
+        error: BaseException
+        try:
+            while True:
+                server_message = self._recv()
+                future = self._pending.pop(server_message.request_id, None)
+                if future is not None:
+                    future.set_result(server_message)
+        except ConnectionClosed as e:
+            error = e
+        except Exception as e:
+            logger.exception("Error in the receiver thread")
+            error = e
+        for request_id in list(self._pending):
+            future = self._pending.pop(request_id, None)
+            if future is not None:
+                future.set_exception(error)
 
     def send(self, message: websocket_api.ClientMessage):
         """
-        Send a message to the server.
+        Send a message to the server, first waiting for the throttle if it's enabled.
         """
-        self._ws.send(bytes(message))
+        if self.throttle is not None:
+            delay = self.throttle.reserve(message)
+            if delay:
+                time.sleep(delay)
+        if self._is_awaited(message.request_id):
+            self._metrics._sent(message)
+        if betterproto.which_one_of(message, "message")[0] == "act_as":
+            with self.state_lock:
+                self._state._act_as_sent()
+        frame = self._codec.encode(message)
+        if self._recorder is not None:
+            self._recorder.record(SENT, frame)
+        self._ws.send(frame)
 
     def __enter__(self):
         return self
@@ -199,90 +638,411 @@ class TradingClient:
             self.close(CloseCode.INTERNAL_ERROR)
 
 
+@dataclass
+class InitTimings:
+    """
+    When each part of the initial data arrived, in seconds since connecting started.
+    """
+
+    started: float = field(default_factory=time.perf_counter)
+    steps: List[Tuple[str, float]] = field(default_factory=list)
+    markets: Dict[int, float] = field(default_factory=dict)
+
+    @property
+    def total(self) -> float:
+        return self.steps[-1][1] if self.steps else 0.0
+
+    def breakdown(self) -> List[Tuple[str, float]]:
+        """
+        How long each step took after the previous one, in arrival order.
+        """
+        result = []
+        previous = 0.0
+        for name, elapsed in self.steps:
+            result.append((name, elapsed - previous))
+            previous = elapsed
+        return result
+
+    def _record(self, name: str, market_id: Optional[int] = None):
+        elapsed = time.perf_counter() - self.started
+        if market_id is not None:
+            name = f"{name} {market_id}"
+            self.markets[market_id] = elapsed
+        self.steps.append((name, elapsed))
+
+
+@dataclass
+class MarketDiff:
+    """
+    What changed in a market between the state and a fresh snapshot of it.
+    """
+
+    orders_added: int = 0
+    orders_removed: int = 0
+    orders_resized: int = 0
+    trades_added: int = 0
+    # The snapshot's trades didn't extend the ones we had, so they were replaced
+    trades_rebuilt: bool = False
+
+
+@dataclass
+class ResyncStats:
+    """
+    Replays of the public snapshot, which the server sends when this client falls
+    too far behind its broadcasts: `Users` after initialization, then every market.
+    The replayed markets are applied as diffs, totalled here.
+    """
+
+    count: int = 0
+    seconds: float = 0.0
+    last_seconds: float = 0.0
+    markets: int = 0
+    orders_added: int = 0
+    orders_removed: int = 0
+    orders_resized: int = 0
+    trades_added: int = 0
+    trades_rebuilt: int = 0
+    _started: Optional[float] = field(default=None, repr=False)
+    _waiting_for: Set[int] = field(default_factory=set, repr=False)
+
+    @property
+    def active(self) -> bool:
+        return self._started is not None
+
+    def _start(self, market_ids: Iterable[int]):
+        if self._started is not None:
+            self._finish()
+        self.count += 1
+        self._started = time.perf_counter()
+        self._waiting_for = set(market_ids)
+
+    def _market(self, market_id: int, diff: MarketDiff):
+        self.markets += 1
+        self.orders_added += diff.orders_added
+        self.orders_removed += diff.orders_removed
+        self.orders_resized += diff.orders_resized
+        self.trades_added += diff.trades_added
+        self.trades_rebuilt += diff.trades_rebuilt
+        self._waiting_for.discard(market_id)
+        if not self._waiting_for:
+            self._finish()
+
+    def _finish(self):
+        if self._started is None:
+            return
+        self.last_seconds = time.perf_counter() - self._started
+        self.seconds += self.last_seconds
+        self._started = None
+        self._waiting_for.clear()
+        logger.warning(
+            f"Fell behind the server and resynced ({self.count} so far),"
+            f" took {self.last_seconds:.3f}s"
+        )
+
+
 @dataclass
 class State:
     """
     Aggregated state from the server
+
+    `books` holds the resting orders of each market as an `OrderBook`, kept up to
+    date incrementally; `markets[id].orders` is a live, read-only `OrdersView` of
+    the same orders (a `Sequence`, not a list).
+    Every resting order is also indexed by id across markets, see `find_order`, and
+    each book indexes the orders of the user we act as by side and price.
+
+    Users, payments and ownerships are kept in dicts keyed by id (bot id for
+    ownerships); `users`, `payments` and `ownerships` are snapshots of them as new
+    lists, built on each access, so appending to one doesn't change the state.
+
+    With `columnar_trades`, each market's trades go into a `TradeStore` in
+    `trade_stores` and `Market.trades` is left empty.
+
+    A state restored from a snapshot has `staleness` set, see `snapshot.Staleness`.
+    `init_timings` records the arrival of each part of the initial data.
+
+    Fresh data for a market that is already in the state, as sent when the server
+    replays its snapshot to a client that fell behind, is applied as a diff against
+    the current book and trades; `resyncs` counts these replays.
     """
 
     _initializing: bool = True
     acting_as: websocket_api.ActingAs = field(default_factory=websocket_api.ActingAs)
     portfolio: websocket_api.Portfolio = field(default_factory=websocket_api.Portfolio)
-    payments: List[websocket_api.Payment] = field(default_factory=list)
-    ownerships: List[websocket_api.Ownership] = field(default_factory=list)
-    users: List[websocket_api.User] = field(default_factory=list)
+    payments_by_id: Dict[int, websocket_api.Payment] = field(default_factory=dict)
+    ownerships_by_bot_id: Dict[str, websocket_api.Ownership] = field(
+        default_factory=dict
+    )
+    users_by_id: Dict[str, websocket_api.User] = field(default_factory=dict)
     markets: Dict[int, websocket_api.Market] = field(default_factory=dict)
+    books: Dict[int, OrderBook] = field(default_factory=dict)
+    _order_index: OrderIndex = field(default_factory=dict, repr=False)
+    columnar_trades: bool = False
+    trade_stores: Dict[int, "TradeStore"] = field(default_factory=dict)
+    staleness: Optional[snapshot.Staleness] = None
+    init_timings: Optional[InitTimings] = None
+    resyncs: ResyncStats = field(default_factory=ResyncStats)
+    # Restored markets the server hasn't sent fresh data for yet
+    _unreconciled: Set[int] = field(default_factory=set, repr=False)
+    # An ActAs was sent and its ActingAs hasn't arrived
+    _switching_user: bool = field(default=False, repr=False)
+
+    @property
+    def payments(self) -> List[websocket_api.Payment]:
+        """
+        Read-only snapshot of `payments_by_id`, copied on each access.
+        """
+        return list(self.payments_by_id.values())
+
+    @property
+    def ownerships(self) -> List[websocket_api.Ownership]:
+        """
+        Read-only snapshot of `ownerships_by_bot_id`, copied on each access.
+        """
+        return list(self.ownerships_by_bot_id.values())
+
+    @property
+    def users(self) -> List[websocket_api.User]:
+        """
+        Read-only snapshot of `users_by_id`, copied on each access.
+        """
+        return list(self.users_by_id.values())
+
+    def save_snapshot(self, path: str):
+        """
+        Write the state to the directory `path`, see `snapshot.save`.
+        """
+        if self._initializing:
+            raise RuntimeError("Can't save a snapshot before initialization is done")
+        snapshot.save(self, path)
+
+    @classmethod
+    def load_snapshot(cls, path: str, *, columnar_trades: bool = False) -> "State":
+        """
+        Restore a state from a snapshot written by `save_snapshot`.
+        With `columnar_trades`, trade columns are memory-mapped from the snapshot.
+        """
+        state = cls(columnar_trades=columnar_trades)
+        snapshot.restore(state, path)
+        return state
+
+    def find_order(self, order_id: int) -> Optional[Tuple[int, websocket_api.Order]]:
+        """
+        Return (market id, order) for a resting order, or None if it isn't resting.
+        """
+        return self._order_index.get(order_id)
+
+    def _sync_market(self, book: OrderBook, market: websocket_api.Market) -> MarketDiff:
+        """
+        Apply a fresh snapshot of a market we already have as a diff, keeping the
+        book, the order index and the trade history rather than rebuilding them.
+        """
+        diff = MarketDiff(*book.sync(market.orders))
+        trades = market.trades
+        if self.columnar_trades:
+            store = self.trade_stores[market.id]
+            count = len(store)
+            last_id = int(store.ids[-1]) if count else None
+        else:
+            old_trades = self.markets[market.id].trades
+            count = len(old_trades)
+            last_id = old_trades[-1].id if count else None
+        if (
+            len(trades) >= count
+            and (count == 0 or trades[count - 1].id == last_id)
+            and self._same_parties(market.id, trades[:count])
+        ):
+            new_trades = trades[count:]
+            if self.columnar_trades:
+                store.extend(new_trades)
+            else:
+                old_trades.extend(new_trades)
+                market.trades = old_trades
+        else:
+            new_trades = trades
+            diff.trades_rebuilt = True
+            if self.columnar_trades:
+                from trade_store import TradeStore
+
+                self.trade_stores[market.id] = TradeStore(market.id, trades)
+        diff.trades_added = len(new_trades)
+        if self.columnar_trades:
+            market.trades = []
+        return diff
+
+    def _same_parties(self, market_id: int, trades: List[websocket_api.Trade]) -> bool:
+        """
+        Whether the trades we have for a market name the same buyers and sellers as
+        `trades`, which differ when the server starts or stops hiding user ids.
+        """
+        if self.columnar_trades:
+            return self.trade_stores[market_id].same_parties(trades)
+        parties = attrgetter("buyer_id", "seller_id")
+        old_trades = self.markets[market_id].trades
+        return list(map(parties, old_trades)) == list(map(parties, trades))
+
+    def _act_as_sent(self):
+        """
+        Note that we asked to act as another user, so the server's resend of the
+        public data that may come before `ActingAs` isn't taken for a resync.
+        """
+        self._switching_user = True
+
+    def _drop_market(self, market_id: int):
+        self.markets.pop(market_id, None)
+        if (book := self.books.pop(market_id, None)) is not None:
+            book.detach()
+        self.trade_stores.pop(market_id, None)
 
     def _update(self, server_message: websocket_api.ServerMessage):
         kind, message = betterproto.which_one_of(server_message, "message")
 
+        if self._initializing and self.init_timings is not None and kind:
+            if isinstance(message, websocket_api.Market):
+                self.init_timings._record(kind, message.id)
+            else:
+                self.init_timings._record(kind)
+
+        if self.resyncs.active and not isinstance(
+            message, (websocket_api.Users, websocket_api.Market)
+        ):
+            self.resyncs._finish()
+
         if isinstance(message, websocket_api.ActingAs):
             # ActingAs is always the last message in the initialization sequence
             self.acting_as = message
+            self._switching_user = False
+            for book in self.books.values():
+                book.set_owner(message.user_id)
             self._initializing = False
+            if self.staleness is not None and self.staleness.reconciled_at is None:
+                self.staleness.reconciled_at = time.time()
+                self._unreconciled.clear()
 
         elif isinstance(message, websocket_api.Portfolio):
             self.portfolio = message
 
         elif isinstance(message, websocket_api.Payments):
-            self.payments = message.payments
+            self.payments_by_id = {payment.id: payment for payment in message.payments}
 
         elif isinstance(message, websocket_api.Payment):
             assert kind == "payment_created"
-            if all(payment.id != message.id for payment in self.payments):
-                self.payments.append(message)
+            self.payments_by_id.setdefault(message.id, message)
 
         elif isinstance(message, websocket_api.Ownerships):
-            self.ownerships = message.ownerships
+            self.ownerships_by_bot_id = {
+                ownership.of_bot_id: ownership for ownership in message.ownerships
+            }
 
         elif isinstance(message, websocket_api.Ownership):
             assert kind == "ownership_received"
-            if all(
-                ownership.of_bot_id != message.of_bot_id
-                for ownership in self.ownerships
-            ):
-                self.ownerships.append(message)
+            self.ownerships_by_bot_id.setdefault(message.of_bot_id, message)
 
         elif isinstance(message, websocket_api.Users):
-            self.users = message.users
+            if not self._initializing and not self._switching_user:
+                # The server is replaying its snapshot because we fell behind
+                self.resyncs._start(self.markets)
+            self.users_by_id = {user.id: user for user in message.users}
 
         elif isinstance(message, websocket_api.User):
             assert kind == "user_created"
-            if all(user.id != message.id for user in self.users):
-                self.users.append(message)
+            self.users_by_id.setdefault(message.id, message)
 
         elif isinstance(message, websocket_api.Market):
+            book = self.books.get(message.id)
+            if book is not None:
+                diff = self._sync_market(book, message)
+                if message.id in self._unreconciled:
+                    self._unreconciled.discard(message.id)
+                    assert self.staleness is not None
+                    self.staleness._reconcile_market(diff)
+                if self.resyncs.active:
+                    self.resyncs._market(message.id, diff)
+            else:
+                if self.staleness is not None and self.staleness.reconciled_at is None:
+                    self.staleness.markets_added += 1
+                book = self.books[message.id] = OrderBook(
+                    message.orders,
+                    market_id=message.id,
+                    index=self._order_index,
+                    owner_id=self.acting_as.user_id,
+                )
+                if self.columnar_trades:
+                    from trade_store import TradeStore
+
+                    self.trade_stores[message.id] = TradeStore(
+                        message.id, message.trades
+                    )
+                    message.trades = []
+            message.orders = book.orders
             self.markets[message.id] = message
 
+        elif isinstance(message, websocket_api.RequestFailed):
+            if message.request_details.kind == "ActAs":
+                self._switching_user = False
+
         elif isinstance(message, websocket_api.MarketSettled):
             self.markets[message.id].closed = websocket_api.MarketClosed(
                 settle_price=message.settle_price
             )
 
         elif isinstance(message, websocket_api.OrderCancelled):
-            self.markets[message.market_id].orders = [
-                order
-                for order in self.markets[message.market_id].orders
-                if order.id != message.id
-            ]
+            self.books[message.market_id].remove(message.id)
 
         elif isinstance(message, websocket_api.OrderCreated):
-            orders = self.markets[message.market_id].orders
+            book = self.books[message.market_id]
             if message.order.id:
-                orders.append(message.order)
-            if message.fills:
-                for order in orders:
-                    if fill := next(
-                        (fill for fill in message.fills if fill.id == order.id),
-                        None,
-                    ):
-                        order.size = fill.size_remaining
-                self.markets[message.market_id].orders = [
-                    order for order in orders if float(order.size) > 0
-                ]
+                book.add(message.order)
+            # Each fill is a hash lookup in the book's id index; fully filled
+            # orders are dropped from their level without touching the rest.
+            for fill in message.fills:
+                book.fill(fill.id, fill.size_remaining)
             if message.trades:
-                self.markets[message.market_id].trades.extend(message.trades)
+                if self.columnar_trades:
+                    self.trade_stores[message.market_id].extend(message.trades)
+                else:
+                    self.markets[message.market_id].trades.extend(message.trades)
 
 
 class RequestFailed(Exception):
     pass
+
+
+def _request_failed(
+    server_message: websocket_api.ServerMessage,
+) -> Optional[RequestFailed]:
+    _, message = betterproto.which_one_of(server_message, "message")
+    if isinstance(message, websocket_api.RequestFailed):
+        return RequestFailed(
+            f"{message.request_details.kind} request failed: {message.error_details.message}"
+        )
+    return None
+
+
+def _check_response(
+    server_message: websocket_api.ServerMessage,
+) -> websocket_api.ServerMessage:
+    if error := _request_failed(server_message):
+        raise error
+    return server_message
+
+
+def _response_or_error(
+    server_message: websocket_api.ServerMessage, raise_on_failure: bool
+) -> Union[websocket_api.ServerMessage, RequestFailed]:
+    if error := _request_failed(server_message):
+        if raise_on_failure:
+            raise error
+        return error
+    return server_message
+
+
+def quantize(value: float, name: str) -> float:
+    """
+    Round a price, size or amount to the 2 decimal places the exchange accepts,
+    warning if that changed it meaningfully.
+    """
+    quantized = round(value, 2)
+    if abs(quantized - value) > 1e-4:
+        logger.warning(f"{name} {value} quantized to {quantized}")
+    return quantized